@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+u"""Pack large numeric arrays in plot responses
+
+As JSON float text, a 500x500 histogram takes megabytes. Clients that
+send ``X-Sirepo-Arrays: float32`` get the values of cfg.keys which are
+float arrays of at least cfg.min_elements values replaced by::
+
+    {"_sirepoArray": "float32", "shape": [500, 500], "data": "<base64>"}
+
+``data`` holds the little endian float32 values in row major order.
+sirepo.js decodes it into a Float32Array, or into a list of
+Float32Array rows for a matrix. Other keys, e.g. axis points, and
+integer arrays are unchanged so only add keys whose consumers accept
+Float32Arrays and float32 precision.
+
+Packing loses precision, so sirepo.js only asks for it if cfg.client
+is set (sent to the client as ``arrayEncoding`` in the schema).
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import base64
+import numbers
+import numpy
+
+#: Request header a client sends to receive packed arrays
+HEADER = 'X-Sirepo-Arrays'
+
+#: Only supported value of HEADER
+FORMAT = 'float32'
+
+#: Key identifying a packed array
+_MARKER = '_sirepoArray'
+
+#: configuration
+cfg = None
+
+
+def encode(value):
+    """Copy value with large float arrays in cfg.keys packed
+
+    Args:
+        value (object): response (dict, list, etc.)
+    Returns:
+        object: value with arrays replaced
+    """
+    if isinstance(value, dict):
+        res = {}
+        for k, v in value.items():
+            a = _float_array(v) if k in cfg.keys else None
+            res[k] = encode(v) if a is None else pack(a)
+        return res
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+
+def is_requested(request):
+    """Did the client ask for packed arrays?
+
+    Args:
+        request (flask.Request): incoming request
+    Returns:
+        bool: True if HEADER is FORMAT
+    """
+    return request.headers.get(HEADER) == FORMAT
+
+
+def pack(array):
+    """Pack a numeric array
+
+    Args:
+        array (numpy.ndarray): values
+    Returns:
+        dict: packed array
+    """
+    return {
+        _MARKER: FORMAT,
+        'data': base64.b64encode(array.astype('<f4').tobytes()).decode('ascii'),
+        'shape': list(array.shape),
+    }
+
+
+def _cfg_keys(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return tuple(k for k in value.split(':') if k)
+
+
+def _float_array(value):
+    """Float array for value if it is large enough to pack
+
+    Only looks at the first element before converting so lists of
+    strings, models, etc. are rejected quickly.
+
+    Args:
+        value (object): list, tuple, or numpy.ndarray
+    Returns:
+        numpy.ndarray: values or None
+    """
+    if not isinstance(value, (list, tuple, numpy.ndarray)):
+        return None
+    if isinstance(value, numpy.ndarray):
+        a = value
+    else:
+        if not value:
+            return None
+        n = len(value)
+        f = value[0]
+        if isinstance(f, (list, tuple)):
+            n *= len(f)
+            f = f[0] if f else None
+        if n < cfg.min_elements or not isinstance(f, numbers.Real) \
+            or isinstance(f, numbers.Integral):
+            return None
+        try:
+            a = numpy.asarray(value)
+        except ValueError:
+            # ragged
+            return None
+    if a.size < cfg.min_elements or a.dtype.kind != 'f':
+        return None
+    return a
+
+
+cfg = pkconfig.init(
+    client=(False, bool, 'Have sirepo.js ask for packed arrays (float32 loses precision)'),
+    keys=(('z_matrix',), _cfg_keys, 'colon separated keys whose float arrays may be packed'),
+    min_elements=(256, int, 'Smallest float array to pack'),
+)
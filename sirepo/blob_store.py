@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+u"""Content addressed store for library files
+
+Library files (predefined mirrors, magnetic measurements, uploads, etc.)
+are stored once under ``<db_dir>/blob`` keyed by their SHA-256 and hard
+linked into each user's lib directory. The link count of a blob is its
+reference count, which `gc` uses to remove blobs no user references.
+
+Blobs are immutable (read-only) so lib files must be replaced, not
+written in place (see `sirepo.simulation_db.replace_lib_file`).
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import errno
+import hashlib
+import os
+import random
+import shutil
+import threading
+import time
+
+#: where blobs live under db_dir
+_BLOB_DIR = 'blob'
+
+#: Don't collect blobs linked or unlinked recently (avoids racing with `link`)
+_GC_MIN_AGE = 3600
+
+#: Errors from os.link which mean a hard link isn't possible
+_NO_LINK_ERRNOS = (errno.EXDEV, errno.EPERM, errno.EMLINK)
+
+#: Times `link` interns again when `gc` removed the blob meanwhile
+_LINK_TRIES = 3
+
+#: Avoids hashing unchanged files (e.g. resource files) more than once
+_hash_cache = {}
+
+#: Locking for _hash_cache
+_hash_lock = threading.Lock()
+
+
+def digest(path):
+    """SHA-256 of the file contents, cached by inode, mtime, and size
+
+    Args:
+        path (py.path): file to hash
+    Returns:
+        str: hex digest
+    """
+    s = os.stat(str(path))
+    k = (s.st_dev, s.st_ino, s.st_mtime, s.st_size)
+    with _hash_lock:
+        res = _hash_cache.get(k)
+    if res:
+        return res
+    h = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for c in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(c)
+    res = h.hexdigest()
+    with _hash_lock:
+        _hash_cache[k] = res
+    return res
+
+
+def gc(min_age=_GC_MIN_AGE, orphans=None):
+    """Remove blobs which are not linked from any lib directory
+
+    Args:
+        min_age (int): seconds since last link change to be considered
+        orphans (set): (st_dev, st_ino) of files the caller unlinked,
+            e.g. a purge, which are removed regardless of min_age [None]
+
+    Returns:
+        int, int: blobs removed, bytes reclaimed
+    """
+    count = 0
+    size = 0
+    now = time.time()
+    for p in pkio.sorted_glob(_root().join('*', '*')):
+        try:
+            s = os.stat(str(p))
+            if s.st_nlink > 1:
+                continue
+            # ctime changes when the link count changes
+            if now - s.st_ctime < min_age \
+                and not (orphans and (s.st_dev, s.st_ino) in orphans):
+                continue
+            os.remove(str(p))
+            count += 1
+            size += s.st_size
+        except OSError as e:
+            pkdlog('{}: gc error: {}', p, e)
+    return count, size
+
+
+def link(src, dst):
+    """Replace dst with a hard link to the blob containing src
+
+    If a link is not possible, dst is a copy of src. src may be
+    the same as dst, which moves dst into the store.
+
+    Args:
+        src (py.path): file to store
+        dst (py.path): file to replace
+    """
+    pkio.mkdir_parent_only(dst)
+    t = _tmp(dst)
+    try:
+        for i in range(_LINK_TRIES):
+            b = _intern(src)
+            try:
+                os.link(str(b), str(t))
+                break
+            except OSError as e:
+                if e.errno == errno.ENOENT and i < _LINK_TRIES - 1:
+                    # gc removed the blob after _intern found it
+                    continue
+                if e.errno not in _NO_LINK_ERRNOS:
+                    raise
+                shutil.copy2(str(src), str(t))
+                break
+        os.rename(str(t), str(dst))
+    finally:
+        pkio.unchecked_remove(t)
+
+
+def _intern(path):
+    """Add path's contents to the store if not already there
+
+    Args:
+        path (py.path): file to store
+    Returns:
+        py.path: blob
+    """
+    h = digest(path)
+    res = _root().join(h[:2], h)
+    if res.check(file=True):
+        return res
+    pkio.mkdir_parent_only(res)
+    t = _tmp(res)
+    try:
+        # preserve mtime, because it is used in cache keys of reports
+        shutil.copy2(str(path), str(t))
+        os.chmod(str(t), 0o444)
+        try:
+            # link, not rename, so an existing blob is never replaced
+            os.link(str(t), str(res))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    finally:
+        pkio.unchecked_remove(t)
+    return res
+
+
+def _root():
+    from sirepo import simulation_db
+
+    return simulation_db.db_dir().join(_BLOB_DIR)
+
+
+def _tmp(path):
+    return path.dirpath().join('.{}.{}'.format(path.basename, random.random()))
@@ -16,6 +16,7 @@ from pykern import pksubprocess
 from pykern.pkdebug import pkdc, pkdexc, pkdp
 from sirepo.template import template_common
 import py.path
+import time
 
 
 celery = Celery('sirepo')
@@ -60,37 +61,60 @@ celery.conf.update(
 #    )
 #fi
 
-#: List of queues is indexed by "is_parallel"
-QUEUE_NAMES = ('sequential', 'parallel')
-
-
-def queue_name(is_parallel):
-    """Which queue to execute in
-
-    Args:
-        is_parallel (bool): is it a parallel job?
-
-    Returns:
-        str: name of queue to route task
-    """
-    return QUEUE_NAMES[int(bool(is_parallel))]
+#: Queues routed by `sirepo.simulation_db.celery_queue`. Deployments
+#: which only consume ``sequential,parallel`` must add ``fast,heavy``
+#: to their workers' ``--queue`` before enabling
+#: ``SIREPO_SIMULATION_DB_COST_FAST_MAX`` or ``..._COST_HEAVY_MIN``.
+QUEUE_NAMES = ('fast', 'sequential', 'heavy', 'parallel')
 
 
 @celery.task
-def start_simulation(cmd, run_dir):
+def start_simulation(cmd, run_dir, metrics_log=None):
     """Call simulation's in run_background with run_dir
 
     Args:
         cmd (list): simulation command line
         run_dir (str): directory
+        metrics_log (str): `sirepo.job_metrics.log_path` [None]
     """
     # Avoid circular import
+    from sirepo import job_metrics
     from sirepo import simulation_db
+    import resource
+
     run_dir = py.path.local(run_dir)
     simulation_db.hack_nfs_write_status('running', run_dir)
-    with pkio.save_chdir(run_dir):
-        pksubprocess.check_call_with_signals(
-            cmd,
-            msg=pkdp,
-            output=str(run_dir.join(template_common.RUN_LOG)),
-        )
+    start = time.time()
+    prev = resource.getrusage(resource.RUSAGE_CHILDREN)
+    rc = 1
+    try:
+        with pkio.save_chdir(run_dir):
+            pksubprocess.check_call_with_signals(
+                cmd,
+                msg=pkdp,
+                output=str(run_dir.join(template_common.RUN_LOG)),
+            )
+        rc = 0
+    finally:
+        job_metrics.record(metrics_log, run_dir, start, rc, _rusage_delta(prev))
+
+
+def _rusage_delta(prev):
+    """Resources used by children since prev
+
+    The worker runs jobs one after another, so the CPU is the difference.
+    ru_maxrss is the largest of any child, so it is an upper bound.
+
+    Args:
+        prev (resource.struct_rusage): before the job
+    Returns:
+        Dict: ru_utime, ru_stime, ru_maxrss
+    """
+    import resource
+
+    r = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return pkcollections.Dict(
+        ru_maxrss=r.ru_maxrss,
+        ru_stime=r.ru_stime - prev.ru_stime,
+        ru_utime=r.ru_utime - prev.ru_utime,
+    )
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+u"""Cross-process locks on users and simulations
+
+Locks are `fcntl.flock` on files in ``<db_dir>/lock`` so they exclude
+threads in this process (each acquisition opens its own file) as well
+as other uwsgi workers and pkcli commands. Locks are reentrant within a
+thread.
+
+To avoid deadlocks, always acquire a `user` lock before a `simulation`
+lock. Creating an app's examples (`sirepo.simulation_db.simulation_dir`)
+takes the user lock so make sure the app directory exists before taking
+a simulation lock.
+
+Lock files are removed with the simulation or user (see `remove`). A
+lock acquired on a file which was removed meanwhile is retried on a new
+file.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkconfig
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import errno
+import fcntl
+import os
+import threading
+import time
+
+#: where lock files live under db_dir
+_LOCK_DIR = 'lock'
+
+#: How often to retry a contended lock
+_POLL_SECONDS = 0.05
+
+#: Log waits longer than this
+_SLOW_WAIT_SECONDS = 1.0
+
+#: Locks held by this thread: path to [fd, count]
+_local = threading.local()
+
+#: Contention metrics by kind (see `stats`)
+_stats = pkcollections.Dict()
+
+#: Locking for _stats
+_stats_lock = threading.Lock()
+
+#: configuration
+cfg = None
+
+
+class Timeout(Exception):
+    """Lock was not acquired within cfg.timeout"""
+    pass
+
+
+def remove(kind, key):
+    """Remove the lock file of a deleted simulation or user
+
+    Call while holding the lock (or when nothing can use key).
+
+    Args:
+        kind (str): 'simulation' or 'user'
+        key (str): sid or uid
+    """
+    pkio.unchecked_remove(_path(kind, key))
+
+
+def simulation(sid, timeout=None):
+    """Lock a simulation's data file and run directories
+
+    Args:
+        sid (str): simulation id
+        timeout (float): seconds to wait [cfg.timeout]
+    Returns:
+        object: context manager
+    """
+    return _Lock('simulation', sid, timeout)
+
+
+def stats():
+    """Contention metrics for each kind of lock
+
+    Returns:
+        Dict: kind to acquired, contended, timeouts, wait_seconds, max_wait_seconds
+    """
+    with _stats_lock:
+        return pkcollections.Dict(
+            (k, pkcollections.Dict(v)) for k, v in _stats.items()
+        )
+
+
+def user(uid, timeout=None):
+    """Lock a user's directory, e.g. for name uniqueness and indexes
+
+    Args:
+        uid (str): user id
+        timeout (float): seconds to wait [cfg.timeout]
+    Returns:
+        object: context manager
+    """
+    return _Lock('user', uid, timeout)
+
+
+class _Lock(object):
+
+    def __init__(self, kind, key, timeout):
+        assert key, \
+            '{}: lock key must not be empty'.format(kind)
+        self.kind = kind
+        self.path = _path(kind, key)
+        self.timeout = cfg.timeout if timeout is None else timeout
+
+    def __enter__(self):
+        h = _held()
+        if self.path in h:
+            h[self.path][1] += 1
+            return self
+        start = time.time()
+        contended = False
+        fd = None
+        try:
+            while True:
+                if fd is None:
+                    pkio.mkdir_parent_only(self.path)
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if _is_current(fd, self.path):
+                        break
+                    # removed (see remove) while we waited
+                    os.close(fd)
+                    fd = None
+                    continue
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                contended = True
+                if time.time() - start >= self.timeout:
+                    self._record(contended, time.time() - start, timed_out=True)
+                    raise Timeout('{}: lock timeout after {}s'.format(self.path, self.timeout))
+                time.sleep(_POLL_SECONDS)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            raise
+        self._record(contended, time.time() - start)
+        h[self.path] = [fd, 1]
+        return self
+
+    def __exit__(self, *args):
+        h = _held()
+        x = h[self.path]
+        x[1] -= 1
+        if x[1] > 0:
+            return False
+        del h[self.path]
+        try:
+            fcntl.flock(x[0], fcntl.LOCK_UN)
+        finally:
+            os.close(x[0])
+        return False
+
+    def _record(self, contended, wait, timed_out=False):
+        with _stats_lock:
+            s = _stats.get(self.kind)
+            if not s:
+                s = _stats[self.kind] = pkcollections.Dict(
+                    acquired=0,
+                    contended=0,
+                    max_wait_seconds=0.0,
+                    timeouts=0,
+                    wait_seconds=0.0,
+                )
+            if timed_out:
+                s.timeouts += 1
+            else:
+                s.acquired += 1
+            if contended:
+                s.contended += 1
+                s.wait_seconds += wait
+                s.max_wait_seconds = max(s.max_wait_seconds, wait)
+        if wait >= _SLOW_WAIT_SECONDS:
+            pkdlog('{}: waited {:.2f}s timed_out={}', self.path, wait, timed_out)
+
+
+def _held():
+    try:
+        return _local.held
+    except AttributeError:
+        _local.held = {}
+        return _local.held
+
+
+def _is_current(fd, path):
+    """Is fd still the file at path?"""
+    try:
+        s = os.stat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return False
+        raise
+    f = os.fstat(fd)
+    return (s.st_dev, s.st_ino) == (f.st_dev, f.st_ino)
+
+
+def _path(kind, key):
+    from sirepo import simulation_db
+
+    return str(simulation_db.db_dir().join(_LOCK_DIR, kind, key))
+
+
+cfg = pkconfig.init(
+    timeout=(60.0, float, 'seconds to wait for a user or simulation lock'),
+)
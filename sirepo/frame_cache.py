@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+u"""Serialized animation frames kept on disk
+
+`sirepo.server.api_simulationFrame` saves the json of each frame in
+``<run_dir>/frame-cache`` keyed by the frame id, which includes the
+startTime of the run. Entries go away with the run dir when the
+simulation is rerun.
+
+A symlink to each entry in ``<db_dir>/frame_cache`` lets any process
+evict entries least recently used when the total exceeds
+cfg.max_bytes.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import errno
+import hashlib
+import os
+import random
+import threading
+
+#: Subdirectory of run_dir containing entries
+_ENTRY_DIR = 'frame-cache'
+
+#: Links to entries under db_dir
+_INDEX_DIR = 'frame_cache'
+
+#: Evict after this fraction of cfg.max_bytes has been added
+_EVICT_FRACTION = 0.1
+
+#: Bytes added by this process since the last eviction
+_added = 0
+
+#: mutex for _added and evictions in this process
+_lock = threading.Lock()
+
+#: configuration
+cfg = None
+
+
+def get(run_dir, frame_id):
+    """Serialized frame if it has been saved
+
+    Args:
+        run_dir (py.path): report's run dir
+        frame_id (str): from the request
+    Returns:
+        bytes: json or None
+    """
+    if not cfg.max_bytes:
+        return None
+    p = str(_entry(run_dir, frame_id))
+    try:
+        with open(p, 'rb') as f:
+            res = f.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    try:
+        os.utime(p, None)
+    except OSError:
+        # evicted
+        pass
+    pkdc('{}: hit', p)
+    return res
+
+
+def put(run_dir, frame_id, value):
+    """Save the serialized frame
+
+    Args:
+        run_dir (py.path): report's run dir
+        frame_id (str): from the request
+        value (str): json
+    """
+    global _added
+
+    if not cfg.max_bytes or not run_dir.check(dir=True):
+        return
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    e = _entry(run_dir, frame_id)
+    pkio.mkdir_parent_only(e)
+    t = '{}.{}'.format(e, random.random())
+    try:
+        with open(t, 'wb') as f:
+            f.write(value)
+        os.rename(t, str(e))
+    finally:
+        pkio.unchecked_remove(t)
+    i = _index_dir()
+    pkio.mkdir_parent(i)
+    try:
+        os.symlink(str(e), str(i.join(_digest(str(e)))))
+    except OSError as x:
+        if x.errno != errno.EEXIST:
+            raise
+    with _lock:
+        _added += len(value)
+        if _added < cfg.max_bytes * _EVICT_FRACTION:
+            return
+        _added = 0
+        _evict()
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def _entry(run_dir, frame_id):
+    return run_dir.join(_ENTRY_DIR, _digest(frame_id) + '.json')
+
+
+def _evict():
+    """Remove least recently used entries over cfg.max_bytes"""
+    entries = []
+    total = 0
+    for l in pkio.sorted_glob(_index_dir().join('*')):
+        try:
+            s = os.stat(str(l))
+        except OSError:
+            # run dir removed
+            pkio.unchecked_remove(l)
+            continue
+        entries.append((s.st_mtime, s.st_size, l))
+        total += s.st_size
+    entries.sort()
+    while total > cfg.max_bytes and entries:
+        _, s, l = entries.pop(0)
+        try:
+            os.remove(os.readlink(str(l)))
+        except OSError:
+            pass
+        pkio.unchecked_remove(l)
+        total -= s
+    pkdc('frame cache bytes={}', total)
+
+
+def _index_dir():
+    from sirepo import simulation_db
+
+    return simulation_db.db_dir().join(_INDEX_DIR)
+
+
+cfg = pkconfig.init(
+    max_bytes=(512 * 1024 * 1024, int, 'Bytes of serialized frames to keep (0 disables)'),
+)
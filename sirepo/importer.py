@@ -102,5 +102,5 @@ def read_zip(stream, template=None):
     lib_d = simulation_db.simulation_lib_dir(template.SIM_TYPE)
     for b, src in zipped.items():
         if b in needed:
-            src.copy(needed[b])
+            src.copy(simulation_db.replace_lib_file(needed[b]))
     return data
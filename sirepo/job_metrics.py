@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+u"""Resource usage of jobs
+
+Whichever process reaps a job (`sirepo.runner`, `sirepo.zygote`, or a
+Celery worker) appends a json line to ``<db_dir>/job-metrics.log``
+with the enqueue, start, and end times, exit status, CPU seconds, peak
+RSS, cores, and output bytes tagged by simulation type and report.
+
+`summary` aggregates the log for `sirepo.server.api_jobMetrics` (if enabled)
+(Prometheus text format) and ``sirepo admin job_stats``.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import json
+import os
+import re
+import threading
+import time
+
+#: Metrics log under db_dir
+LOG_FILE = 'job-metrics.log'
+
+#: Prometheus metric suffix, type, and help for each total (see `_add`)
+_PROMETHEUS = (
+    ('jobs', 'jobs_total', 'counter', 'Jobs which ended'),
+    ('errors', 'errors_total', 'counter', 'Jobs which exited with non-zero status'),
+    ('queue_seconds', 'queue_seconds_total', 'counter', 'Seconds between enqueue and start'),
+    ('run_seconds', 'run_seconds_total', 'counter', 'Seconds between start and end'),
+    ('max_run_seconds', 'run_seconds_max', 'gauge', 'Longest run'),
+    ('cpu_seconds', 'cpu_seconds_total', 'counter', 'User and system CPU seconds'),
+    ('core_seconds', 'core_seconds_total', 'counter', 'Cores times run seconds'),
+    ('max_rss_bytes', 'rss_bytes_max', 'gauge', 'Largest peak resident set size'),
+    ('output_bytes', 'output_bytes_total', 'counter', 'Bytes in run directories at end'),
+)
+
+#: Strip so watchpointReport12 aggregates with other watchpoints
+_REPORT_NUMBER_RE = re.compile(r'\d+$')
+
+#: Totals of the whole log, updated incrementally (see `summary`)
+_totals = pkcollections.Dict(offset=0, stats={})
+
+#: mutex for _totals
+_totals_lock = threading.Lock()
+
+
+def log_path():
+    """Where jobs record metrics (server only)
+
+    Returns:
+        py.path: log file
+    """
+    from sirepo import simulation_db
+
+    return simulation_db.db_dir().join(LOG_FILE)
+
+
+def prometheus_text():
+    """Totals in Prometheus text exposition format
+
+    Returns:
+        str: metrics labeled by sim_type and report
+    """
+    s = summary()
+    res = []
+    for f, n, t, h in _PROMETHEUS:
+        n = 'sirepo_job_' + n
+        res.append('# HELP {} {}'.format(n, h))
+        res.append('# TYPE {} {}'.format(n, t))
+        for k in sorted(s.keys()):
+            res.append('{}{{report="{}",sim_type="{}"}} {}'.format(n, k[1], k[0], s[k][f]))
+    return '\n'.join(res) + '\n'
+
+
+def record(log, run_dir, started, returncode, rusage):
+    """Append the metrics of a finished job to log
+
+    Doesn't raise so errors don't interfere with reaping.
+
+    Args:
+        log (str): `log_path` (None means don't record)
+        run_dir (py.path): job's directory
+        started (float): when the process started
+        returncode (int): exit status (negative is signal)
+        rusage (resource.struct_rusage): of the process and its children
+    """
+    if not log:
+        return
+    try:
+        from sirepo import mpi
+        from sirepo import simulation_db
+
+        run_dir = pkio.py_path(run_dir)
+        i = simulation_db.read_json(run_dir.join(simulation_db.RUN_INFO_FILE))
+        m = pkcollections.Dict(
+            cores=mpi.cfg.cores if simulation_db.is_parallel(i) else 1,
+            cpuSeconds=rusage.ru_utime + rusage.ru_stime,
+            endTime=time.time(),
+            enqueueTime=i.startTime,
+            exitStatus=returncode,
+            jobId=i.jobId,
+            # kilobytes on Linux
+            maxRssBytes=rusage.ru_maxrss * 1024,
+            outputBytes=_output_bytes(run_dir),
+            report=i.report,
+            simulationType=i.simulationType,
+            startTime=started,
+        )
+        with open(str(log), 'a') as f:
+            f.write(json.dumps(m, sort_keys=True) + '\n')
+    except Exception:
+        pkdlog('{}: error: {}', run_dir, pkdexc())
+
+
+def returncode(status):
+    """Convert `os.wait4` status to `subprocess.Popen.returncode`
+
+    Args:
+        status (int): from wait
+    Returns:
+        int: exit code or negative signal
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def summary(since=None):
+    """Totals by simulation type and report
+
+    Args:
+        since (float): only jobs which ended after this time (None is all)
+    Returns:
+        dict: (sim_type, report) to Dict of totals
+    """
+    p = log_path()
+    if since is not None:
+        res = {}
+        with _open(p) as f:
+            for m in _read(f):
+                if m.endTime >= since:
+                    _add(res, m)
+        return res
+    with _totals_lock:
+        try:
+            if p.size() < _totals.offset:
+                # rotated
+                _totals.update(offset=0, stats={})
+        except Exception as e:
+            if not pkio.exception_is_not_found(e):
+                raise
+            return {}
+        with _open(p) as f:
+            f.seek(_totals.offset)
+            for m in _read(f):
+                _add(_totals.stats, m)
+            _totals.offset = f.tell()
+        return dict((k, pkcollections.Dict(v)) for k, v in _totals.stats.items())
+
+
+def _add(stats, m):
+    k = (m.simulationType, _REPORT_NUMBER_RE.sub('', m.report))
+    s = stats.get(k)
+    if not s:
+        s = stats[k] = pkcollections.Dict((x[0], 0) for x in _PROMETHEUS)
+    r = m.endTime - m.startTime
+    s.jobs += 1
+    if m.exitStatus:
+        s.errors += 1
+    s.queue_seconds += max(0, m.startTime - m.enqueueTime)
+    s.run_seconds += r
+    s.max_run_seconds = max(s.max_run_seconds, r)
+    s.cpu_seconds += m.cpuSeconds
+    s.core_seconds += m.cores * r
+    s.max_rss_bytes = max(s.max_rss_bytes, m.maxRssBytes)
+    s.output_bytes += m.outputBytes
+
+
+def _open(path):
+    try:
+        return open(str(path), 'rb')
+    except IOError as e:
+        if not pkio.exception_is_not_found(e):
+            raise
+    return open(os.devnull, 'rb')
+
+
+def _output_bytes(run_dir):
+    from sirepo import simulation_db
+    from sirepo.template import template_common
+
+    x = (
+        template_common.INPUT_BASE_NAME + simulation_db.JSON_SUFFIX,
+        simulation_db.RUN_INFO_FILE,
+    )
+    return sum(f.size() for f in pkio.walk_tree(run_dir) if f.basename not in x)
+
+
+def _read(f):
+    """Parse complete lines from the current position
+
+    Leaves f after the last complete line so a partial write is read
+    by the next call.
+    """
+    while True:
+        p = f.tell()
+        l = f.readline()
+        if not l.endswith(b'\n'):
+            f.seek(p)
+            return
+        try:
+            yield pkcollections.Dict(json.loads(l.decode('utf-8')))
+        except Exception as e:
+            pkdlog('{}: invalid metrics line: {}', l, e)
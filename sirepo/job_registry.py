@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+u"""Jobs known to all server processes
+
+The runners keep instances in class level dicts, which only the
+process which started a job can see. Each job is also recorded in a
+SQLite table in ``<db_dir>/job.db`` (cfg.path) so `sirepo.runner` can
+answer is_processing and kill for jobs started by other uwsgi workers.
+
+The database uses a rollback journal, because WAL needs shared memory,
+which doesn't work when db_dir is on NFS. Since all the processes
+which use the registry run on one host (pids are per host), cfg.path
+may be on local disk instead.
+
+A pid is stored with the start time of its process (see
+`process_exists`) so a pid reused by an unrelated process, e.g. after
+a restart, is not taken for the job. Records of processes which no
+longer exist on this host and records not updated for cfg.max_age
+(e.g. a Celery task whose server process died) are deleted (see
+`expire`).
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcollections
+from pykern import pkconfig
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import errno
+import socket
+import sqlite3
+import threading
+import time
+
+#: database file under db_dir
+_DB_FILE = 'job.db'
+
+#: How often `find` and `add` call `expire`
+_EXPIRE_SECONDS = 60
+
+#: Columns in job table (jid is the key)
+_COLUMNS = ('jid', 'host', 'pid', 'pid_start', 'task_id', 'queue', 'run_dir', 'state', 'created', 'updated')
+
+#: This host, compared to host column to know if pids are meaningful
+HOST = socket.gethostname()
+
+#: Connection per thread (sqlite3 connections can't be shared)
+_local = threading.local()
+
+#: When `expire` last ran in this process
+_last_expire = 0
+
+#: configuration
+cfg = None
+
+
+def add(jid, pid=None, task_id=None, queue=None, run_dir=None, state='running'):
+    """Record a job started (or queued) by this process
+
+    Replaces any existing record for jid.
+
+    Args:
+        jid (str): job id
+        pid (int): process id on this host
+        task_id (str): Celery task id
+        queue (str): queue name
+        run_dir (py.path): where the job runs
+        state (str): e.g. running or queued
+    """
+    _expire_maybe()
+    now = time.time()
+    _execute(
+        'INSERT OR REPLACE INTO job ({}) VALUES ({})'.format(
+            ', '.join(_COLUMNS),
+            ', '.join(['?'] * len(_COLUMNS)),
+        ),
+        (jid, HOST, pid, _process_start(pid), task_id, queue, run_dir and str(run_dir), state, now, now),
+    )
+
+
+def expire():
+    """Delete records of jobs which have exited or are too old
+
+    Returns:
+        int: records deleted
+    """
+    global _last_expire
+
+    _last_expire = time.time()
+    res = _execute(
+        'DELETE FROM job WHERE updated < ?',
+        (_last_expire - cfg.max_age,),
+    ).rowcount
+    for jid, pid, pid_start in _execute(
+        'SELECT jid, pid, pid_start FROM job WHERE host = ? AND pid IS NOT NULL',
+        (HOST,),
+    ).fetchall():
+        if pid_start is not None and _process_start(pid) == pid_start:
+            continue
+        remove(jid, pid=pid)
+        res += 1
+    if res:
+        pkdlog('{} expired job records', res)
+    return res
+
+
+def find(jid_prefix):
+    """Find jobs whose ids start with jid_prefix, e.g. a user's jobs
+
+    Args:
+        jid_prefix (str): start of job id
+    Returns:
+        list: records
+    """
+    _expire_maybe()
+    return [
+        pkcollections.Dict(zip(_COLUMNS, r)) for r in _execute(
+            'SELECT {} FROM job WHERE substr(jid, 1, ?) = ?'.format(', '.join(_COLUMNS)),
+            (len(jid_prefix), jid_prefix),
+        ).fetchall()
+    ]
+
+
+def get(jid):
+    """Find a job
+
+    Args:
+        jid (str): job id
+    Returns:
+        Dict: record or None
+    """
+    r = _execute(
+        'SELECT {} FROM job WHERE jid = ?'.format(', '.join(_COLUMNS)),
+        (jid,),
+    ).fetchone()
+    return pkcollections.Dict(zip(_COLUMNS, r)) if r else None
+
+
+def process_exists(record):
+    """Is the job's process running on this host?
+
+    The process must have the start time recorded with the pid.
+
+    Args:
+        record (Dict): from `get` or `find`
+    Returns:
+        bool: True if record.pid is the job's process
+    """
+    if not record.pid or record.host != HOST or record.pid_start is None:
+        return False
+    return _process_start(record.pid) == record.pid_start
+
+
+def remove(jid, pid=None, task_id=None):
+    """Forget a job, if it is still the same job
+
+    Args:
+        jid (str): job id
+        pid (int): only if pid matches
+        task_id (str): only if task_id matches
+    """
+    q = 'DELETE FROM job WHERE jid = ?'
+    a = [jid]
+    if pid is not None:
+        q += ' AND pid = ?'
+        a.append(pid)
+    if task_id is not None:
+        q += ' AND task_id = ?'
+        a.append(task_id)
+    _execute(q, a)
+
+
+def update(jid, **kwargs):
+    """Change columns of a job
+
+    Args:
+        jid (str): job id
+        kwargs (dict): columns to set
+    """
+    assert kwargs and all(k in _COLUMNS[1:] for k in kwargs), \
+        '{}: invalid columns'.format(kwargs)
+    kwargs['updated'] = time.time()
+    if 'pid' in kwargs:
+        kwargs['pid_start'] = _process_start(kwargs['pid'])
+    k = sorted(kwargs.keys())
+    _execute(
+        'UPDATE job SET {} WHERE jid = ?'.format(', '.join(x + ' = ?' for x in k)),
+        [kwargs[x] for x in k] + [jid],
+    )
+
+
+def _connection():
+    try:
+        return _local.connection
+    except AttributeError:
+        pass
+    from sirepo import simulation_db
+
+    c = sqlite3.connect(
+        cfg.path or str(simulation_db.db_dir().join(_DB_FILE)),
+        isolation_level=None,
+        timeout=30,
+    )
+    # WAL is not safe on NFS
+    c.execute('PRAGMA journal_mode=DELETE')
+    c.execute(
+        '''CREATE TABLE IF NOT EXISTS job (
+            jid TEXT PRIMARY KEY NOT NULL,
+            host TEXT NOT NULL,
+            pid INTEGER,
+            pid_start INTEGER,
+            task_id TEXT,
+            queue TEXT,
+            run_dir TEXT,
+            state TEXT NOT NULL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )''',
+    )
+    _local.connection = c
+    return c
+
+
+def _execute(query, args):
+    return _connection().execute(query, args)
+
+
+def _expire_maybe():
+    if time.time() - _last_expire >= _EXPIRE_SECONDS:
+        expire()
+
+
+def _process_start(pid):
+    """When the process started, which identifies it with pid
+
+    Args:
+        pid (int): process id on this host (may be None)
+    Returns:
+        int: clock ticks since boot or None if no such process
+    """
+    if not pid:
+        return None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            s = f.read()
+    except IOError as e:
+        if e.errno in (errno.ENOENT, errno.ESRCH):
+            return None
+        raise
+    # comm (2nd field) may contain spaces; starttime is the 22nd field
+    return int(s[s.rindex(')') + 2:].split()[19])
+
+
+cfg = pkconfig.init(
+    max_age=(7 * 86400, int, 'Seconds after its last update a record is deleted'),
+    path=(None, str, 'SQLite database file, e.g. on local disk [<db_dir>/job.db]'),
+)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+u"""JSON which accepts numpy values
+
+`dumps` and `iterencode` accept numpy arrays and scalars anywhere in
+the value so templates don't have to call ``tolist``. Float arrays have
+NaN and Inf replaced with 0 in one vectorized operation (see `finite`),
+which is what templates did value by value. Python floats which are
+not finite still raise ValueError.
+
+`iterencode` yields the top level of a dict one value at a time and
+large arrays in slices so a response doesn't have to hold the whole
+text. Each piece is encoded by the C encoder. Since an encoding error
+happens mid-response, only values which are `is_large` are streamed.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkcompat
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import json
+import numpy
+
+#: Values with this many elements are worth streaming (see `is_large`)
+_LARGE_ELEMENTS = 4 * 65536
+
+#: Elements of an array encoded at once by `iterencode`
+_SLICE_ELEMENTS = 65536
+
+
+class _Encoder(json.JSONEncoder):
+
+    def default(self, o):
+        if isinstance(o, numpy.ndarray):
+            return finite(o).tolist()
+        if isinstance(o, numpy.generic):
+            return finite(o).item()
+        return super(_Encoder, self).default(o)
+
+
+_COMPACT = _Encoder(allow_nan=False, separators=(',', ':'))
+
+_PRETTY = _Encoder(allow_nan=False, indent=4, separators=(',', ': '), sort_keys=True)
+
+
+def dumps(value, pretty=False):
+    """Encode value
+
+    Args:
+        value (object): may contain numpy values
+        pretty (bool): indent and sort keys [False]
+    Returns:
+        str: json
+    """
+    return (_PRETTY if pretty else _COMPACT).encode(value)
+
+
+def finite(values):
+    """Replace NaN and Inf with 0
+
+    Args:
+        values (object): numpy array or scalar, list, etc.
+    Returns:
+        numpy.ndarray: values (not copied if already finite or not floats)
+    """
+    a = numpy.asarray(values)
+    if a.dtype.kind == 'f':
+        f = numpy.isfinite(a)
+        if not f.all():
+            return numpy.where(f, a, 0)
+    return a
+
+
+def is_large(value):
+    """Does value have enough numbers to stream with `iterencode`?
+
+    Counts elements of arrays and lists, stopping at the threshold.
+
+    Args:
+        value (object): may contain numpy values
+    Returns:
+        bool: True if value should be streamed
+    """
+    return _elements(value, _LARGE_ELEMENTS) >= _LARGE_ELEMENTS
+
+
+def iterencode(value):
+    """Encode value in pieces
+
+    An error encoding a later piece occurs after earlier pieces have
+    been yielded, i.e. mid-response.
+
+    Args:
+        value (object): may contain numpy values
+    Returns:
+        generator: str pieces of compact json
+    """
+    if isinstance(value, dict) and all(pkcompat.isinstance_str(k) for k in value):
+        yield '{'
+        s = ''
+        for k, v in value.items():
+            yield s + _COMPACT.encode(k) + ':'
+            for x in iterencode(v):
+                yield x
+            s = ','
+        yield '}'
+    elif isinstance(value, numpy.ndarray) and value.ndim > 0 \
+        and value.size > _SLICE_ELEMENTS:
+        n = max(1, _SLICE_ELEMENTS * len(value) // value.size)
+        yield '['
+        for i in range(0, len(value), n):
+            # strip brackets of the slice
+            yield (',' if i else '') + _COMPACT.encode(value[i:i + n])[1:-1]
+        yield ']'
+    else:
+        yield _COMPACT.encode(value)
+
+
+def _elements(value, limit):
+    """Count scalars in value, stopping at limit"""
+    if isinstance(value, numpy.ndarray):
+        return value.size
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return 1
+    res = 0
+    for v in value:
+        res += _elements(v, limit - res)
+        if res >= limit:
+            break
+    return res
@@ -5,6 +5,10 @@ SIREPO.srdbg = console.log.bind(console);
 // No timeout for now (https://github.com/radiasoft/sirepo/issues/317)
 SIREPO.http_timeout = 0;
 
+// Ask for large heatmaps (z_matrix) as float32 (see sirepo.array_encoding); false for JSON numbers.
+// Lossy, so only set from the schema if the server is configured to offer it.
+SIREPO.ARRAY_ENCODING = false;
+
 var srlog = SIREPO.srlog;
 var srdbg = SIREPO.srdbg;
 
@@ -17,6 +21,7 @@ angular.element(document).ready(function() {
         },
         success: function(result) {
             SIREPO.APP_SCHEMA = result;
+            SIREPO.ARRAY_ENCODING = result.arrayEncoding || false;
             angular.bootstrap(document, ['SirepoApp']);
         },
         error: function(xhr, status, err) {
@@ -1194,6 +1199,38 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
     var IS_HTML_ERROR_RE = new RegExp('^(?:<html|<!doctype)', 'i');
     var HTML_TITLE_RE = new RegExp('>([^<]+)</', 'i');
 
+    // replaces arrays packed by sirepo.array_encoding with Float32Arrays.
+    // Only keys in array_encoding.cfg.keys are packed; their consumers must accept typed arrays.
+    function decodeArrays(value) {
+        if (! angular.isObject(value)) {
+            return value;
+        }
+        if (value._sirepoArray) {
+            var s = atob(value.data);
+            var bytes = new Uint8Array(s.length);
+            for (var i = 0; i < s.length; i++) {
+                bytes[i] = s.charCodeAt(i);
+            }
+            // little endian, same as the browsers sirepo supports
+            var a = new Float32Array(bytes.buffer);
+            if (value.shape.length < 2) {
+                return a;
+            }
+            var rows = [];
+            var n = a.length / value.shape[0];
+            for (var r = 0; r < value.shape[0]; r++) {
+                rows.push(a.subarray(r * n, (r + 1) * n));
+            }
+            return rows;
+        }
+        for (var k in value) {
+            if (value.hasOwnProperty(k)) {
+                value[k] = decodeArrays(value[k]);
+            }
+        }
+        return value;
+    }
+
     function logError(data, status) {
         if (status == 404) {
             self.localRedirect('notFound');
@@ -1351,6 +1388,9 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
         var interval, t;
         var timed_out = false;
         t = {timeout: timeout.promise};
+        if (SIREPO.ARRAY_ENCODING) {
+            t.headers = {'X-Sirepo-Arrays': SIREPO.ARRAY_ENCODING};
+        }
         if (SIREPO.http_timeout > 0) {
             interval = $interval(
                 function () {
@@ -1420,7 +1460,7 @@ SIREPO.app.factory('requestSender', function(errorService, localRoutes, $http, $
                 var data = response.data;
                 $interval.cancel(interval);
                 if (angular.isObject(data)) {
-                    successCallback(data, response.status);
+                    successCallback(decodeArrays(data), response.status);
                 }
                 else {
                     thisErrorCallback(data, response.status);
@@ -1497,12 +1537,29 @@ SIREPO.app.factory('simulationQueue', function($rootScope, $interval, requestSen
 
     function runItem(qi) {
         var handleStatus = function(qi, resp) {
+            if (resp.superseding) {
+                // server is stopping the job with the previous parameters
+                qi.interval = $interval(
+                    function () {
+                        requestSender.sendRequest(qi.firstRoute, process, qi.request, process);
+                    },
+                    Math.max(1, resp.nextRequestSeconds) * 1000,
+                    1
+                );
+                return;
+            }
             qi.request = resp.nextRequest;
+            // server holds the request until one of these changes
+            qi.request.lastStatus = {
+                frameCount: resp.frameCount,
+                percentComplete: resp.percentComplete,
+                state: resp.state,
+            };
             qi.interval = $interval(
                 function () {
                     qi.runStatusCount++;
                     requestSender.sendRequest(
-                        'runStatus', process, qi.request, process);
+                        'runStatusWait', process, qi.request, process);
                 },
                 // Sanity check in case of defect on server
                 Math.max(1, resp.nextRequestSeconds) * 1000,
@@ -1819,6 +1876,9 @@ SIREPO.app.factory('persistentSimulation', function(simulationQueue, appState, f
                     return 'Error: ' + e.split(/[\n\r]+/)[0];
                 }
             }
+            if (state.isStatePending() && simulationStatus().queuePosition !== undefined) {
+                return 'Queued, ' + simulationStatus().queuePosition + ' ahead of you';
+            }
             // ucfirst on the state value
             var s = simulationStatus().state;
             return s.charAt(0).toUpperCase() + s.slice(1);
@@ -30,10 +30,12 @@ def create_examples():
         }
         server.session_user(uid)
         for sim_type in feature_config.cfg.sim_types:
-            simulation_db.verify_app_directory(sim_type)
+            if not d.join(sim_type).check(dir=True):
+                # created with all examples on first use
+                continue
             names = map(
                 lambda x: x['name'],
-                simulation_db.iterate_simulation_datafiles(sim_type, simulation_db.process_simulation_list, {
+                simulation_db.list_simulations(sim_type, {
                     'simulation.isExample': True,
                 }))
             for s in simulation_db.examples(sim_type):
@@ -41,43 +43,145 @@ def create_examples():
                     simulation_db.save_new_example(s)
 
 
-def purge_users(days=180, confirm=False):
+def job_stats(days=None):
+    """Summarize job metrics by simulation type and report
+
+    See `sirepo.job_metrics`.
+
+    Args:
+        days (int): only jobs which ended in the last days [all]
+
+    Returns:
+        str: table of counts, averages, and maximums
+    """
+    from sirepo import job_metrics
+    from sirepo import server
+    import time
+
+    server.init()
+    s = job_metrics.summary(
+        since=time.time() - float(days) * 86400 if days is not None else None,
+    )
+    f = '{:<10} {:<28} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'
+    res = [f.format(
+        'type', 'report', 'jobs', 'errors', 'wait_s', 'run_s', 'max_run_s',
+        'cpu_s', 'max_rss_mb', 'out_mb',
+    )]
+    for k in sorted(s.keys()):
+        v = s[k]
+        n = float(v.jobs)
+        res.append(f.format(
+            k[0],
+            k[1],
+            v.jobs,
+            v.errors,
+            '{:.1f}'.format(v.queue_seconds / n),
+            '{:.1f}'.format(v.run_seconds / n),
+            '{:.1f}'.format(v.max_run_seconds),
+            '{:.1f}'.format(v.cpu_seconds / n),
+            '{:.0f}'.format(v.max_rss_bytes / 1e6),
+            '{:.1f}'.format(v.output_bytes / n / 1e6),
+        ))
+    return '\n'.join(res)
+
+
+def purge_users(days=180, confirm=False, threads=4):
     """Remove old users from db which have not registered.
 
+    Last access is the user's access marker (see
+    `sirepo.simulation_db.user_accessed`). Directories without a
+    marker are walked for the newest file.
+
     Args:
         days (int): maximum days of untouched files (old is mtime > days)
         confirm (bool): delete the directories if True (else don't delete) [False]
+        threads (int): directories to delete concurrently [4]
 
     Returns:
         list: directories removed (or to remove if confirm)
     """
+    from multiprocessing.pool import ThreadPool
     from pykern import pkio
+    from pykern.pkdebug import pkdlog
+    from sirepo import blob_store
     from sirepo import server
     from sirepo import simulation_db
-    import datetime
+    import time
 
     days = int(days)
     assert days >= 1, \
         '{}: days must be a positive integer'
     server.init()
     uids = server.all_uids()
-    now = datetime.datetime.utcnow()
+    oldest = time.time() - days * 86400
     to_remove = []
     for d in pkio.sorted_glob(simulation_db.user_dir_name('*')):
         if _is_src_dir(d):
             continue;
         #TODO(pjm): need to skip special "src" user
-        if simulation_db.uid_from_dir_name(d) in uids:
+        uid = simulation_db.uid_from_dir_name(d)
+        if uid in uids:
             continue
-        for f in pkio.walk_tree(d):
-            if (now - now.fromtimestamp(f.mtime())).days <= days:
-                break
-        else:
-            to_remove.append(d)
+        t = simulation_db.user_last_access(uid)
+        if t is not None:
+            if t > oldest:
+                continue
+        elif any(f.mtime() > oldest for f in pkio.walk_tree(d)):
+            continue
+        to_remove.append(d)
     if confirm:
-        pkio.unchecked_remove(*to_remove)
+        if to_remove:
+            p = ThreadPool(max(1, int(threads)))
+            try:
+                r = p.map(_remove_user_dir, to_remove)
+            finally:
+                p.close()
+                p.join()
+            pkdlog('{} users removed, {} bytes reclaimed', len(to_remove), sum(x[0] for x in r))
+        else:
+            r = []
+        # blobs orphaned by this purge are removed now, not after min_age
+        pkdlog(
+            '{} blobs removed, {} bytes reclaimed',
+            *blob_store.gc(orphans=set().union(*(x[1] for x in r)))
+        )
     return to_remove
 
 
 def _is_src_dir(d):
     return re.search(r'/src$', str(d))
+
+
+def _remove_user_dir(d):
+    """Remove a user directory
+
+    Args:
+        d (py.path): user directory
+    Returns:
+        int, set: bytes reclaimed (blobs are counted by `sirepo.blob_store.gc`),
+            (st_dev, st_ino) of hard linked files, e.g. blobs
+    """
+    from pykern import pkio
+    from sirepo import db_lock
+    from sirepo import simulation_db
+    import os
+
+    res = 0
+    linked = set()
+    for f in pkio.walk_tree(d):
+        try:
+            s = os.lstat(str(f))
+            if s.st_nlink == 1:
+                res += s.st_size
+            else:
+                linked.add((s.st_dev, s.st_ino))
+        except OSError:
+            pass
+    uid = simulation_db.uid_from_dir_name(d)
+    with db_lock.user(uid):
+        sids = [x.basename for x in pkio.sorted_glob(d.join('*', '*'))]
+        pkio.unchecked_remove(d)
+        for sid in sids:
+            db_lock.remove('simulation', sid)
+        db_lock.remove('user', uid)
+    return res, linked
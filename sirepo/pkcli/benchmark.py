@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+u"""Measure response encoding
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+#: Encodes of each frame
+_REPEAT = 5
+
+
+def json_encoder(*frame_files):
+    """Compare `sirepo.json_encoder` with tolist and json.dumps
+
+    Frame files are responses saved from /simulation-frame (or out.json
+    files) for real srw, elegant, warppba, etc. frames. Without files,
+    frames shaped like an SRW intensity report, an elegant parameter
+    plot, and a warppba field are generated.
+
+    The old path is what templates and the server did before: tolist,
+    replace NaN and Inf value by value, then json.dumps.
+
+    Args:
+        frame_files (str): json files [generated frames]
+    Returns:
+        str: seconds per encode for each frame
+    """
+    from pykern import pkio
+    from sirepo import json_encoder
+    import json
+    import time
+
+    frames = []
+    for f in frame_files:
+        with open(f) as x:
+            frames.append((pkio.py_path(f).basename, _to_numpy(json.load(x))))
+    if not frames:
+        frames = _generated_frames()
+    res = ['{:<24} {:>10} {:>10} {:>10} {:>8}'.format('frame', 'old_s', 'dumps_s', 'stream_s', 'mb')]
+    for n, f in frames:
+        t = []
+        for e in (
+            lambda: json.dumps(_old_path(f), allow_nan=False),
+            lambda: json_encoder.dumps(f),
+            lambda: ''.join(json_encoder.iterencode(f)),
+        ):
+            s = time.time()
+            for _ in range(_REPEAT):
+                v = e()
+            t.append((time.time() - s) / _REPEAT)
+        res.append('{:<24} {:>10.4f} {:>10.4f} {:>10.4f} {:>8.1f}'.format(
+            n, t[0], t[1], t[2], len(v) / 1e6))
+    return '\n'.join(res)
+
+
+def _generated_frames():
+    import numpy
+
+    r = numpy.random.RandomState(1)
+    e = r.normal(size=200000)
+    e[::1000] = numpy.nan
+    return [
+        ('srw-intensity', {
+            'title': 'Intensity Report',
+            'x_range': [-1e-3, 1e-3, 1024],
+            'y_range': [-1e-3, 1e-3, 1024],
+            'z_matrix': r.random_sample((1024, 1024)),
+        }),
+        ('elegant-parameters', {
+            'title': '',
+            'x_points': numpy.linspace(0, 100, 200000),
+            'plots': [
+                {'points': e, 'label': 'betax', 'color': '#1f77b4'},
+                {'points': r.normal(size=200000), 'label': 'betay', 'color': '#ff7f0e'},
+            ],
+        }),
+        ('warppba-field', {
+            'title': 'E z',
+            'x_range': [0, 1e-5, 512],
+            'y_range': [-2e-5, 2e-5, 256],
+            'z_matrix': r.normal(size=(256, 512)),
+        }),
+    ]
+
+
+def _old_path(value):
+    import math
+    import numpy
+
+    if isinstance(value, dict):
+        return dict((k, _old_path(v)) for k, v in value.items())
+    if isinstance(value, numpy.ndarray):
+        value = value.tolist()
+    if isinstance(value, list):
+        return [_old_path(v) for v in value]
+    if isinstance(value, float) and (math.isinf(value) or math.isnan(value)):
+        return 0
+    return value
+
+
+def _to_numpy(value):
+    """Numeric lists to arrays, as templates can return them now"""
+    import numpy
+
+    if isinstance(value, dict):
+        return dict((k, _to_numpy(v)) for k, v in value.items())
+    if isinstance(value, list):
+        try:
+            a = numpy.asarray(value)
+            if a.dtype.kind in 'fiu':
+                return a
+        except ValueError:
+            pass
+        return [_to_numpy(v) for v in value]
+    return value
@@ -5,6 +5,64 @@ u"""Database utilities
 :license: http://www.apache.org/licenses/LICENSE-2.0.html
 """
 from __future__ import absolute_import, division, print_function
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+
+
+def migrate(processes=None):
+    """Upgrade all simulations of all users to the current schema
+
+    Runs `simulation_db.fixup_old_data` on every simulation in a pool
+    of worker processes, one user at a time. Run this after a release
+    (before starting the server) and set
+    ``SIREPO_SIMULATION_DB_FIXUP_ON_READ=0`` so requests never upgrade
+    documents.
+
+    Args:
+        processes (int): number of worker processes [cpu count]
+    Returns:
+        str: summary
+    """
+    from pykern import pkio
+    from sirepo import server
+    from sirepo import simulation_db
+    import multiprocessing
+
+    server.init()
+    uids = []
+    for d in pkio.sorted_glob(simulation_db.user_dir_name('*')):
+        try:
+            uids.append(simulation_db.uid_from_dir_name(d))
+        except AssertionError:
+            # not a user, e.g. "src"
+            pass
+    p = multiprocessing.Pool(int(processes) if processes else None)
+    migrated = 0
+    errors = []
+    try:
+        for i, r in enumerate(p.imap_unordered(_migrate_user, uids)):
+            migrated += r[1]
+            errors.extend(r[2])
+            pkdlog(
+                '{}/{} uid={} migrated={} errors={}',
+                i + 1,
+                len(uids),
+                r[0],
+                r[1],
+                len(r[2]),
+            )
+        p.close()
+    except BaseException:
+        p.terminate()
+        raise
+    finally:
+        p.join()
+    for path, err in errors:
+        pkdlog('{}: migrate failed: {}', path, err)
+    return '{} users, {} simulations migrated, {} errors'.format(
+        len(uids),
+        migrated,
+        len(errors),
+    )
 
 
 def upgrade():
@@ -34,3 +92,58 @@ def upgrade():
                 break
             with open(str(fn), 'w') as f:
                 f.write(t)
+
+
+def rebuild_global_index():
+    """Recreate the simulation id to user index from the user directories
+
+    Run once after an upgrade. Until then, lookups which miss the
+    index search every user's directory. Afterwards, a miss is final.
+    """
+    from sirepo import simulation_db
+    from sirepo import server
+
+    server.init()
+    return '{} simulations indexed'.format(simulation_db.rebuild_global_index())
+
+
+def _migrate_user(uid):
+    """Upgrade one user's simulations (runs in a worker process)
+
+    Args:
+        uid (str): user to migrate
+    Returns:
+        tuple: uid, number migrated, list of (path, error)
+    """
+    from pykern import pkio
+    from sirepo import feature_config
+    from sirepo import server
+    from sirepo import simulation_db
+    import flask
+
+    migrated = 0
+    errors = []
+    # create a mock session
+    flask.session = {
+        server._ENVIRON_KEY_BEAKER: {},
+    }
+    server.session_user(uid)
+    for sim_type in feature_config.cfg.sim_types:
+        for path in pkio.sorted_glob(
+            simulation_db.user_dir_name(uid).join(
+                sim_type,
+                '*',
+                simulation_db.SIMULATION_DATA_FILE,
+            ),
+        ):
+            try:
+                data = simulation_db.open_json_file(sim_type, path, fixup=False)
+                data, changed = simulation_db.fixup_old_data(data)
+                if changed:
+                    # writes atomically
+                    simulation_db.save_simulation_json(data, do_validate=False)
+                    migrated += 1
+            except Exception as e:
+                pkdc('{}: {}', path, pkdexc())
+                errors.append((str(path), str(e)))
+    return uid, migrated, errors
@@ -115,8 +115,20 @@ def uwsgi():
     if in_dev:
         from sirepo import server, runner
         # uwsgi doesn't pass signals right so can't use _Background
-        if not issubclass(server.cfg.job_queue, runner.Celery):
-            pkcli.command_error('uwsgi only works if sirepo.server.cfg.job_queue=_Celery')
+        # and Scheduler only knows about jobs in its own process
+        if not (
+            issubclass(server.cfg.job_queue, runner.Celery)
+            or issubclass(server.cfg.job_queue, runner.Scheduler) and cfg.processes == 1
+        ):
+            pkcli.command_error('uwsgi only works if sirepo.server.cfg.job_queue=_Celery (or Scheduler with one process)')
+    from sirepo import status_watcher
+    if status_watcher.cfg.max_waiters >= cfg.threads:
+        # waiting status requests would hold every thread
+        pkcli.command_error(
+            'sirepo.status_watcher.cfg.max_waiters={} must be less than threads={}',
+            status_watcher.cfg.max_waiters,
+            cfg.threads,
+        )
     run_dir = _run_dir()
     with pkio.save_chdir(run_dir):
         values = dict(pkcollections.map_items(cfg))
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+u"""Process which forks foreground jobs (see `sirepo.zygote`)
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+
+
+def default_command():
+    """Started by `sirepo.runner.Scheduler`; reads jobs from stdin"""
+    from sirepo import zygote
+
+    zygote.main()
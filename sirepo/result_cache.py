@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+u"""Results shared across simulations and users
+
+When a foreground job exits, `sirepo.runner` saves its run dir under
+``<db_dir>/result_cache`` keyed by the simulation type, report, report
+parameters hash, and the contents of the lib files the report uses.
+Another simulation with the same key (a copy, the same example for
+another user, a reverted parameter) gets the saved files instead of
+running again.
+
+Entries are evicted least recently used when the total exceeds
+cfg.max_bytes.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+from pykern import pkio
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import simulation_db
+from sirepo.template import template_common
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+
+#: where entries live under db_dir
+_CACHE_DIR = 'result_cache'
+
+#: Files in a run dir which belong to the simulation, not the result
+_INPUT_FILES = (
+    template_common.INPUT_BASE_NAME + simulation_db.JSON_SUFFIX,
+    simulation_db.RUN_INFO_FILE,
+)
+
+#: Written in a run dir once it has been saved
+_SAVED_FILE = 'result-cached'
+
+#: Entry directory containing run dir files
+_RUN_SUBDIR = 'run'
+
+#: Entry file containing bytes in run subdir
+_SIZE_FILE = 'size'
+
+#: mutex for evictions in this process
+_evict_lock = threading.Lock()
+
+#: configuration
+cfg = None
+
+
+def key(data):
+    """Identify the result of a job (see `save`)
+
+    Args:
+        data (dict): report and models
+    Returns:
+        str: key or None if results of data are not cached
+    """
+    if not _enabled(data):
+        return None
+    return _key(data)
+
+
+def restore(data):
+    """Populate the run dir from the cache
+
+    Args:
+        data (dict): report and models
+    Returns:
+        bool: True if a result was restored, i.e. no need to run
+    """
+    from sirepo import db_lock
+
+    if not _enabled(data):
+        return False
+    e = _root().join(_key(data))
+    if not e.join(_SIZE_FILE).check(file=True):
+        return False
+    with db_lock.simulation(simulation_db.parse_sid(data)):
+        run_dir = simulation_db.simulation_run_dir(data, remove_dir=True)
+        try:
+            shutil.copytree(str(e.join(_RUN_SUBDIR)), str(run_dir), symlinks=True)
+        except Exception as x:
+            # evicted while copying
+            pkdlog('{}: restore failed: {}', e, x)
+            pkio.unchecked_remove(run_dir)
+            return False
+        template_common.copy_lib_files(data, None, run_dir)
+        simulation_db.write_run_input(data, run_dir)
+        pkio.write_text(run_dir.join(_SAVED_FILE), e.basename)
+    _touch(e)
+    pkdc('{}: restored from {}', run_dir, e)
+    return True
+
+
+def save(run_dir, key):
+    """Save the run dir of a job which exited successfully
+
+    Copies under the simulation lock so a new run or `restore` can't
+    change the run dir midway. Nothing is saved if the run dir is no
+    longer the completed run of key, e.g. it was rerun with other
+    parameters after the job exited.
+
+    Called by `sirepo.runner` outside of a request, so the lib files
+    are found relative to run_dir, not from the session's user.
+
+    Args:
+        run_dir (py.path): where the job ran
+        key (str): result of `key` when the job started (None: don't save)
+    """
+    from sirepo import db_lock
+
+    if not key:
+        return
+    e = _root().join(key)
+    if e.check():
+        _touch(e)
+        return
+    if not run_dir.check(dir=True):
+        return
+    # run_dir is <sid>/<report>
+    with db_lock.simulation(run_dir.dirpath().basename):
+        m = run_dir.join(_SAVED_FILE)
+        if m.check() or simulation_db.read_status(run_dir) != 'completed':
+            return
+        try:
+            data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
+            if 'reportParametersHash' not in data:
+                # computing it may need the session's lib dir
+                data.reportParametersHash = simulation_db.read_json(
+                    run_dir.join(simulation_db.RUN_INFO_FILE),
+                ).reportParametersHash
+        except Exception as x:
+            if pkio.exception_is_not_found(x):
+                return
+            raise
+        # run_dir is <type>/<sid>/<report> and lib files are in <type>/lib
+        if _key(data, run_dir.dirpath().dirpath().join('lib')) != key:
+            pkdc('{}: rerun since job exited, not saved', run_dir)
+            return
+        t = e.dirpath().join('.{}.{}'.format(key, random.random()))
+        try:
+            shutil.copytree(
+                str(run_dir),
+                str(t.join(_RUN_SUBDIR)),
+                symlinks=True,
+                ignore=_ignore,
+            )
+            pkio.write_text(t.join(_SIZE_FILE), str(_size(t.join(_RUN_SUBDIR))))
+            try:
+                os.rename(str(t), str(e))
+            except OSError:
+                # another process saved the same key
+                pass
+        finally:
+            pkio.unchecked_remove(t)
+        pkio.write_text(m, key)
+    pkdc('{}: saved as {}', run_dir, e)
+    _evict()
+
+
+def _enabled(data):
+    return cfg.max_bytes > 0 and not simulation_db.is_parallel(data)
+
+
+def _evict():
+    """Remove least recently used entries over cfg.max_bytes"""
+    with _evict_lock:
+        entries = []
+        total = 0
+        for e in pkio.sorted_glob(_root().join('*')):
+            try:
+                s = int(pkio.read_text(e.join(_SIZE_FILE)))
+                entries.append((e.mtime(), s, e))
+                total += s
+            except Exception:
+                # partially removed or not finished
+                pass
+        entries.sort()
+        while total > cfg.max_bytes and entries:
+            _, s, e = entries.pop(0)
+            pkio.unchecked_remove(e)
+            total -= s
+            pkdc('{}: evicted bytes={}', e, s)
+
+
+def _ignore(path, names):
+    res = []
+    for n in names:
+        if n in _INPUT_FILES or n == _SAVED_FILE \
+            or os.path.islink(os.path.join(path, n)):
+            res.append(n)
+    return res
+
+
+def _key(data, lib_dir=None):
+    """Identify result by report parameters and lib file contents
+
+    Args:
+        data (dict): report and models
+        lib_dir (py.path): where the lib files are [session's lib dir]
+    Returns:
+        str: hex digest
+    """
+    from sirepo import blob_store
+
+    libs = []
+    for f in template_common.lib_files(data, lib_dir):
+        libs.append([f.basename, blob_store.digest(f) if f.check(file=True) else None])
+    return hashlib.sha256(json.dumps([
+        data['simulationType'],
+        data['report'],
+        template_common.report_parameters_hash(data),
+        sorted(libs),
+    ]).encode()).hexdigest()
+
+
+def _root():
+    return simulation_db.db_dir().join(_CACHE_DIR)
+
+
+def _size(path):
+    return sum(f.size() for f in pkio.walk_tree(path))
+
+
+def _touch(entry):
+    try:
+        os.utime(str(entry), None)
+    except OSError:
+        # evicted
+        pass
+
+
+cfg = pkconfig.init(
+    max_bytes=(1024 * 1024 * 1024, int, 'Bytes of shared results to keep (0 disables)'),
+)
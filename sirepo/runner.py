@@ -8,16 +8,41 @@ from __future__ import absolute_import, division, print_function
 from pykern import pkcli
 from pykern import pkconfig
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import job_metrics
+from sirepo import job_registry
+from sirepo import mpi
+from sirepo import result_cache
 from sirepo import simulation_db
 from sirepo.template import template_common
+import collections
 import errno
+import fcntl
 import os
 import signal
+import subprocess
 import sys
 import threading
 import time
 import uuid
 
+#: Resource classes in dispatch order, same as `sirepo.celery_tasks.QUEUE_NAMES`
+_QUEUE_NAMES = ('fast', 'sequential', 'heavy', 'parallel')
+
+#: How often the Scheduler dispatcher checks for exited jobs
+_SCHEDULER_POLL_SECONDS = 0.5
+
+#: Work for the reaper thread (see `_after_exit`)
+_reaper_work = collections.deque()
+
+#: Wakes the reaper thread: read and write fds
+_reaper_pipe = None
+
+#: Reaper thread
+_reaper_thread = None
+
+#: mutex for starting the reaper thread
+_reaper_lock = threading.Lock()
+
 
 class Background(object):
     """Run as subprocess"""
@@ -31,14 +56,21 @@ class Background(object):
     def __init__(self, data):
         with self._lock:
             self.jid = simulation_db.job_id(data)
-            if self.jid in self._job:
+            if self.jid in self._job or _other_process_pid(self.jid):
                 raise Collision(self.jid)
             self.in_kill = None
+            q = simulation_db.celery_queue(data)
+            _assert_quota(q)
             self.cmd, self.run_dir = simulation_db.prepare_simulation(data)
+            self.result_key = result_cache.key(data)
             self._job[self.jid] = self
             self.pid = None
+            _start_reaper()
+            self.metrics_log = str(job_metrics.log_path())
+            self.start_time = time.time()
             # This command may blow up
             self.pid = self._start_job()
+            job_registry.add(self.jid, pid=self.pid, queue=q, run_dir=self.run_dir)
 
     @classmethod
     def is_processing(cls, jid):
@@ -47,7 +79,7 @@ class Background(object):
                 self = cls._job[jid]
             except KeyError:
                 pkdc('{}: not found', jid)
-                return False
+                return bool(_other_process_pid(jid))
             if self.in_kill:
                 # Strange but true. The process is alive at this point so we
                 # don't want to do anything like start a new process
@@ -58,51 +90,33 @@ class Background(object):
             except OSError:
                 # Has to exist so no need to protect
                 del self._job[jid]
+                job_registry.remove(jid, pid=self.pid)
                 pkdlog('{}: pid={} does not exist, removing job', jid, self.pid)
                 return False
         return True
 
     @classmethod
-    def kill(cls, jid):
+    def kill(cls, jid, on_exit=None):
+        """Start stopping the job and return (see `_kill_later`)
+
+        Args:
+            jid (str): job id
+            on_exit (function): called once the process has exited [None]
+        """
         self = None
         with cls._lock:
             try:
                 self = cls._job[jid]
             except KeyError:
+                _kill_other_process(jid, on_exit)
                 return
             if self.in_kill:
                 pkdlog('{}: kill in progress in another thread', jid)
                 return
             nonce = uuid.uuid4()
             self.in_kill = nonce
-
-        pkdlog('{}: stopping: pid={}', self.jid, self.pid)
-        sig = signal.SIGTERM
-        for i in range(3):
-            try:
-                os.kill(self.pid, sig)
-                time.sleep(1)
-                pid, status = os.waitpid(self.pid, os.WNOHANG)
-                if pid == self.pid:
-                    pkdlog('{}: waitpid: status={}', pid, status)
-                    break
-                else:
-                    pkdlog('{}: unexpected waitpid result; job={} pid={}', pid, self.jid, self.pid)
-                sig = signal.SIGKILL
-            except OSError:
-                pkdlog('{}: already reaped; job={}', self.pid, self.jid)
-                return
-        with cls._lock:
-            try:
-                self = cls._job[jid]
-                if self.in_kill and self.in_kill == nonce:
-                    self.in_kill = None
-                    del self._job[self.jid]
-                    pkdlog('{}: delete successful; pid=', self.jid, self.pid)
-                    return
-                pkdlog('{}: job restarted by another thread', jid)
-            except KeyError:
-                pkdlog('{}: job reaped by another thread', jid)
+        job_registry.update(jid, state='canceling')
+        _kill_later(on_exit, cls._kill, self, nonce)
 
     @classmethod
     def race_condition_reap(cls, jid):
@@ -116,6 +130,11 @@ class Background(object):
 
     @classmethod
     def sigchld_handler(cls, signum=None, frame=None):
+        """Reap a job and queue the rest of the work (see `_after_exit`)
+
+        sqlite and file writes could deadlock on locks held by the
+        thread this handler interrupted.
+        """
         try:
             with cls._lock:
                 if not cls._job:
@@ -124,11 +143,15 @@ class Background(object):
                     # are doing popens, which does a waitpid.
                     # see radiasoft/sirepo#681
                     return
-                pid, status = os.waitpid(-1, os.WNOHANG)
+                pid, status, ru = os.wait4(-1, os.WNOHANG)
                 pkdlog('{}: waitpid: status={}', pid, status)
                 for self in cls._job.values():
                     if self.pid == pid:
                         del self._job[self.jid]
+                        _after_exit(self._record, status, ru)
+                        _after_exit(job_registry.remove, self.jid, pid=pid)
+                        if status == 0:
+                            _after_exit(result_cache.save, self.run_dir, self.result_key)
                         pkdlog('{}: delete successful', self.jid)
                         return
         except OSError as e:
@@ -136,6 +159,47 @@ class Background(object):
                 pkdlog('waitpid: OSError: {} errno={}', e.strerror, e.errno)
                 # Fall through. Not much to do here
 
+    @classmethod
+    def _kill(cls, self, nonce):
+        pkdlog('{}: stopping: pid={}', self.jid, self.pid)
+        sig = signal.SIGTERM
+        for i in range(3):
+            try:
+                os.kill(self.pid, sig)
+                time.sleep(1)
+                pid, status, ru = os.wait4(self.pid, os.WNOHANG)
+                if pid == self.pid:
+                    pkdlog('{}: waitpid: status={}', pid, status)
+                    self._record(status, ru)
+                    break
+                else:
+                    pkdlog('{}: unexpected waitpid result; job={} pid={}', pid, self.jid, self.pid)
+                sig = signal.SIGKILL
+            except OSError:
+                pkdlog('{}: already reaped; job={}', self.pid, self.jid)
+                return
+        with cls._lock:
+            try:
+                self = cls._job[self.jid]
+                if self.in_kill and self.in_kill == nonce:
+                    self.in_kill = None
+                    del self._job[self.jid]
+                    job_registry.remove(self.jid, pid=self.pid)
+                    pkdlog('{}: delete successful; pid=', self.jid, self.pid)
+                    return
+                pkdlog('{}: job restarted by another thread', self.jid)
+            except KeyError:
+                pkdlog('{}: job reaped by another thread', self.jid)
+
+    def _record(self, status, rusage):
+        job_metrics.record(
+            self.metrics_log,
+            self.run_dir,
+            self.start_time,
+            job_metrics.returncode(status),
+            rusage,
+        )
+
     def _start_job(self):
         """Detach a process from the controlling terminal and run it in the
         background as a daemon.
@@ -205,11 +269,20 @@ class Celery(object):
                     self.async_result and self.async_result.state,
                 )
                 raise Collision(self.jid)
+            self.celery_queue = simulation_db.celery_queue(data)
+            _assert_quota(self.celery_queue)
             self.cmd, self.run_dir = simulation_db.prepare_simulation(data)
+            self.result_key = result_cache.key(data)
             self._job[self.jid] = self
             self.data = data
             self._job[self.jid] = self
             self.async_result = self._start_job()
+            job_registry.add(
+                self.jid,
+                task_id=self.async_result.task_id,
+                queue=self.celery_queue,
+                run_dir=self.run_dir,
+            )
             pkdc(
                 '{}: started tid={} dir={} queue={} len_jobs={}',
                 self.jid,
@@ -226,34 +299,22 @@ class Celery(object):
             return bool(cls._find_job(jid))
 
     @classmethod
-    def kill(cls, jid):
-        from celery.exceptions import TimeoutError
+    def kill(cls, jid, on_exit=None):
+        """Start revoking the task and return (see `_kill_later`)
+
+        Args:
+            jid (str): job id
+            on_exit (function): called once the task has been revoked [None]
+        """
         with cls._lock:
             self = cls._find_job(jid)
             if not self:
+                _call(on_exit)
                 return
             res = self.async_result
-            tid = res.task_id
-            pkdlog('{}: killing: tid={}', jid, tid)
-        try:
-            res.revoke(terminate=True, wait=True, timeout=2, signal='SIGTERM')
-        except TimeoutError as e:
-            pkdlog('{}: sending a SIGKILL tid={}', jid, tid)
-            res.revoke(terminate=True, signal='SIGKILL')
-        with cls._lock:
-            self = cls._find_job(jid)
-            if not self:
-                return
-            if self.async_result.task_id == tid:
-                del self._job[self.jid]
-                pkdlog('{}: deleted (killed) job; tid={} celery_state={}', jid, tid, self.async_result.state)
-                return
-            pkdlog(
-                '{}: job reaped by another thread; old_tid={}, new_tid={}',
-                jid,
-                tid,
-                self.async_result,
-            )
+            pkdlog('{}: killing: tid={}', jid, res.task_id)
+        job_registry.update(jid, state='canceling')
+        _kill_later(on_exit, cls._revoke, jid, res)
 
     @classmethod
     def race_condition_reap(cls, jid):
@@ -269,7 +330,7 @@ class Celery(object):
                     res,
                     res and res.state,
                 )
-                del self._job[self.jid]
+                self._forget()
                 res.revoke(terminate=True, signal='SIGKILL')
             else:
                 pkdlog('{}: job finished finally', jid)
@@ -279,8 +340,10 @@ class Celery(object):
         try:
             self = cls._job[jid]
         except KeyError:
-            pkdlog('{}: job not found; len_jobs={}', jid, len(cls._job))
-            return None
+            self = cls._from_registry(jid)
+            if not self:
+                pkdlog('{}: job not found; len_jobs={}', jid, len(cls._job))
+                return None
         res = self.async_result
         pkdc(
             '{}: job tid={} celery_state={} len_jobs={}',
@@ -290,7 +353,10 @@ class Celery(object):
             len(cls._job),
         )
         if not res or res.ready():
-            del self._job[jid]
+            self._forget()
+            # jobs started by other processes are not saved (no key)
+            if res and res.successful():
+                _after_exit(result_cache.save, self.run_dir, self.result_key)
             pkdlog(
                 '{}: deleted errant or ready job; tid={} ready={}',
                 jid,
@@ -300,14 +366,64 @@ class Celery(object):
             return None
         return self
 
+    @classmethod
+    def _from_registry(cls, jid):
+        """Job started by another process
+
+        Args:
+            jid (str): job id
+        Returns:
+            Celery: instance (not in _job) or None
+        """
+        from sirepo import celery_tasks
+
+        r = job_registry.get(jid)
+        if not r or not r.task_id:
+            return None
+        self = cls.__new__(cls)
+        self.jid = jid
+        self.async_result = celery_tasks.celery.AsyncResult(r.task_id)
+        self.result_key = None
+        self.run_dir = None
+        return self
+
+    def _forget(self):
+        if self._job.get(self.jid) is self:
+            del self._job[self.jid]
+        job_registry.remove(self.jid, task_id=self.async_result.task_id)
+
+    @classmethod
+    def _revoke(cls, jid, res):
+        from celery.exceptions import TimeoutError
+
+        tid = res.task_id
+        try:
+            res.revoke(terminate=True, wait=True, timeout=2, signal='SIGTERM')
+        except TimeoutError as e:
+            pkdlog('{}: sending a SIGKILL tid={}', jid, tid)
+            res.revoke(terminate=True, signal='SIGKILL')
+        with cls._lock:
+            self = cls._find_job(jid)
+            if not self:
+                return
+            if self.async_result.task_id == tid:
+                self._forget()
+                pkdlog('{}: deleted (killed) job; tid={} celery_state={}', jid, tid, self.async_result.state)
+                return
+            pkdlog(
+                '{}: job reaped by another thread; old_tid={}, new_tid={}',
+                jid,
+                tid,
+                self.async_result,
+            )
+
     def _start_job(self):
         """Detach a process from the controlling terminal and run it in the
         background as a daemon.
         """
         from sirepo import celery_tasks
-        self.celery_queue = simulation_db.celery_queue(self.data)
         return celery_tasks.start_simulation.apply_async(
-            args=[self.cmd, str(self.run_dir)],
+            args=[self.cmd, str(self.run_dir), str(job_metrics.log_path())],
             queue=self.celery_queue,
         )
 
@@ -317,6 +433,367 @@ class Collision(Exception):
     pass
 
 
+class Quota(Exception):
+    """User is running all the jobs or cores allowed (see cfg.user_max_jobs)"""
+    pass
+
+
+class Scheduler(object):
+    """Run jobs as subprocesses with a fixed number of slots (single host)
+
+    Jobs wait in a FIFO queue per resource class (see `cfg`) until a
+    slot is free. A dispatcher thread starts and reaps the processes so
+    no signal handlers are needed. Jobs are only known to the process
+    which queued them, so run with one server process (threads are ok).
+
+    Users share the slots of a queue fairly: a user's waiting jobs take
+    turns with other users' (see `_fair_order`) and jobs which would put
+    a user over cfg.user_max_jobs or cfg.user_max_cores wait.
+
+    With cfg.zygote, foreground jobs are forked by `sirepo.zygote`
+    instead of starting a new interpreter.
+    """
+
+    # Map of jid to instance (queued or running)
+    _job = {}
+
+    # mutex for _job, _queue, _running; notified when a job is queued
+    _lock = threading.Condition(threading.RLock())
+
+    # FIFO of waiting instances by queue name
+    _queue = dict((q, []) for q in _QUEUE_NAMES)
+
+    # Running instances by queue name
+    _running = dict((q, []) for q in _QUEUE_NAMES)
+
+    # Dispatcher thread
+    _thread = None
+
+    def __init__(self, data):
+        self.jid = simulation_db.job_id(data)
+        self._assert_no_collision()
+        # disk heavy so not under _lock, which the dispatcher and status
+        # requests need; starts of a simulation are serialized by db_lock
+        self.cmd, self.run_dir = simulation_db.prepare_simulation(data)
+        self.result_key = result_cache.key(data)
+        self.in_kill = False
+        self.metrics_log = str(job_metrics.log_path())
+        self.on_exit = None
+        self.process = None
+        self.queue_name = simulation_db.celery_queue(data)
+        self.cores = _cores(self.queue_name)
+        self.owner = simulation_db.job_id_prefix()
+        with self._lock:
+            self._assert_no_collision()
+            self._job[self.jid] = self
+            self._queue[self.queue_name].append(self)
+            job_registry.add(
+                self.jid,
+                queue=self.queue_name,
+                run_dir=self.run_dir,
+                state='queued',
+            )
+            pkdc(
+                '{}: queued queue={} position={}',
+                self.jid,
+                self.queue_name,
+                len(self._queue[self.queue_name]) - 1,
+            )
+            self._start_dispatcher()
+            self._lock.notify()
+
+    @classmethod
+    def is_processing(cls, jid):
+        with cls._lock:
+            self = cls._job.get(jid)
+            if not self:
+                return bool(_other_process_pid(jid))
+            if self.process and self._poll() is not None:
+                cls._reap(self)
+                return False
+            return True
+
+    @classmethod
+    def kill(cls, jid, on_exit=None):
+        """Remove queued job or start stopping the job and return
+
+        Args:
+            jid (str): job id
+            on_exit (function): called once the process has exited [None]
+        """
+        with cls._lock:
+            self = cls._job.get(jid)
+            if not self:
+                _kill_other_process(jid, on_exit)
+                return
+            if self in cls._queue[self.queue_name]:
+                pkdlog('{}: removing from queue={}', jid, self.queue_name)
+                cls._queue[self.queue_name].remove(self)
+                del cls._job[jid]
+                job_registry.remove(jid)
+                _call(on_exit)
+                return
+            if self.in_kill:
+                return
+            self.in_kill = True
+            if not self.process:
+                # _start stops it once it has a process
+                self.on_exit = on_exit
+                return
+        job_registry.update(jid, state='canceling')
+        _kill_later(on_exit, cls._terminate, self)
+
+    @classmethod
+    def queue_position(cls, jid):
+        """Jobs which will start before this one in its queue
+
+        Args:
+            jid (str): job id
+        Returns:
+            int: 0 is next to run, None if running or not found
+        """
+        with cls._lock:
+            self = cls._job.get(jid)
+            if not self or self not in cls._queue[self.queue_name]:
+                return None
+            return cls._fair_order(self.queue_name, cls._usage()).index(self)
+
+    @classmethod
+    def race_condition_reap(cls, jid):
+        """Job terminated, but is still in _job; is_processing reaps it"""
+        pkdlog('{}: job not reaped by dispatcher yet', jid)
+        cls.is_processing(jid)
+
+    @classmethod
+    def _dispatch(cls):
+        """Reap finished jobs and start queued jobs while slots are free
+
+        Jobs are started without holding _lock, because starting may
+        block (e.g. while the zygote imports templates). A starting job
+        is in _running, but has no process.
+        """
+        while True:
+            starting = []
+            with cls._lock:
+                for q in _QUEUE_NAMES:
+                    for self in list(cls._running[q]):
+                        if not self.process:
+                            continue
+                        if self._poll() is not None:
+                            cls._reap(self)
+                        elif self._is_over_time_limit():
+                            cls._time_limit(self)
+                u = cls._usage()
+                for q in _QUEUE_NAMES:
+                    while len(cls._running[q]) < cfg.slots[q]:
+                        self = cls._next(q, u)
+                        if not self:
+                            break
+                        cls._queue[q].remove(self)
+                        cls._running[q].append(self)
+                        x = u.setdefault(self.owner, [0, 0])
+                        x[0] += 1
+                        x[1] += self.cores
+                        starting.append(self)
+                if not starting:
+                    cls._lock.wait(_SCHEDULER_POLL_SECONDS)
+                    continue
+            for self in starting:
+                cls._start(self)
+
+    @classmethod
+    def _fair_order(cls, queue, usage):
+        """Waiting jobs of queue in the order they should start
+
+        A user's n-th waiting job ranks with other users' jobs which
+        have n jobs running or ahead of them, so one user's burst
+        doesn't hold up everybody else. Ties are first come, first
+        served.
+
+        Args:
+            queue (str): queue name
+            usage (dict): result of `_usage`
+        Returns:
+            list: instances
+        """
+        n = {}
+        res = []
+        for i, self in enumerate(cls._queue[queue]):
+            r = n.get(self.owner)
+            if r is None:
+                r = usage.get(self.owner, (0, 0))[0]
+            n[self.owner] = r + 1
+            res.append((r, i, self))
+        return [x[2] for x in sorted(res, key=lambda x: x[:2])]
+
+    @classmethod
+    def _next(cls, queue, usage):
+        """First job in fair order whose user is within quota
+
+        Args:
+            queue (str): queue name
+            usage (dict): result of `_usage`
+        Returns:
+            Scheduler: instance or None
+        """
+        for self in cls._fair_order(queue, usage):
+            u = usage.get(self.owner, (0, 0))
+            if not _over_quota(u[0], u[1], self.cores):
+                return self
+        return None
+
+    @classmethod
+    def _reap(cls, self):
+        pkdlog('{}: exited: pid={} returncode={}', self.jid, self.process.pid, self.process.returncode)
+        if self.process.returncode == 0 and not self.in_kill:
+            _after_exit(result_cache.save, self.run_dir, self.result_key)
+        del cls._job[self.jid]
+        job_registry.remove(self.jid, pid=self.process.pid)
+        try:
+            cls._running[self.queue_name].remove(self)
+        except ValueError:
+            pass
+
+    @classmethod
+    def _start(cls, self):
+        """Start a job which `_dispatch` moved to _running"""
+        try:
+            p = self._start_job()
+        except Exception:
+            pkdlog('{}: start error: {}', self.jid, pkdexc())
+            with cls._lock:
+                cls._running[self.queue_name].remove(self)
+                del cls._job[self.jid]
+                job_registry.remove(self.jid)
+            return
+        with cls._lock:
+            self.process = p
+            job_registry.update(self.jid, pid=self.process.pid, state='running')
+            if not self.in_kill:
+                return
+        # canceled while starting
+        job_registry.update(self.jid, state='canceling')
+        _kill_later(self.on_exit, cls._terminate, self)
+
+    @classmethod
+    def _start_dispatcher(cls):
+        if cls._thread:
+            return
+        cls._thread = threading.Thread(target=cls._dispatch, name='runner.Scheduler')
+        cls._thread.daemon = True
+        cls._thread.start()
+
+    @classmethod
+    def _terminate(cls, self):
+        def _poll():
+            with cls._lock:
+                return self._poll()
+
+        pkdlog('{}: stopping: pid={}', self.jid, self.process.pid)
+        _terminate_pid(self.process.pid, _poll)
+        with cls._lock:
+            if cls._job.get(self.jid) is self:
+                cls._reap(self)
+
+    @classmethod
+    def _time_limit(cls, self):
+        """Stop a foreground job which ran too long"""
+        from sirepo import server
+
+        pkdlog(
+            '{}: foreground_time_limit={}s exceeded: pid={}',
+            self.jid,
+            server.cfg.foreground_time_limit,
+            self.process.pid,
+        )
+        with open(str(self.run_dir.join(template_common.RUN_LOG)), 'a') as f:
+            f.write(
+                'error: simulation exceeded the time limit of {} seconds\n'.format(
+                    server.cfg.foreground_time_limit,
+                ),
+            )
+        self.in_kill = True
+        job_registry.update(self.jid, state='canceling')
+        _kill_later(None, cls._terminate, self)
+
+    @classmethod
+    def _usage(cls):
+        """Running jobs and cores by user
+
+        Returns:
+            dict: owner to [jobs, cores]
+        """
+        res = {}
+        for q in _QUEUE_NAMES:
+            for self in cls._running[q]:
+                x = res.setdefault(self.owner, [0, 0])
+                x[0] += 1
+                x[1] += self.cores
+        return res
+
+    def _assert_no_collision(self):
+        with self._lock:
+            if self.jid in self._job or _other_process_pid(self.jid):
+                raise Collision(self.jid)
+
+    def _is_over_time_limit(self):
+        """Foreground job running longer than server.cfg.foreground_time_limit"""
+        from sirepo import server
+
+        return self.queue_name != 'parallel' and not self.in_kill \
+            and time.time() - self.start_time > server.cfg.foreground_time_limit
+
+    def _poll(self):
+        """Reap the process if it exited and record its metrics
+
+        The zygote reaps and records the jobs it forks.
+
+        Returns:
+            int: returncode or None if running
+        """
+        p = self.process
+        if p.returncode is not None or not isinstance(p, subprocess.Popen):
+            return p.poll()
+        try:
+            pid, status, ru = os.wait4(p.pid, os.WNOHANG)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            return p.poll()
+        if not pid:
+            return None
+        p.returncode = job_metrics.returncode(status)
+        job_metrics.record(self.metrics_log, self.run_dir, self.start_time, p.returncode, ru)
+        return p.returncode
+
+    def _start_job(self):
+        """Start the process (called without _lock)
+
+        Returns:
+            object: `subprocess.Popen` or `sirepo.zygote.Process`
+        """
+        simulation_db.write_status('running', self.run_dir)
+        self.start_time = time.time()
+        if cfg.zygote and self.queue_name != 'parallel':
+            from sirepo import zygote
+
+            res = zygote.start(self.cmd, self.run_dir, self.metrics_log)
+            pkdlog('{}: forked by zygote: pid={}', self.jid, res.pid)
+            return res
+        with open(os.devnull) as i, \
+            open(str(self.run_dir.join(template_common.RUN_LOG)), 'a') as o:
+            res = subprocess.Popen(
+                self.cmd,
+                close_fds=True,
+                cwd=str(self.run_dir),
+                stdin=i,
+                stdout=o,
+                stderr=subprocess.STDOUT,
+            )
+        pkdlog('{}: started: pid={} cmd={}', self.jid, res.pid, self.cmd)
+        return res
+
+
 def cfg_job_queue(value):
     """Return job queue class based on name
 
@@ -324,10 +801,10 @@ def cfg_job_queue(value):
         value (object): May be class or str.
 
     Returns:
-        object: `Background` or `Celery` class.
+        object: `Background`, `Celery`, or `Scheduler` class.
 
     """
-    if isinstance(value, type) and issubclass(value, (Celery, Background)):
+    if isinstance(value, type) and issubclass(value, (Celery, Background, Scheduler)):
         # Already initialized but may call initializer with original object
         return value
     if value == 'Celery':
@@ -337,10 +814,57 @@ def cfg_job_queue(value):
     elif value == 'Background':
         signal.signal(signal.SIGCHLD, Background.sigchld_handler)
         return Background
+    elif value == 'Scheduler':
+        return Scheduler
     else:
         pkcli.command_error('{}: unknown job_queue', value)
 
 
+def _after_exit(func, *args, **kwargs):
+    """Call func in the reaper thread
+
+    Work done after a job exits (e.g. `sirepo.result_cache.save`) reads
+    files and takes locks so it can't be done in a signal handler or
+    while holding a runner's _lock. Safe to call from a signal handler
+    once `_start_reaper` was called (deque.append is atomic and os.write
+    takes no locks).
+
+    Args:
+        func (function): what to call
+        args (list): passed to func
+        kwargs (dict): passed to func
+    """
+    _start_reaper()
+    _reaper_work.append((func, args, kwargs))
+    try:
+        os.write(_reaper_pipe[1], b'x')
+    except OSError as e:
+        # pipe full so reaper will wake anyway
+        if e.errno != errno.EAGAIN:
+            raise
+
+
+def _assert_quota(queue):
+    """Raise Quota if the session user may not start another job
+
+    Counts the user's jobs in `sirepo.job_registry` so the limits
+    apply across server processes. Records of finished jobs, which are
+    left when nobody polls the status (e.g. the tab was closed), are
+    removed first (see `_is_live`).
+
+    Args:
+        queue (str): where the new job will run
+    """
+    if not (cfg.user_max_jobs or cfg.user_max_cores):
+        return
+    jobs = [j for j in job_registry.find(simulation_db.job_id_prefix()) if _is_live(j)]
+    c = sum(_cores(j.queue) for j in jobs)
+    if _over_quota(len(jobs), c, _cores(queue)):
+        raise Quota(
+            'You are running {} simulations using {} cores. Wait for one to complete or cancel it.'.format(len(jobs), c),
+        )
+
+
 def _assert_celery():
     """Verify celery & rabbit are running"""
     from sirepo import celery_tasks
@@ -361,3 +885,203 @@ def _assert_celery():
     #TODO(robnagler) really should be pkconfig.Error() or something else
     # but this prints a nice message. Don't call sys.exit, not nice
     pkcli.command_error(err)
+
+
+def _call(func):
+    """Call func, if any, logging errors
+
+    Args:
+        func (function): e.g. on_exit of kill (may be None)
+    """
+    if not func:
+        return
+    try:
+        func()
+    except Exception:
+        pkdlog('{}: error: {}', func, pkdexc())
+
+
+def _cores(queue):
+    """Cores used by a job
+
+    Args:
+        queue (str): queue name
+    Returns:
+        int: mpi.cfg.cores for parallel jobs, else 1
+    """
+    return mpi.cfg.cores if queue == 'parallel' else 1
+
+
+def _is_live(job):
+    """Is the job in the registry record still queued or running?
+
+    Removes the record of a Celery task which is done or a process on
+    this host which exited. Processes on other hosts can't be checked
+    and are expired by age (see `sirepo.job_registry.expire`).
+    Scheduler jobs (no pid or task) have their own quota.
+
+    Args:
+        job (Dict): registry record
+    Returns:
+        bool: True if it counts against the user's quota
+    """
+    if job.task_id:
+        from sirepo import celery_tasks
+
+        if not celery_tasks.celery.AsyncResult(job.task_id).ready():
+            return True
+        job_registry.remove(job.jid, task_id=job.task_id)
+        return False
+    if not job.pid:
+        return False
+    return job.host != job_registry.HOST or bool(_other_process_pid(job.jid))
+
+
+def _kill_other_process(jid, on_exit=None):
+    """Terminate a job started by another process on this host
+
+    Args:
+        jid (str): job id
+        on_exit (function): called once the process has exited [None]
+    """
+    pid = _other_process_pid(jid)
+    if not pid:
+        _call(on_exit)
+        return
+    pkdlog('{}: stopping job of another process: pid={}', jid, pid)
+    job_registry.update(jid, state='canceling')
+
+    def _kill():
+        # the process may have exited (and pid reused) since the check above
+        if _other_process_pid(jid) == pid:
+            _terminate_pid(pid, lambda: None if _other_process_pid(jid) == pid else 1)
+        job_registry.remove(jid, pid=pid)
+
+    _kill_later(on_exit, _kill)
+
+
+def _kill_later(on_exit, func, *args):
+    """Call func in a thread so cancel requests return immediately
+
+    Args:
+        on_exit (function): called after func, i.e. the job has exited (may be None)
+        func (function): escalates signals and cleans up
+        args (list): passed to func
+    """
+    def _target():
+        try:
+            func(*args)
+        except Exception:
+            pkdlog('{}: error: {}', func, pkdexc())
+        _call(on_exit)
+
+    t = threading.Thread(target=_target, name='runner.kill')
+    t.daemon = True
+    t.start()
+
+
+def _other_process_pid(jid):
+    """Pid of a running job in the registry
+
+    Removes the record if the process no longer exists or the pid
+    was reused (see `sirepo.job_registry.process_exists`).
+
+    Args:
+        jid (str): job id
+    Returns:
+        int: pid or None
+    """
+    r = job_registry.get(jid)
+    if not r or not r.pid or r.host != job_registry.HOST:
+        return None
+    if job_registry.process_exists(r):
+        return r.pid
+    job_registry.remove(jid, pid=r.pid)
+    return None
+
+
+def _over_quota(jobs, cores, new_cores):
+    """Would another job put a user over cfg.user_max_jobs or user_max_cores?
+
+    A user may always run one job, even if it needs more cores.
+
+    Args:
+        jobs (int): user's running jobs
+        cores (int): cores used by jobs
+        new_cores (int): cores of the new job
+    Returns:
+        bool: True if the new job must not start
+    """
+    if not jobs:
+        return False
+    if cfg.user_max_jobs and jobs >= cfg.user_max_jobs:
+        return True
+    return bool(cfg.user_max_cores and cores + new_cores > cfg.user_max_cores)
+
+
+def _reaper():
+    """Call the functions queued by `_after_exit`"""
+    while True:
+        try:
+            os.read(_reaper_pipe[0], 4096)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+            continue
+        while _reaper_work:
+            func, args, kwargs = _reaper_work.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                pkdlog('{}: error: {}', func, pkdexc())
+
+
+def _start_reaper():
+    """Start the thread which does `_after_exit` work (not in signal context)"""
+    global _reaper_pipe, _reaper_thread
+
+    if _reaper_thread:
+        return
+    with _reaper_lock:
+        if _reaper_thread:
+            return
+        p = os.pipe()
+        fcntl.fcntl(p[1], fcntl.F_SETFL, fcntl.fcntl(p[1], fcntl.F_GETFL) | os.O_NONBLOCK)
+        _reaper_pipe = p
+        t = threading.Thread(target=_reaper, name='runner.reaper')
+        t.daemon = True
+        t.start()
+        _reaper_thread = t
+
+
+def _terminate_pid(pid, poll):
+    """Send SIGTERM then SIGKILL until poll returns non-None
+
+    Args:
+        pid (int): process
+        poll (function): returns None while process exists
+    """
+    for s in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.kill(pid, s)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            return
+        for _ in range(10):
+            if poll() is not None:
+                return
+            time.sleep(.2)
+
+
+cfg = pkconfig.init(
+    slots=dict(
+        fast=(2, int, 'Scheduler: concurrent cheap foreground jobs'),
+        heavy=(1, int, 'Scheduler: concurrent expensive foreground jobs'),
+        parallel=(1, int, 'Scheduler: concurrent parallel (animation) jobs'),
+        sequential=(2, int, 'Scheduler: concurrent foreground jobs'),
+    ),
+    user_max_cores=(0, int, 'Cores (see sirepo.mpi) a user may use at once (0 is unlimited)'),
+    user_max_jobs=(0, int, 'Jobs a user may run at once (0 is unlimited)'),
+    zygote=(False, bool, 'Scheduler: fork foreground jobs from a process with templates imported'),
+)
@@ -9,9 +9,18 @@ from pykern import pkcollections
 from pykern import pkconfig
 from pykern import pkio
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import array_encoding
+from sirepo import blob_store
+from sirepo import db_lock
 from sirepo import feature_config
+from sirepo import frame_cache
+from sirepo import job_metrics
+from sirepo import job_registry
+from sirepo import json_encoder
+from sirepo import result_cache
 from sirepo import runner
 from sirepo import simulation_db
+from sirepo import status_watcher
 from sirepo.template import template_common
 import beaker.middleware
 import datetime
@@ -27,6 +36,7 @@ import sys
 import time
 import werkzeug
 import werkzeug.exceptions
+import zlib
 
 #TODO(pjm): this import is required to work-around template loading in listSimulations, see #1151
 if any(k in feature_config.cfg.sim_types for k in ('rs4pi', 'warppba', 'warpvnd')):
@@ -53,6 +63,15 @@ _PY_PATH_LOCAL_CLASS = type(py.path.local())
 #: What is_running?
 _RUN_STATES = ('pending', 'running')
 
+#: Smaller plot responses aren't worth compressing
+_GZIP_MIN_BYTES = 1024
+
+#: Changes to these fields end api_runStatusWait
+_RUN_STATUS_WAIT_FIELDS = ('frameCount', 'percentComplete', 'state')
+
+#: When the client should retry runSimulation while a superseded job stops
+_SUPERSEDE_RETRY_SECONDS = 1
+
 #: Identifies the user in the Beaker session
 _SESSION_KEY_USER = 'uid'
 
@@ -137,7 +156,7 @@ def api_copySimulation():
     data = simulation_db.read_simulation_json(sim_type, sid=req['simulationId'])
     if not name:
         base_name = data['models']['simulation']['name']
-        names = simulation_db.iterate_simulation_datafiles(sim_type, _simulation_name)
+        names = [r['name'] for r in simulation_db.list_simulations(sim_type)]
         count = 0
         while True:
             count += 1
@@ -185,6 +204,8 @@ def api_downloadDataFile(simulation_type, simulation_id, model, frame, suffix=No
     }
     options = pkcollections.Dict(data)
     options.suffix = suffix
+    options.columns = _csv_columns(flask.request.args.get('columns'))
+    options.pages = _csv_pages(flask.request.args.get('pages'))
     frame = int(frame)
     template = sirepo.template.import_module(data)
     if frame >= 0:
@@ -193,7 +214,7 @@ def api_downloadDataFile(simulation_type, simulation_id, model, frame, suffix=No
         data['report'] = model
     run_dir = simulation_db.simulation_run_dir(data)
     filename, content, content_type = template.get_data_file(run_dir, model, frame, options=options)
-    return _as_attachment(flask.make_response(content), content_type, filename)
+    return _data_file_response(filename, content, content_type)
 app_download_data_file = api_downloadDataFile
 
 
@@ -287,7 +308,7 @@ def api_findByName(simulation_type, application_mode, simulation_name):
         oauth.set_default_state(logged_out_as_anonymous=True)
     redirect_uri = None
     # use the existing named simulation, or copy it from the examples
-    rows = simulation_db.iterate_simulation_datafiles(simulation_type, simulation_db.process_simulation_list, {
+    rows = simulation_db.list_simulations(simulation_type, {
         'simulation.name': simulation_name,
         'simulation.isExample': True,
     })
@@ -295,7 +316,7 @@ def api_findByName(simulation_type, application_mode, simulation_name):
         for s in simulation_db.examples(simulation_type):
             if s['models']['simulation']['name'] == simulation_name:
                 simulation_db.save_new_example(s)
-                rows = simulation_db.iterate_simulation_datafiles(simulation_type, simulation_db.process_simulation_list, {
+                rows = simulation_db.list_simulations(simulation_type, {
                     'simulation.name': simulation_name,
                 })
                 break
@@ -409,6 +430,20 @@ def api_homePage():
 light_landing_page = api_homePage
 
 
+def api_jobMetrics():
+    """Job totals for Prometheus (see `sirepo.job_metrics`)
+
+    Totals are for all users so only served if `cfg.enable_job_metrics`.
+    The front end server should restrict access to the scraper.
+    """
+    if not cfg.enable_job_metrics:
+        werkzeug.exceptions.abort(404)
+    return flask.Response(
+        job_metrics.prometheus_text(),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+
 def api_newSimulation():
     new_simulation_data = _parse_data_input()
     sim_type = new_simulation_data['simulationType']
@@ -498,26 +533,33 @@ app_root = api_root
 def api_runCancel():
     data = _parse_data_input()
     jid = simulation_db.job_id(data)
-    # TODO(robnagler) need to have a way of listing jobs
     # Don't bother with cache_hit check. We don't have any way of canceling
     # if the parameters don't match so for now, always kill.
     #TODO(robnagler) mutex required
     if cfg.job_queue.is_processing(jid):
-        run_dir = simulation_db.simulation_run_dir(data)
-        # Write first, since results are write once, and we want to
-        # indicate the cancel instead of the termination error that
-        # will happen as a result of the kill.
-        simulation_db.write_result({'state': 'canceled'}, run_dir=run_dir)
-        cfg.job_queue.kill(jid)
-        # TODO(robnagler) should really be inside the template (t.cancel_simulation()?)
-        # the last frame file may not be finished, remove it
-        t = sirepo.template.import_module(data)
-        t.remove_last_frame(run_dir)
+        _cancel_job(jid, simulation_db.simulation_run_dir(data), data)
     # Always true from the client's perspective
     return _json_response({'state': 'canceled'})
 app_run_cancel = api_runCancel
 
 
+def api_runCancelAll():
+    """Cancel all of the session user's jobs"""
+    res = 0
+    for j in job_registry.find(simulation_db.job_id_prefix()):
+        if not j.run_dir or not cfg.job_queue.is_processing(j.jid):
+            continue
+        d = py.path.local(j.run_dir)
+        try:
+            data = simulation_db.read_json(d.join(template_common.INPUT_BASE_NAME))
+        except Exception as e:
+            pkdlog('{}: ignoring job without input: {}', j.jid, e)
+            continue
+        _cancel_job(j.jid, d, data)
+        res += 1
+    return _json_response({'state': 'canceled', 'count': res})
+
+
 def api_runSimulation():
     data = _parse_data_input(validate=True)
     res = _simulation_run_status(data, quiet=True)
@@ -528,20 +570,56 @@ def api_runSimulation():
         ) or res.get('parametersChanged', True)
     ):
         try:
-            _start_simulation(data)
+            if not _start_simulation(data):
+                return _json_response({
+                    'nextRequestSeconds': _SUPERSEDE_RETRY_SECONDS,
+                    'state': 'pending',
+                    'superseding': True,
+                })
         except runner.Collision:
             pkdlog('{}: runner.Collision, ignoring start', simulation_db.job_id(data))
+        except runner.Quota as e:
+            pkdlog('{}: runner.Quota: {}', simulation_db.job_id(data), e)
+            return _json_response({'state': 'error', 'error': str(e)})
         res = _simulation_run_status(data)
-    return _json_response(res)
+    return _plot_response(_plot_json(res))
 app_run_simulation = api_runSimulation
 
 
 def api_runStatus():
     data = _parse_data_input()
-    return _json_response(_simulation_run_status(data))
+    return _plot_response(_plot_json(_simulation_run_status(data)))
 app_run_status = api_runStatus
 
 
+def api_runStatusWait():
+    """Like runStatus, but waits for state, percentComplete, or frameCount
+    to differ from lastStatus in the request (see `sirepo.status_watcher`)
+
+    The status is only read again when the run dir's signature differs
+    from the one it was read with.
+    """
+    data = _parse_data_input()
+    last = data.get('lastStatus') or {}
+    run_dir = simulation_db.simulation_run_dir(data)
+    end = time.time() + status_watcher.cfg.wait_seconds
+    s = status_watcher.signature(run_dir)
+    res = _simulation_run_status(data)
+    while 'nextRequest' in res and all(
+        res.get(k) == last.get(k) for k in _RUN_STATUS_WAIT_FIELDS
+    ):
+        r = end - time.time()
+        if r <= 0 or not status_watcher.wait(run_dir, s, r):
+            break
+        n = status_watcher.signature(run_dir)
+        if n == s:
+            # the shared signature was older than ours
+            continue
+        s = n
+        res = _simulation_run_status(data)
+    return _plot_response(_plot_json(res))
+
+
 def api_saveSimulationData():
     data = _parse_data_input(validate=True)
     res = _validate_serial(data)
@@ -594,10 +672,23 @@ def api_simulationFrame(frame_id):
     template = sirepo.template.import_module(data)
     data['report'] = template.get_animation_name(data)
     run_dir = simulation_db.simulation_run_dir(data)
-    model_data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
-    frame = template.get_simulation_frame(run_dir, data, model_data)
-    response = _json_response(frame)
-    if 'error' not in frame and template.WANT_BROWSER_FRAME_CACHE:
+    k = frame_id
+    if array_encoding.is_requested(flask.request):
+        k += '*' + array_encoding.FORMAT
+    res = frame_cache.get(run_dir, k)
+    is_ok = True
+    if res is None:
+        # frames of a running job may change, e.g. the last frame
+        is_final = template.WANT_BROWSER_FRAME_CACHE \
+            or not cfg.job_queue.is_processing(simulation_db.job_id(data))
+        model_data = simulation_db.read_json(run_dir.join(template_common.INPUT_BASE_NAME))
+        frame = template.get_simulation_frame(run_dir, data, model_data)
+        res = _plot_json(frame)
+        is_ok = 'error' not in frame
+        if is_ok and is_final:
+            frame_cache.put(run_dir, k, res)
+    response = _plot_response(res)
+    if is_ok and template.WANT_BROWSER_FRAME_CACHE:
         now = datetime.datetime.utcnow()
         expires = now + datetime.timedelta(365)
         response.headers['Cache-Control'] = 'public, max-age=31536000'
@@ -616,7 +707,7 @@ def api_listSimulations():
     simulation_db.verify_app_directory(sim_type)
     return _json_response(
         sorted(
-            simulation_db.iterate_simulation_datafiles(sim_type, simulation_db.process_simulation_list, search),
+            simulation_db.list_simulations(sim_type, search),
             key=lambda row: row['name'],
         )
     )
@@ -668,13 +759,15 @@ def api_uploadFile(simulation_type, simulation_id, file_type):
             if file_list:
                 err = 'File is in use in other simulations. Please confirm you would like to replace the file for all simulations.'
     if not err:
-        pkio.mkdir_parent_only(p)
-        f.save(str(p))
+        f.save(str(simulation_db.replace_lib_file(p)))
         template = sirepo.template.import_module(simulation_type)
         if hasattr(template, 'validate_file'):
             err = template.validate_file(file_type, str(p))
             if err:
                 pkio.unchecked_remove(p)
+        if not err:
+            # share identical uploads
+            blob_store.link(p, p)
     if err:
         return _json_response({
             'error': err,
@@ -719,6 +812,7 @@ def init(db_dir=None, uwsgi=None):
     else:
         db_dir = cfg.db_dir
     uri_router.init(app, sys.modules[__name__], simulation_db)
+    app.use_x_sendfile = cfg.x_sendfile
     global _wsgi_app
     _wsgi_app = _WSGIApp(app, uwsgi)
     _BeakerSession().sirepo_init_app(app, db_dir)
@@ -833,7 +927,13 @@ class _WSGIApp(object):
     def __call__(self, environ, start_response):
         """An "app" called by uwsgi with requests.
         """
-        self.set_log_user(session_user(checked=False, environ=environ))
+        u = session_user(checked=False, environ=environ)
+        self.set_log_user(u)
+        if u:
+            try:
+                simulation_db.user_accessed(u)
+            except Exception:
+                pkdlog('{}: user_accessed error: {}', u, pkdexc())
         return self.wsgi_app(environ, start_response)
 
 
@@ -884,6 +984,65 @@ def _cfg_time_limit(value):
     return v
 
 
+def _csv_columns(value):
+    """Parse columns=x,xp,t of a csv download"""
+    if not value:
+        return None
+    return [c.strip() for c in value.split(',') if c.strip()] or None
+
+
+def _csv_pages(value):
+    """Parse pages=3, pages=2-5 or pages=2- (one-based, inclusive)"""
+    if not value:
+        return None
+    m = re.search(r'^(\d+)(?:(-)(\d*))?$', value.strip())
+    if not m or int(m.group(1)) < 1:
+        raise werkzeug.exceptions.BadRequest('invalid pages={}'.format(value))
+    first = int(m.group(1))
+    if not m.group(2):
+        return first, first
+    last = int(m.group(3)) if m.group(3) else None
+    if last is not None and last < first:
+        raise werkzeug.exceptions.BadRequest('invalid pages={}'.format(value))
+    return first, last
+
+
+def _data_file_response(filename, content, content_type):
+    """Send the result of a template's get_data_file
+
+    Paths are sent by the front end server with X-Accel-Redirect if
+    cfg.x_accel_redirect, else streamed with Range support so
+    downloads can resume (or named by X-Sendfile if cfg.x_sendfile).
+    Iterators are streamed.
+
+    Args:
+        filename (str): attachment name
+        content (object): py.path, iterator of str, or str
+        content_type (str): mime type
+    Returns:
+        Response: flask response
+    """
+    if isinstance(content, py.path.local):
+        r = content.relto(simulation_db.db_dir())
+        if cfg.x_accel_redirect and r:
+            res = app.response_class()
+            res.headers['X-Accel-Redirect'] = '{}/{}'.format(cfg.x_accel_redirect.rstrip('/'), r)
+            return _as_attachment(res, content_type, filename)
+        # download URLs don't change when the file does
+        res = flask.send_file(
+            str(content),
+            mimetype=content_type,
+            as_attachment=True,
+            attachment_filename=filename,
+            conditional=True,
+            cache_timeout=0,
+        )
+        res.cache_control.public = False
+        res.cache_control.private = True
+        return res
+    return _as_attachment(app.response_class(content), content_type, filename)
+
+
 def _handle_error(error):
     status_code = 500
     if isinstance(error, werkzeug.exceptions.HTTPException):
@@ -897,6 +1056,25 @@ def _handle_error(error):
     return f, status_code
 
 
+def _cancel_job(jid, run_dir, data):
+    """Mark the job canceled and stop it (in the background)
+
+    Args:
+        jid (str): job id
+        run_dir (py.path): where the job runs
+        data (dict): simulationType and report
+    """
+    # Write first, since results are write once, and we want to
+    # indicate the cancel instead of the termination error that
+    # will happen as a result of the kill.
+    simulation_db.write_result({'state': 'canceled'}, run_dir=run_dir)
+    # TODO(robnagler) should really be inside the template (t.cancel_simulation()?)
+    # the last frame file may not be finished, remove it once the job
+    # can no longer write it
+    t = sirepo.template.import_module(data)
+    cfg.job_queue.kill(jid, on_exit=lambda: t.remove_last_frame(run_dir))
+
+
 def _json_input(assert_sim_type=True):
     req = flask.request
     if req.mimetype != 'application/json':
@@ -918,16 +1096,19 @@ def _json_input(assert_sim_type=True):
 def _json_response(value, pretty=False):
     """Generate JSON flask response
 
+    Large plots are streamed (see `sirepo.json_encoder.iterencode`).
+    Everything else is encoded before the response is created so an
+    encoding error is an error response, not truncated json.
+
     Args:
         value (dict): what to format
         pretty (bool): pretty print [False]
     Returns:
         Response: flask response
     """
-    return app.response_class(
-        simulation_db.generate_json(value, pretty=pretty),
-        mimetype=app.config.get('JSONIFY_MIMETYPE', 'application/json'),
-    )
+    if not pretty and json_encoder.is_large(value):
+        return _json_text_response(json_encoder.iterencode(value))
+    return _json_text_response(simulation_db.generate_json(value, pretty=pretty))
 
 
 def _json_response_ok():
@@ -938,10 +1119,25 @@ def _json_response_ok():
     """
     global _JSON_RESPONSE_OK
     if not _JSON_RESPONSE_OK:
-        _JSON_RESPONSE_OK = _json_response({'state': 'ok'})
+        # not streamed so it can be sent more than once
+        _JSON_RESPONSE_OK = _json_text_response(simulation_db.generate_json({'state': 'ok'}))
     return _JSON_RESPONSE_OK
 
 
+def _json_text_response(value):
+    """Generate JSON flask response from serialized JSON
+
+    Args:
+        value (object): json str or generator of str
+    Returns:
+        Response: flask response
+    """
+    return app.response_class(
+        value,
+        mimetype=app.config.get('JSONIFY_MIMETYPE', 'application/json'),
+    )
+
+
 def _mtime_or_now(path):
     """mtime for path if exists else time.time()
 
@@ -975,6 +1171,41 @@ def _parse_data_input(validate=False):
     return simulation_db.fixup_old_data(data)[0] if validate else data
 
 
+def _plot_json(value):
+    """Serialize value, packing arrays if the client asked
+
+    See `sirepo.array_encoding`.
+
+    Args:
+        value (dict): frame or status
+    Returns:
+        str: json
+    """
+    if array_encoding.is_requested(flask.request):
+        value = array_encoding.encode(value)
+    return simulation_db.generate_json(value)
+
+
+def _plot_response(value):
+    """Response from `_plot_json` compressed if the client accepts gzip
+
+    Args:
+        value (str): json
+    Returns:
+        Response: flask response
+    """
+    res = _json_text_response(value)
+    res.vary.add(array_encoding.HEADER)
+    res.vary.add('Accept-Encoding')
+    if len(value) < _GZIP_MIN_BYTES \
+        or 'gzip' not in flask.request.headers.get('Accept-Encoding', ''):
+        return res
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    res.set_data(c.compress(res.get_data()) + c.flush())
+    res.headers['Content-Encoding'] = 'gzip'
+    return res
+
+
 def _render_root_page(page, values):
     values.source_cache_key = _source_cache_key()
     values.app_version = simulation_db.app_version()
@@ -1022,12 +1253,6 @@ def _simulation_data(res, path, data):
     res.append(data)
 
 
-def _simulation_name(res, path, data):
-    """Iterator function to return simulation name
-    """
-    res.append(data['models']['simulation']['name'])
-
-
 def _simulation_run_status(data, quiet=False):
     """Look for simulation status and output
 
@@ -1099,10 +1324,14 @@ def _simulation_run_status(data, quiet=False):
                 rep.cached_hash,
             )
         #TODO(robnagler) verify serial number to see what's newer
-        res.setdefault('startTime', _mtime_or_now(rep.input_file))
+        res.setdefault('startTime', rep.start_time or _mtime_or_now(rep.input_file))
         res.setdefault('lastUpdateTime', _mtime_or_now(rep.run_dir))
         res.setdefault('elapsedTime', res['lastUpdateTime'] - res['startTime'])
         if is_processing:
+            if hasattr(cfg.job_queue, 'queue_position'):
+                p = cfg.job_queue.queue_position(rep.job_id)
+                if p is not None:
+                    res['queuePosition'] = p
             res['nextRequestSeconds'] = simulation_db.poll_seconds(rep.cached_data)
             res['nextRequest'] = {
                 'report': rep.model_name,
@@ -1125,19 +1354,37 @@ def _simulation_run_status(data, quiet=False):
 
 
 def _simulations_using_file(simulation_type, file_type, search_name, ignore_sim_id=None):
+    """Paths of the session user's simulations which use a lib file
+
+    Simulations come from the simulation index, which has already
+    fixed up the data files. The index only holds the simulation model
+    so validate_delete_file gets the data file (usually parsed already
+    by `simulation_db.read_json`).
+
+    Returns:
+        list: folder and name of each simulation
+    """
     res = []
     template = sirepo.template.import_module(simulation_type)
     if not hasattr(template, 'validate_delete_file'):
         return res
-    for row in simulation_db.iterate_simulation_datafiles(simulation_type, _simulation_data):
-        if template.validate_delete_file(row, search_name, file_type):
-            sim = row['models']['simulation']
-            if ignore_sim_id and sim['simulationId'] == ignore_sim_id:
+    for row in simulation_db.list_simulations(simulation_type):
+        if ignore_sim_id and row['simulationId'] == ignore_sim_id:
+            continue
+        try:
+            data = simulation_db.read_json(
+                simulation_db.sim_data_file(simulation_type, row['simulationId']),
+            )
+        except Exception as e:
+            if pkio.exception_is_not_found(e):
+                # deleted since listed
                 continue
-            if sim['folder'] == '/':
-                res.append('/{}'.format(sim['name']))
+            raise
+        if template.validate_delete_file(data, search_name, file_type):
+            if row['folder'] == '/':
+                res.append('/{}'.format(row['name']))
             else:
-                res.append('{}/{}'.format(sim['folder'], sim['name']))
+                res.append('{}/{}'.format(row['folder'], row['name']))
     return res
 
 
@@ -1150,16 +1397,34 @@ def _source_cache_key():
 def _start_simulation(data):
     """Setup and start the simulation.
 
+    Starts are serialized per simulation. If the same job is already
+    running with the same parameters, attach to it (don't touch the
+    run_dir). If the parameters changed, start stopping the running job
+    and return without waiting for it; the client retries.
+
     Args:
         data (dict): app data
     Returns:
-        object: runner instance
+        bool: False if a job with other parameters is still stopping
     """
     data['simulationStatus'] = {
         'startTime': int(time.time()),
         'state': 'pending',
     }
-    cfg.job_queue(data)
+    jid = simulation_db.job_id(data)
+    # examples take the user lock, which must not be taken after a simulation lock
+    simulation_db.simulation_dir(data['simulationType'])
+    with db_lock.simulation(simulation_db.parse_sid(data)):
+        if cfg.job_queue.is_processing(jid):
+            if simulation_db.report_info(data).cache_hit:
+                pkdc('{}: attaching to running job', jid)
+                return True
+            pkdlog('{}: parameters changed, superseding running job', jid)
+            cfg.job_queue.kill(jid)
+            return False
+        if not result_cache.restore(data):
+            cfg.job_queue(data)
+        return True
 
 
 def _validate_serial(data):
@@ -1191,9 +1456,12 @@ cfg = pkconfig.init(
         secure=(False, bool, 'Beaker: Whether or not the session cookie should be marked as secure'),
     ),
     db_dir=(None, _cfg_db_dir, 'where database resides'),
-    job_queue=('Background', runner.cfg_job_queue, 'how to run long tasks: Celery or Background'),
+    job_queue=('Background', runner.cfg_job_queue, 'how to run long tasks: Celery, Background, or Scheduler'),
     foreground_time_limit=(5 * 60, _cfg_time_limit, 'timeout for short (foreground) tasks'),
     oauth_login=(False, bool, 'OAUTH: enable login'),
     enable_source_cache_key=(True, bool, 'enable source cache key, disable to allow local file edits in Chrome'),
     enable_bluesky=(False, bool, 'Enable calling simulations directly from NSLS-II/bluesky'),
+    enable_job_metrics=(False, bool, 'Serve job totals for all users at /job-metrics (internal use only)'),
+    x_accel_redirect=(None, str, 'Downloads: nginx internal location which maps to db_dir'),
+    x_sendfile=(False, bool, 'Downloads: front end server sends files named by X-Sendfile'),
 )
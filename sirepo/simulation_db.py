@@ -11,8 +11,11 @@ from pykern import pkinspect
 from pykern import pkio
 from pykern import pkresource
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import array_encoding
+from sirepo import db_lock
 from sirepo import feature_config
 from sirepo.template import template_common
+import collections
 import copy
 import datetime
 import errno
@@ -20,6 +23,7 @@ import flask
 import glob
 import json
 import numconv
+import numpy
 import os
 import os.path
 import py
@@ -36,12 +40,24 @@ JSON_SUFFIX = '.json'
 #: Schema common values, e.g. version
 SCHEMA_COMMON = None
 
+#: Summary of in.json written by `write_run_input` for `report_info`
+RUN_INFO_FILE = 'run-info' + JSON_SUFFIX
+
 #: Simulation file name is globally unique to avoid collisions with simulation output
 SIMULATION_DATA_FILE = 'sirepo-data' + JSON_SUFFIX
 
+#: Summaries of a user's simulations, one per simulation type directory
+SIMULATION_INDEX_FILE = 'sirepo-index' + JSON_SUFFIX
+
 #: Where server files and static files are found
 STATIC_FOLDER = py.path.local(pkresource.filename('static'))
 
+#: Simulation id to user id index (see `find_global_simulation`) under db_dir
+_GLOBAL_INDEX_DIR = 'global'
+
+#: Marker in _GLOBAL_INDEX_DIR: every simulation has an entry so a miss is final
+_GLOBAL_INDEX_COMPLETE_FILE = 'complete'
+
 #: Verify ID
 _IS_PARALLEL_RE = re.compile('animation', re.IGNORECASE)
 
@@ -63,6 +79,12 @@ _LIB_DIR = 'lib'
 #: Older than any other version
 _OLDEST_VERSION = '20140101.000001'
 
+#: Placeholder key in out.json for an array stored in `_RESULT_ARRAYS_SUFFIX` file
+_RESULT_ARRAY_KEY = '_sirepo_result_array'
+
+#: Binary container for large numeric arrays in results (see `write_result`)
+_RESULT_ARRAYS_SUFFIX = '.npz'
+
 #: Matches cancelation errors in run_log: KeyboardInterrupt probably only happens in dev
 _RUN_LOG_CANCEL_RE = re.compile(r'^KeyboardInterrupt$', flags=re.MULTILINE)
 
@@ -75,21 +97,39 @@ _STATUS_FILE = 'status'
 #: created under dir
 _TMP_DIR = 'tmp'
 
+#: Last access marker in a user's directory (see `user_accessed`)
+_USER_ACCESS_FILE = 'last-access'
+
+#: Entries in _user_access which cause expired entries to be removed
+_USER_ACCESS_MAX = 10000
+
 #: where users live under db_dir
 _USER_ROOT_DIR = 'user'
 
 #: Flask app (init() must be called to set this)
 _app = None
 
+#: App directory and its temporary name while this thread creates it
+_app_dir_creating = threading.local()
+
+#: Parsed json files (see `_JsonCache`)
+_json_cache = None
+
 #: Use to assert _serial_new result. Not perfect but good enough to avoid common problems
 _serial_prev = 0
 
-#: Locking for global operations like serial, user moves, etc.
-_global_lock = threading.RLock()
+#: Locking for _serial_prev (db operations use `sirepo.db_lock`)
+_serial_lock = threading.Lock()
 
 #: sirepo.server module, initialized manually to avoid circularity
 _server = None
 
+#: When this process last marked a uid accessed (see `user_accessed`)
+_user_access = {}
+
+#: Locking for _user_access
+_user_access_lock = threading.Lock()
+
 #: configuration
 cfg = None
 
@@ -100,6 +140,91 @@ class CopyRedirect(Exception):
         self.sr_response = response
 
 
+class _JsonCache(object):
+    """LRU cache of parsed json files
+
+    Entries are keyed by path and validated by the inode, mtime, and
+    size of the file so external writes are seen. Callers get copies so
+    they may modify the result.
+
+    Args:
+        max_bytes (int): budget of file sizes cached (0 disables)
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def read(self, path):
+        """Return a copy of the parsed contents of path
+
+        Args:
+            path (str): file to read
+        Returns:
+            object: json converted to python
+        """
+        path = os.path.abspath(path)
+        try:
+            k = self._key(os.stat(path))
+        except OSError:
+            # open() will raise the appropriate IOError
+            k = None
+        with self._lock:
+            e = self._cache.pop(path, None)
+            if e:
+                if e[0] == k:
+                    self._cache[path] = e
+                    self.hits += 1
+                    return _json_copy(e[1])
+                self._bytes -= e[0][-1]
+            self.misses += 1
+        with open(path) as f:
+            k = self._key(os.fstat(f.fileno()))
+            res = json_load(f)
+        if k[-1] <= self.max_bytes // 4:
+            with self._lock:
+                e = self._cache.pop(path, None)
+                if e:
+                    self._bytes -= e[0][-1]
+                self._cache[path] = (k, res)
+                self._bytes += k[-1]
+                while self._bytes > self.max_bytes:
+                    self._bytes -= self._cache.popitem(last=False)[1][0][-1]
+            return _json_copy(res)
+        return res
+
+    def remove(self, path):
+        """Invalidate path
+
+        Args:
+            path (str): file which is being written
+        """
+        with self._lock:
+            e = self._cache.pop(os.path.abspath(path), None)
+            if e:
+                self._bytes -= e[0][-1]
+
+    def stats(self):
+        with self._lock:
+            return pkcollections.Dict(
+                bytes=self._bytes,
+                files=len(self._cache),
+                hits=self.hits,
+                misses=self.misses,
+            )
+
+    def _key(self, stat):
+        # size must be last (see above)
+        return (
+            stat.st_ino,
+            getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            stat.st_size,
+        )
+
+
 def app_version():
     """Force the version to be dynamic if running in dev channel
 
@@ -114,14 +239,42 @@ def app_version():
 def celery_queue(data):
     """Which queue to execute simulation in
 
+    Parallel jobs run in ``parallel``. Other jobs run in ``sequential``
+    unless cfg.cost_fast_max or cfg.cost_heavy_min is set. Then jobs are
+    routed by the template's ``estimate_cost(data)``, if it has one, to
+    ``fast``, ``sequential``, or ``heavy`` so quick reports don't wait
+    behind slow ones. Before setting either, make sure Celery workers
+    consume the ``fast`` and ``heavy`` queues (see
+    `sirepo.celery_tasks.QUEUE_NAMES`), or those jobs never run.
+
     Args:
         data (dict): simulation parameters
 
     Returns:
-        str: celery queue name
+        str: celery queue name (also used by `sirepo.runner.Scheduler`)
     """
-    from sirepo import celery_tasks
-    return celery_tasks.queue_name(is_parallel(data))
+    if is_parallel(data):
+        return 'parallel'
+    if not (cfg.cost_fast_max or cfg.cost_heavy_min):
+        return 'sequential'
+    t = sirepo.template.import_module(data)
+    c = t.estimate_cost(data) if hasattr(t, 'estimate_cost') else None
+    if c is None:
+        return 'sequential'
+    if c < cfg.cost_fast_max:
+        return 'fast'
+    if cfg.cost_heavy_min and c >= cfg.cost_heavy_min:
+        return 'heavy'
+    return 'sequential'
+
+
+def db_dir():
+    """Root of the database
+
+    Returns:
+        py.path: directory
+    """
+    return _app.sirepo_db_dir
 
 
 def default_data(sim_type):
@@ -144,7 +297,11 @@ def default_data(sim_type):
 def delete_simulation(simulation_type, sid):
     """Deletes the simulation's directory.
     """
-    pkio.unchecked_remove(simulation_dir(simulation_type, sid))
+    with _user_lock(), db_lock.simulation(sid):
+        pkio.unchecked_remove(simulation_dir(simulation_type, sid))
+        _simulation_index_update(simulation_type, sid)
+        _global_index_update(simulation_type, sid)
+        db_lock.remove('simulation', sid)
 
 
 def examples(app):
@@ -160,6 +317,29 @@ def examples(app):
 
 
 def find_global_simulation(simulation_type, sid):
+    """Find the simulation directory in any user's directory
+
+    Looks up the owner in the global index. Once the index is
+    complete (see `rebuild_global_index`), a miss is final. Until then,
+    a miss falls back to checking each user's directory for the
+    simulation, and the index entry is repaired.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        sid (str): simulation id
+    Returns:
+        str: path to simulation directory or None
+    """
+    p = _global_index_path(simulation_type, sid)
+    uid = _global_index_read(p)
+    if uid:
+        res = user_dir_name(uid).join(simulation_type, sid)
+        if res.check(dir=True):
+            return str(res)
+        # user purged or simulation deleted outside of delete_simulation
+        pkio.unchecked_remove(p)
+    if _global_index_is_complete():
+        return None
     global_path = None
     for path in glob.glob(
         str(user_dir_name().join('*', simulation_type, sid))
@@ -169,6 +349,11 @@ def find_global_simulation(simulation_type, sid):
         global_path = path
 
     if global_path:
+        _global_index_update(
+            simulation_type,
+            sid,
+            uid_from_dir_name(py.path.local(global_path).dirpath().dirpath()),
+        )
         return global_path
     return None
 
@@ -229,6 +414,8 @@ def get_schema(sim_type):
         {'feature_config': feature_config.for_sim_type(sim_type)},
     )
     schema['simulationType'] = sim_type
+    # lossy, so sirepo.js only asks for packed arrays if configured
+    schema['arrayEncoding'] = array_encoding.FORMAT if array_encoding.cfg.client else None
     _SCHEMA_CACHE[sim_type] = schema
 
     # merge common models into app models
@@ -299,15 +486,17 @@ def generate_json(data, pretty=False):
     """Convert data to JSON to be send back to client
 
     Use only for responses. Use `:func:write_json` to save.
+    Accepts numpy values (see `sirepo.json_encoder`).
+
     Args:
         data (dict): what to format
         pretty (bool): pretty print [False]
     Returns:
         str: formatted data
     """
-    if pretty:
-        return json.dumps(data, indent=4, separators=(',', ': '), sort_keys=True, allow_nan=False)
-    return json.dumps(data, allow_nan=False)
+    from sirepo import json_encoder
+
+    return json_encoder.dumps(data, pretty=pretty)
 
 
 def hack_nfs_write_status(status, run_dir):
@@ -339,7 +528,7 @@ def iterate_simulation_datafiles(simulation_type, op, search=None):
         path = py.path.local(path)
         try:
             data = open_json_file(simulation_type, path, fixup=False)
-            data, changed = fixup_old_data(data)
+            data, changed = _fixup_on_read(data)
             # save changes to avoid re-applying fixups on each iteration
             if changed:
                 #TODO(pjm): validate_name may causes infinite recursion, need better fixup of list prior to iteration
@@ -360,13 +549,22 @@ def job_id(data):
     Returns:
         str: unique name
     """
-    return '{}-{}-{}'.format(
-        _server.session_user(),
+    return '{}{}-{}'.format(
+        job_id_prefix(),
         data['simulationId'],
         data['report'],
     )
 
 
+def job_id_prefix():
+    """Start of the job ids of the session user
+
+    Returns:
+        str: prefix of `job_id`
+    """
+    return '{}-'.format(_server.session_user())
+
+
 def json_filename(filename, run_dir=None):
     """Append JSON_SUFFIX if necessary and convert to str
 
@@ -384,6 +582,15 @@ def json_filename(filename, run_dir=None):
     return py.path.local(filename)
 
 
+def json_cache_stats():
+    """Hit/miss counters and usage of the parsed json cache
+
+    Returns:
+        Dict: bytes, files, hits, misses
+    """
+    return _json_cache.stats()
+
+
 def json_load(*args, **kwargs):
     #TODO(robnagler) see https://github.com/radiasoft/sirepo/issues/379
     # Should work to use pkcollections.Dict
@@ -391,11 +598,45 @@ def json_load(*args, **kwargs):
     return pkcollections.json_load_any(*args, **kwargs)
 
 
+def list_simulations(simulation_type, search=None):
+    """Summaries of the session user's simulations
+
+    Answered from the simulation index, which is revalidated against
+    the mtime and size of each data file so only new or modified
+    simulations are parsed. Searches on fields outside of
+    ``simulation`` are not indexed and fall back to
+    `iterate_simulation_datafiles`.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        search (dict): field paths (e.g. simulation.folder) and values to match
+
+    Returns:
+        list: rows in `process_simulation_list` format
+    """
+    if search and not _search_is_indexed(search):
+        return iterate_simulation_datafiles(
+            simulation_type,
+            process_simulation_list,
+            search,
+        )
+    res = []
+    for sid, e in sorted(_simulation_index(simulation_type).items()):
+        if search and not _search_data(
+            pkcollections.Dict(models=pkcollections.Dict(simulation=e.simulation)),
+            search,
+        ):
+            continue
+        res.append(_simulation_list_row(sid, e.mtime, e.simulation))
+    return res
+
+
 def move_user_simulations(to_uid):
     """Moves all non-example simulations for the current session into the target user's dir.
     """
     from_uid = _server.session_user()
-    with _global_lock:
+    a, b = sorted((from_uid, to_uid))
+    with db_lock.user(a), db_lock.user(b):
         for path in glob.glob(
                 str(user_dir_name(from_uid).join('*', '*', SIMULATION_DATA_FILE)),
         ):
@@ -408,6 +649,11 @@ def move_user_simulations(to_uid):
             pkdlog('{} -> {}', dir_path, new_dir_path)
             pkio.mkdir_parent(new_dir_path)
             os.rename(dir_path, new_dir_path)
+            _global_index_update(
+                os.path.basename(os.path.dirname(dir_path)),
+                _sid_from_path(path),
+                to_uid,
+            )
 
 
 def open_json_file(sim_type, path=None, sid=None, fixup=True):
@@ -446,11 +692,10 @@ def open_json_file(sim_type, path=None, sid=None, fixup=True):
         raise werkzeug.exceptions.NotFound()
     data = None
     try:
-        with open(str(path)) as f:
-            data = json_load(f)
-            # ensure the simulationId matches the path
-            if sid:
-                data['models']['simulation']['simulationId'] = _sid_from_path(path)
+        data = _json_cache.read(str(path))
+        # ensure the simulationId matches the path
+        if sid:
+            data['models']['simulation']['simulationId'] = _sid_from_path(path)
     except Exception as e:
         pkdlog('{}: error: {}', path, pkdexc())
         raise
@@ -515,24 +760,24 @@ def prepare_simulation(data):
     Returns:
         list, py.path: pkcli command, simulation directory
     """
-    run_dir = simulation_run_dir(data, remove_dir=True)
-    #TODO(robnagler) create a lock_dir -- what node/pid/thread to use?
-    #   probably can only do with celery.
-    pkio.mkdir_parent(run_dir)
-    write_status('pending', run_dir)
-    sim_type = data['simulationType']
     sid = parse_sid(data)
-    template = sirepo.template.import_module(data)
-    template_common.copy_lib_files(data, None, run_dir)
-
-    write_json(run_dir.join(template_common.INPUT_BASE_NAME), data)
-    #TODO(robnagler) encapsulate in template
-    is_p = is_parallel(data)
-    template.write_parameters(
-        data,
-        run_dir=run_dir,
-        is_parallel=is_p,
-    )
+    # examples take the user lock, which must not be taken after a simulation lock
+    simulation_dir(data['simulationType'])
+    with db_lock.simulation(sid):
+        run_dir = simulation_run_dir(data, remove_dir=True)
+        pkio.mkdir_parent(run_dir)
+        write_status('pending', run_dir)
+        template = sirepo.template.import_module(data)
+        template_common.copy_lib_files(data, None, run_dir)
+
+        write_run_input(data, run_dir)
+        #TODO(robnagler) encapsulate in template
+        is_p = is_parallel(data)
+        template.write_parameters(
+            data,
+            run_dir=run_dir,
+            is_parallel=is_p,
+        )
     cmd = [
         pkinspect.root_package(template),
         pkinspect.module_basename(template),
@@ -543,17 +788,68 @@ def prepare_simulation(data):
 
 
 def process_simulation_list(res, path, data):
-    sim = data['models']['simulation']
-    res.append({
-        'simulationId': _sid_from_path(path),
-        'name': sim['name'],
-        'folder': sim['folder'],
-        'last_modified': datetime.datetime.fromtimestamp(
-            os.path.getmtime(str(path))
-        ).strftime('%Y-%m-%d %H:%M'),
-        'isExample': sim['isExample'] if 'isExample' in sim else False,
-        'simulation': sim,
-    })
+    res.append(
+        _simulation_list_row(
+            _sid_from_path(path),
+            os.path.getmtime(str(path)),
+            data['models']['simulation'],
+        ),
+    )
+
+
+def rebuild_global_index():
+    """Recreate the simulation id to user index from the user directories
+
+    Stale entries are removed. When done, the index is marked
+    complete so `find_global_simulation` no longer searches user
+    directories on a miss. Run once after an upgrade.
+
+    Returns:
+        int: number of simulations indexed
+    """
+    d = _global_index_dir()
+    seen = set()
+    for path in pkio.sorted_glob(user_dir_name().join('*', '*', '*', SIMULATION_DATA_FILE)):
+        sid_dir = path.dirpath()
+        sim_type = sid_dir.dirpath().basename
+        try:
+            uid = uid_from_dir_name(sid_dir.dirpath().dirpath())
+            sid = _sid_from_path(path)
+        except (AssertionError, RuntimeError) as e:
+            pkdlog('{}: ignoring: {}', path, e)
+            continue
+        k = (sim_type, sid)
+        if k in seen:
+            pkdlog('{}: duplicate value for global sid, ignoring', sid_dir)
+            continue
+        seen.add(k)
+        _global_index_update(sim_type, sid, uid)
+    for p in pkio.sorted_glob(d.join('*', '*')):
+        if (p.dirpath().basename, p.basename) in seen:
+            continue
+        # may have been created after the glob above
+        uid = _global_index_read(p)
+        if not (uid and user_dir_name(uid).join(p.dirpath().basename, p.basename).check(dir=True)):
+            pkio.unchecked_remove(p)
+    _write_text_atomic(d.join(_GLOBAL_INDEX_COMPLETE_FILE), '')
+    return len(seen)
+
+
+def replace_lib_file(path):
+    """Prepare to write a file in a lib directory
+
+    Library files are hard links to read-only blobs shared with other
+    users (see `sirepo.blob_store`) so they must be removed before
+    being written.
+
+    Args:
+        path (py.path): file which will be written
+    Returns:
+        py.path: path
+    """
+    pkio.unchecked_remove(path)
+    pkio.mkdir_parent_only(path)
+    return path
 
 
 def read_json(filename):
@@ -565,8 +861,7 @@ def read_json(filename):
     Returns:
         object: json converted to python
     """
-    with open(str(json_filename(filename))) as f:
-        return json_load(f)
+    return _json_cache.read(str(json_filename(filename)))
 
 
 def read_result(run_dir):
@@ -582,7 +877,7 @@ def read_result(run_dir):
     res = None
     err = None
     try:
-        res = read_json(fn)
+        res = _result_restore_arrays(read_json(fn), run_dir)
     except Exception as e:
         pkdc('{}: exception={}', fn, e)
         err = pkdexc()
@@ -622,7 +917,7 @@ def read_simulation_json(sim_type, *args, **kwargs):
         data (dict): simulation data
     """
     data = open_json_file(sim_type, fixup=False, *args, **kwargs)
-    new, changed = fixup_old_data(data)
+    new, changed = _fixup_on_read(data)
     if changed:
         return save_simulation_json(new)
     return data
@@ -649,6 +944,12 @@ def report_info(data):
     Only a hit if the models between data and cache match exactly. Otherwise,
     return cached data if it's there and valid.
 
+    cached_data is the summary written by `write_run_input`
+    (jobId, report, reportParametersHash, simulationId, simulationType,
+    startTime), not the full input, which is only parsed for run dirs
+    created before the summary existed. Use `read_json` on input_file
+    if the models are needed.
+
     Args:
         data (dict): parameters identifying run_dir and models or reportParametersHash
 
@@ -664,6 +965,7 @@ def report_info(data):
         model_name=data['report'],
         parameters_changed=False,
         run_dir=simulation_run_dir(data),
+        start_time=None,
     )
     rep.input_file = json_filename(template_common.INPUT_BASE_NAME, rep.run_dir)
     rep.job_status = read_status(rep.run_dir)
@@ -672,9 +974,10 @@ def report_info(data):
         return rep
     #TODO(robnagler) Lock
     try:
-        cd = read_json(rep.input_file)
-        rep.cached_hash = template_common.report_parameters_hash(cd)
+        cd = _run_info(rep)
+        rep.cached_hash = cd.reportParametersHash
         rep.cached_data = cd
+        rep.start_time = cd.get('startTime')
         if rep.req_hash == rep.cached_hash:
             rep.cache_hit = True
             return rep
@@ -695,6 +998,8 @@ def save_new_example(data):
 def save_new_simulation(data, do_validate=True):
     d = simulation_dir(data.simulationType)
     sid = _random_id(d, data.simulationType).id
+    # repairs the reservation if a concurrent lookup saw it as stale
+    _global_index_update(data.simulationType, sid, uid_from_dir_name(d.dirpath()))
     data.models.simulation.simulationId = sid
     return save_simulation_json(data, do_validate=do_validate)
 
@@ -714,7 +1019,7 @@ def save_simulation_json(data, do_validate=True):
     data = fixup_old_data(data)[0]
     s = data.models.simulation
     fn = sim_data_file(data.simulationType, s.simulationId)
-    with _global_lock:
+    with _user_lock(), db_lock.simulation(s.simulationId):
         need_validate = True
         try:
             # OPTIMIZATION: If folder/name same, avoid reading entire folder
@@ -728,6 +1033,7 @@ def save_simulation_json(data, do_validate=True):
             _validate_name(data)
         s.simulationSerial = _serial_new()
         write_json(fn, data)
+        _simulation_index_update(data.simulationType, s.simulationId, data)
     return data
 
 
@@ -747,11 +1053,26 @@ def sim_data_file(sim_type, sim_id):
 def simulation_dir(simulation_type, sid=None):
     """Generates simulation directory from sid and simulation_type
 
+    The app directory is created with examples and library files on
+    first use so new users only pay for the apps they visit.
+
     Args:
         simulation_type (str): srw, warppba, ...
         sid (str): simulation id (optional)
     """
     d = _user_dir().join(sirepo.template.assert_sim_type(simulation_type))
+    if not d.check(dir=True):
+        c = getattr(_app_dir_creating, 'value', None)
+        if c and c[0] == d:
+            # template fixups of the examples, e.g. srw reads lib files
+            d = c[1]
+            if not sid:
+                return d
+            return d.join(sid)
+        with _user_lock():
+            # another request may have created it while we waited
+            if not d.check(dir=True):
+                _create_example_and_lib_files(simulation_type)
     if not sid:
         return d
     if not _ID_RE.search(sid):
@@ -812,6 +1133,42 @@ def uid_from_dir_name(dir_name):
     return res
 
 
+def user_accessed(uid):
+    """Record that a user made a request
+
+    Touches a marker in the user's directory at most once per
+    cfg.user_access_interval so `user_last_access` doesn't have to
+    walk the directory. Only touches the marker, i.e. purging users
+    (`sirepo.pkcli.admin.purge_users`) is never done by requests.
+
+    Args:
+        uid (str): user id
+    """
+    now = time.time()
+    with _user_access_lock:
+        if now - _user_access.get(uid, 0) < cfg.user_access_interval:
+            return
+        if len(_user_access) >= _USER_ACCESS_MAX:
+            # expired entries would be touched anyway
+            for k, v in list(_user_access.items()):
+                if now - v >= cfg.user_access_interval:
+                    del _user_access[k]
+            if len(_user_access) >= _USER_ACCESS_MAX:
+                _user_access.clear()
+        _user_access[uid] = now
+    d = user_dir_name(uid)
+    if not d.check(dir=True):
+        # don't create directories for stale sessions
+        return
+    f = d.join(_USER_ACCESS_FILE)
+    try:
+        os.utime(str(f), None)
+    except Exception as e:
+        if not pkio.exception_is_not_found(e):
+            raise
+        pkio.write_text(f, '')
+
+
 def user_dir_name(uid=None):
     """String name for user name
 
@@ -820,12 +1177,28 @@ def user_dir_name(uid=None):
     Return:
         py.path: directory name
     """
-    d = _app.sirepo_db_dir.join(_USER_ROOT_DIR)
+    d = db_dir().join(_USER_ROOT_DIR)
     if not uid:
         return d
     return d.join(uid)
 
 
+def user_last_access(uid):
+    """When the user last made a request
+
+    Args:
+        uid (str): user id
+    Returns:
+        float: mtime of access marker or None if no marker
+    """
+    try:
+        return os.path.getmtime(str(user_dir_name(uid).join(_USER_ACCESS_FILE)))
+    except Exception as e:
+        if pkio.exception_is_not_found(e):
+            return None
+        raise
+
+
 def validate_serial(req_data):
     """Verify serial in data validates
 
@@ -835,9 +1208,10 @@ def validate_serial(req_data):
     Returns:
         object: None if all ok, or json response (bad)
     """
-    with _global_lock:
-        sim_type = sirepo.template.assert_sim_type(req_data['simulationType'])
-        sid = parse_sid(req_data)
+    sim_type = sirepo.template.assert_sim_type(req_data['simulationType'])
+    sid = parse_sid(req_data)
+    # user lock, because read_simulation_json may save
+    with _user_lock(), db_lock.simulation(sid):
         req_ser = req_data['models']['simulation']['simulationSerial']
         curr = read_simulation_json(sim_type, sid=sid)
         curr_ser = curr['models']['simulation']['simulationSerial']
@@ -858,25 +1232,28 @@ def validate_serial(req_data):
 def verify_app_directory(simulation_type):
     """Ensure the app directory is present. If not, create it and add example files.
     """
-    d = simulation_dir(simulation_type)
-    if d.exists():
-        return
-    _create_example_and_lib_files(simulation_type)
+    simulation_dir(simulation_type)
 
 
-def write_json(filename, data):
+def write_json(filename, data, pretty=True):
     """Write data as json to filename
 
     Args:
         filename (py.path or str): will append JSON_SUFFIX if necessary
+        pretty (bool): indent and sort keys [True]
     """
-    with open(str(json_filename(filename)), 'w') as f:
-        f.write(generate_json(data, pretty=True))
+    fn = json_filename(filename)
+    _json_cache.remove(str(fn))
+    _write_text_atomic(fn, generate_json(data, pretty=pretty))
 
 
 def write_result(result, run_dir=None):
     """Write simulation result to standard output.
 
+    Large numeric lists (e.g. z_matrix) are stored as binary arrays in
+    a file next to out.json, which is written compactly. `read_result`
+    restores them.
+
     Args:
         result (dict): will set state to completed
         run_dir (py.path): Defaults to current dir
@@ -889,7 +1266,20 @@ def write_result(result, run_dir=None):
         # closest to the reason is stopped (e.g. canceled)
         return
     result.setdefault('state', 'completed')
-    write_json(fn, result)
+    arrays = {}
+    res = _result_extract_arrays(result, arrays)
+    b = fn.new(ext=_RESULT_ARRAYS_SUFFIX)
+    if arrays:
+
+        def _write(path):
+            with open(str(path), 'wb') as f:
+                numpy.savez(f, **arrays)
+
+        # before out.json, which tells readers the result is complete
+        _write_atomic(b, _write)
+    else:
+        pkio.unchecked_remove(b)
+    write_json(fn, res, pretty=False)
     write_status(result['state'], run_dir)
     input_file = json_filename(template_common.INPUT_BASE_NAME, run_dir)
     if input_file.exists():
@@ -898,6 +1288,28 @@ def write_result(result, run_dir=None):
             template.clean_run_dir(run_dir)
 
 
+def write_run_input(data, run_dir):
+    """Write in.json and the summary `report_info` reads
+
+    Args:
+        data (dict): report and models
+        run_dir (py.path): where to write
+    """
+    write_json(run_dir.join(template_common.INPUT_BASE_NAME), data)
+    write_json(
+        run_dir.join(RUN_INFO_FILE),
+        pkcollections.Dict(
+            jobId=job_id(data),
+            report=data['report'],
+            reportParametersHash=template_common.report_parameters_hash(data),
+            simulationId=parse_sid(data),
+            simulationType=data['simulationType'],
+            startTime=int(time.time()),
+        ),
+        pretty=False,
+    )
+
+
 def write_status(status, run_dir):
     """Write status to simulation
 
@@ -909,22 +1321,55 @@ def write_status(status, run_dir):
 
 
 def _create_example_and_lib_files(simulation_type):
-    d = simulation_dir(simulation_type)
-    pkio.mkdir_parent(d)
-    for s in examples(simulation_type):
-        save_new_example(s)
-    d = simulation_lib_dir(simulation_type)
-    pkio.mkdir_parent(d)
-    template = sirepo.template.import_module(simulation_type)
-    if hasattr(template, 'resource_files'):
-        for f in template.resource_files():
-            #TODO(pjm): symlink has problems in containers
-            # d.join(f.basename).mksymlinkto(f)
-            f.copy(d)
+    """Create the session user's app directory with examples and lib files
+
+    The directory is built under a temporary name and renamed into
+    place so other processes never see a partial set of examples, and
+    a failure leaves no directory so the next request tries again.
+    The simulation index is built on the first read.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+    """
+    from sirepo import blob_store
+
+    u = _user_dir()
+    t = u.join('.{}.{}'.format(simulation_type, random.random()))
+    sids = []
+    try:
+        # simulation_dir returns t while the examples are fixed up
+        _app_dir_creating.value = (u.join(simulation_type), t)
+        d = pkio.mkdir_parent(t.join(_LIB_DIR))
+        template = sirepo.template.import_module(simulation_type)
+        if hasattr(template, 'resource_files'):
+            for f in template.resource_files():
+                #TODO(pjm): symlink has problems in containers
+                # d.join(f.basename).mksymlinkto(f)
+                blob_store.link(f, d.join(f.basename))
+        for s in examples(simulation_type):
+            s.models.simulation.isExample = True
+            s = fixup_old_data(s)[0]
+            i = _random_id(t, simulation_type).id
+            sids.append(i)
+            s.models.simulation.simulationId = i
+            s.models.simulation.simulationSerial = _serial_new()
+            write_json(t.join(i, SIMULATION_DATA_FILE), s)
+        os.rename(str(t), str(u.join(simulation_type)))
+    except Exception:
+        pkio.unchecked_remove(t)
+        for i in sids:
+            _global_index_update(simulation_type, i)
+        raise
+    finally:
+        _app_dir_creating.value = None
+    uid = uid_from_dir_name(u)
+    for i in sids:
+        # repairs reservations a concurrent lookup saw as stale
+        _global_index_update(simulation_type, i, uid)
 
 
 def _find_user_simulation_copy(simulation_type, sid):
-    rows = iterate_simulation_datafiles(simulation_type, process_simulation_list, {
+    rows = list_simulations(simulation_type, {
         'simulation.outOfSessionSimulationId': sid,
     })
     if len(rows):
@@ -932,22 +1377,157 @@ def _find_user_simulation_copy(simulation_type, sid):
     return None
 
 
+def _fixup_on_read(data):
+    """Apply `fixup_old_data` to a document read from the db
+
+    Skipped if cfg.fixup_on_read is false, which means the db has been
+    upgraded with ``sirepo db migrate``.
+
+    Args:
+        data (dict): simulation data
+    Returns:
+        dict: upgraded `data`
+        bool: True if data changed
+    """
+    if cfg.fixup_on_read:
+        return fixup_old_data(data)
+    if data.get('version') != SCHEMA_COMMON['version']:
+        pkdlog(
+            'version={} sid={}: not current, run sirepo db migrate',
+            data.get('version'),
+            data.get('models', {}).get('simulation', {}).get('simulationId'),
+        )
+    return data, False
+
+
+def _global_index_dir():
+    return db_dir().join(_GLOBAL_INDEX_DIR)
+
+
+def _global_index_path(simulation_type, sid):
+    return _global_index_dir().join(simulation_type, sid)
+
+
+def _global_index_is_complete():
+    """Is every simulation in the global index?
+
+    True after `rebuild_global_index` or when the first user is
+    created by this index writer, because every path which creates
+    simulations updates the index.
+
+    Returns:
+        bool: True if a miss is final
+    """
+    p = _global_index_dir().join(_GLOBAL_INDEX_COMPLETE_FILE)
+    if p.check(file=True):
+        return True
+    u = user_dir_name()
+    if u.check(dir=True) and os.listdir(str(u)):
+        return False
+    # new db: nothing to index
+    _write_text_atomic(p, '')
+    return True
+
+
+def _global_index_read(path):
+    """Read the user id in a global index entry
+
+    Args:
+        path (py.path): index entry
+    Returns:
+        str: uid or None if no entry
+    """
+    try:
+        return pkio.read_text(path).strip() or None
+    except IOError as e:
+        if pkio.exception_is_not_found(e):
+            return None
+        raise
+
+
+def _global_index_update(simulation_type, sid, uid=None):
+    """Add, replace, or remove (uid is None) a global index entry
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        sid (str): simulation id
+        uid (str): owner of simulation [None]
+    """
+    p = _global_index_path(simulation_type, sid)
+    if not uid:
+        pkio.unchecked_remove(p)
+        return
+    _write_text_atomic(p, uid)
+
+
+def _global_index_reserve(simulation_type, sid, uid):
+    """Create a global index entry if none exists
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        sid (str): simulation id
+        uid (str): owner of simulation
+    Returns:
+        bool: True if created, False if sid is in use
+    """
+    p = _global_index_path(simulation_type, sid)
+    pkio.mkdir_parent_only(p)
+    try:
+        fd = os.open(str(p), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise
+    try:
+        os.write(fd, uid.encode('ascii'))
+    finally:
+        os.close(fd)
+    return True
+
+
 def _init():
     global SCHEMA_COMMON
     with open(str(STATIC_FOLDER.join('json/schema-common{}'.format(JSON_SUFFIX)))) as f:
         SCHEMA_COMMON = json_load(f)
     global cfg
     cfg = pkconfig.init(
+        cost_fast_max=(0.0, float, 'Jobs with estimate_cost below this run in the fast queue, e.g. 1e5 (0 disables; workers must consume fast)'),
+        cost_heavy_min=(0.0, float, 'Jobs with estimate_cost at least this run in the heavy queue, e.g. 5e6 (0 disables; workers must consume heavy)'),
+        fixup_on_read=(True, bool, 'Upgrade old documents when read; disable after running sirepo db migrate'),
+        json_cache_bytes=(32 * 1024 * 1024, int, 'Bytes of json files to keep parsed in memory (0 disables)'),
         nfs_tries=(10, int, 'How many times to poll in hack_nfs_write_status'),
         nfs_sleep=(0.5, float, 'Seconds sleep per hack_nfs_write_status poll'),
+        result_array_min=(1024, int, 'Numeric lists in results with this many elements or more are stored in binary'),
+        user_access_interval=(3600, int, 'Seconds between updates of a user\'s last access marker'),
     )
+    global _json_cache
+    _json_cache = _JsonCache(cfg.json_cache_bytes)
+
+
+def _json_copy(value):
+    """Copy json data faster than `copy.deepcopy`
+
+    Args:
+        value (object): result of `json_load`
+    Returns:
+        object: copy of value
+    """
+    if isinstance(value, dict):
+        return value.__class__((k, _json_copy(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_json_copy(v) for v in value]
+    return value
 
 
 def _random_id(parent_dir, simulation_type=None):
     """Create a random id in parent_dir
 
+    With simulation_type, the id is reserved in the global index
+    first so it is unique across all users without searching them.
+
     Args:
         parent_dir (py.path): where id should be unique
+        simulation_type (str): reserve id in global index [None]
     Returns:
         dict: id (str) and path (py.path)
     """
@@ -956,17 +1536,19 @@ def _random_id(parent_dir, simulation_type=None):
     # Generate cryptographically secure random string
     for _ in range(5):
         i = ''.join(r.choice(_ID_CHARS) for x in range(_ID_LEN))
-        if simulation_type:
-            if find_global_simulation(simulation_type, i):
-                continue
+        if simulation_type and not _global_index_reserve(
+            simulation_type,
+            i,
+            uid_from_dir_name(parent_dir.dirpath()),
+        ):
+            continue
         d = parent_dir.join(i)
         try:
             os.mkdir(str(d))
             return pkcollections.Dict(id=i, path=d)
         except OSError as e:
-            if e.errno == errno.EEXIST:
-                pass
-            raise
+            if e.errno != errno.EEXIST:
+                raise
     raise RuntimeError('{}: failed to create unique directory'.format(parent_dir))
 
 
@@ -1000,6 +1582,105 @@ def _search_data(data, search):
     return True
 
 
+def _result_extract_arrays(value, arrays):
+    """Replace large numeric lists with placeholders
+
+    The size is the total number of elements so a matrix is stored as
+    one array even if its rows are short. Lists which are not finite
+    are left alone so `generate_json` fails the same way it would
+    without arrays.
+
+    Args:
+        value (object): part of result
+        arrays (dict): name to numpy array (updated)
+    Returns:
+        object: value or copy with placeholders
+    """
+    if isinstance(value, dict):
+        return value.__class__(
+            (k, _result_extract_arrays(v, arrays)) for k, v in value.items()
+        )
+    if not isinstance(value, (list, tuple, numpy.ndarray)):
+        return value
+    try:
+        a = numpy.asarray(value)
+        if a.size >= cfg.result_array_min and a.dtype.kind in 'fiu' \
+            and numpy.isfinite(a).all():
+            k = 'a{}'.format(len(arrays))
+            arrays[k] = a
+            return {_RESULT_ARRAY_KEY: k}
+    except ValueError:
+        # ragged
+        pass
+    return [_result_extract_arrays(v, arrays) for v in value]
+
+
+def _result_restore_arrays(value, run_dir, arrays=None):
+    """Replace placeholders created by `_result_extract_arrays`
+
+    Args:
+        value (object): part of result (modified)
+        run_dir (py.path): where the arrays file is
+        arrays (list): lazily loaded arrays file
+    Returns:
+        object: value with lists
+    """
+    if arrays is None:
+        arrays = []
+    if isinstance(value, dict):
+        if _RESULT_ARRAY_KEY in value:
+            if not arrays:
+                fn = json_filename(template_common.OUTPUT_BASE_NAME, run_dir)
+                with numpy.load(str(fn.new(ext=_RESULT_ARRAYS_SUFFIX))) as f:
+                    arrays.append(dict(f.items()))
+            return arrays[0][value[_RESULT_ARRAY_KEY]].tolist()
+        for k, v in value.items():
+            value[k] = _result_restore_arrays(v, run_dir, arrays)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            value[i] = _result_restore_arrays(v, run_dir, arrays)
+    return value
+
+
+def _run_info(rep):
+    """Read the summary of the input in the run_dir
+
+    Args:
+        rep (Dict): run_dir and input_file
+    Returns:
+        Dict: summary written by `write_run_input`
+    """
+    try:
+        return read_json(rep.run_dir.join(RUN_INFO_FILE))
+    except Exception as e:
+        if not pkio.exception_is_not_found(e):
+            raise
+    # run_dir created before RUN_INFO_FILE
+    d = read_json(rep.input_file)
+    return pkcollections.Dict(
+        report=d['report'],
+        reportParametersHash=template_common.report_parameters_hash(d),
+        simulationId=d['simulationId'],
+        simulationType=d['simulationType'],
+    )
+
+
+def _search_is_indexed(search):
+    """Can `search` be answered by the simulation index?
+
+    Args:
+        search (dict): field paths and values
+    Returns:
+        bool: True if all fields are in the simulation model
+    """
+    for field in search:
+        path = field.split('.')
+        # single element paths are ignored by _search_data
+        if len(path) > 1 and path[0] != 'simulation':
+            return False
+    return True
+
+
 def _serial_new():
     """Generate a serial number
 
@@ -1012,7 +1693,7 @@ def _serial_new():
     """
     global _serial_prev
     res = int(time.time() * 1000000)
-    with _global_lock:
+    with _serial_lock:
         # Good enough assertion. Any collisions will also be detected
         # by parameter hash so order isn't only validation
         assert res > _serial_prev, \
@@ -1021,6 +1702,117 @@ def _serial_new():
     return res
 
 
+def _simulation_index(simulation_type):
+    """Read and revalidate the session user's simulation index
+
+    Entries are keyed by simulation id and hold the mtime and size of
+    the data file along with its simulation model. An entry is rebuilt
+    (with fixups applied and saved) when the data file does not match,
+    so the index is a cache which may be deleted at any time.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+    Returns:
+        Dict: simulation id to entry
+    """
+    d = simulation_dir(simulation_type)
+    fn = d.join(SIMULATION_INDEX_FILE)
+    with _user_lock():
+        try:
+            prev = read_json(fn)
+        except Exception as e:
+            if not pkio.exception_is_not_found(e):
+                pkdlog('{}: rebuilding index: {}', fn, e)
+            prev = pkcollections.Dict()
+        res = pkcollections.Dict()
+        for path in glob.glob(str(d.join('*', SIMULATION_DATA_FILE))):
+            path = py.path.local(path)
+            try:
+                sid = _sid_from_path(path)
+                s = os.stat(str(path))
+                e = prev.get(sid)
+                if e and e.mtime == s.st_mtime and e.size == s.st_size:
+                    res[sid] = e
+                    continue
+                data = open_json_file(simulation_type, path, fixup=False)
+                data, changed = _fixup_on_read(data)
+                # save changes to avoid re-applying fixups on each iteration
+                if changed:
+                    save_simulation_json(data, do_validate=False)
+                    s = os.stat(str(path))
+                res[sid] = _simulation_index_entry(s, data)
+            except (OSError, RuntimeError, ValueError) as e:
+                pkdlog('{}: error: {}', path, e)
+        if res != prev:
+            write_json(fn, res)
+    return res
+
+
+def _simulation_index_entry(stat, data):
+    """Index entry for a simulation data file
+
+    Args:
+        stat (posix.stat_result): of the data file
+        data (dict): simulation data
+    Returns:
+        Dict: entry
+    """
+    return pkcollections.Dict(
+        mtime=stat.st_mtime,
+        size=stat.st_size,
+        simulation=data.models.simulation,
+    )
+
+
+def _simulation_index_update(simulation_type, sid, data=None):
+    """Replace or remove (data is None) a simulation in the index
+
+    Nothing is done if the index does not exist, since it will be
+    built on the next read.
+
+    Args:
+        simulation_type (str): srw, warppba, ...
+        sid (str): simulation id
+        data (dict): what was written to the data file [None]
+    """
+    fn = simulation_dir(simulation_type).join(SIMULATION_INDEX_FILE)
+    with _user_lock():
+        try:
+            index = read_json(fn)
+        except Exception:
+            return
+        if data:
+            index[sid] = _simulation_index_entry(
+                os.stat(str(sim_data_file(simulation_type, sid))),
+                data,
+            )
+        elif sid in index:
+            del index[sid]
+        else:
+            return
+        write_json(fn, index)
+
+
+def _simulation_list_row(sid, mtime, sim):
+    """Row returned by `process_simulation_list`
+
+    Args:
+        sid (str): simulation id
+        mtime (float): modification time of data file
+        sim (dict): simulation model
+    Returns:
+        dict: row
+    """
+    return {
+        'simulationId': sid,
+        'name': sim['name'],
+        'folder': sim['folder'],
+        'last_modified': datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M'),
+        'isExample': sim['isExample'] if 'isExample' in sim else False,
+        'simulation': sim,
+    }
+
+
 def _sid_from_path(path):
     sid = os.path.split(os.path.split(str(path))[0])[1]
     if not _ID_RE.search(sid):
@@ -1028,6 +1820,15 @@ def _sid_from_path(path):
     return sid
 
 
+def _user_lock():
+    """Lock the session user's directory
+
+    Returns:
+        object: context manager
+    """
+    return db_lock.user(_server.session_user())
+
+
 def _validate_name(data):
     """Validate and if necessary uniquify name
 
@@ -1037,14 +1838,13 @@ def _validate_name(data):
     starts_with = pkcollections.Dict()
     s = data.models.simulation
     n = s.name
-    for d in iterate_simulation_datafiles(
+    for r in list_simulations(
         data.simulationType,
-        lambda res, _, d: res.append(d),
         {'simulation.folder': s.folder},
     ):
-        n2 = d.models.simulation.name
-        if n2.startswith(n) and d.models.simulation.simulationId != s.simulationId:
-            starts_with[n2] = d.models.simulation.simulationId
+        n2 = r['name']
+        if n2.startswith(n) and r['simulationId'] != s.simulationId:
+            starts_with[n2] = r['simulationId']
     if n in starts_with:
         _validate_name_uniquify(data, starts_with)
 
@@ -1060,6 +1860,34 @@ def _validate_name_uniquify(data, starts_with):
     data.models.simulation.name = n2
 
 
+def _write_atomic(path, write):
+    """Write to a temporary file and rename into place
+
+    Readers either see the old or new contents, never a partial write.
+
+    Args:
+        path (py.path): file to replace
+        write (function): called with the temporary file's path
+    """
+    pkio.mkdir_parent_only(path)
+    t = path.dirpath().join('.{}.{}'.format(path.basename, random.random()))
+    try:
+        write(t)
+        os.rename(str(t), str(path))
+    finally:
+        pkio.unchecked_remove(t)
+
+
+def _write_text_atomic(path, text):
+    """Write text atomically (see `_write_atomic`)
+
+    Args:
+        path (py.path): file to replace
+        text (str): what to write
+    """
+    _write_atomic(path, lambda t: pkio.write_text(t, text))
+
+
 def _user_dir():
     """User for the session
 
@@ -1085,10 +1913,8 @@ def _user_dir_create():
         str: New user id
     """
     uid = _random_id(user_dir_name())['id']
-    # Must set before calling simulation_dir
+    # Must set before calling simulation_dir, which creates apps on demand
     _server.session_user(uid)
-    for simulation_type in feature_config.cfg.sim_types:
-        _create_example_and_lib_files(simulation_type)
     return uid
 
 
@@ -102,17 +102,24 @@ class _TestClient(flask.testing.FlaskClient):
         op = lambda r: self.post(r, data=data)
         return _req(route_name, params, op, raw_response=raw_response)
 
-    def sr_get(self, route_name, params=None, raw_response=False):
+    def sr_get(self, route_name, params=None, raw_response=False, query=None, headers=None):
         """Gets a request to route_name to server
 
         Args:
             route_name (str): identifies route in schema-common.json
             params (dict): optional params to route_name
+            query (dict): optional query string arguments
+            headers (dict): optional request headers
 
         Returns:
             object: Parsed JSON result
         """
-        return _req(route_name, params, self.get, raw_response=raw_response)
+        return _req(
+            route_name,
+            params,
+            lambda uri: self.get(uri, query_string=query, headers=headers),
+            raw_response=raw_response,
+        )
 
     def sr_sim_data(self, sim_type, sim_name):
         """Return simulation data by name
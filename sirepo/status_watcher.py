@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+u"""Wait for run dirs to change
+
+`sirepo.server.api_runStatusWait` holds a status request until the run
+dir changes instead of the client polling every second or two. One
+thread per process polls the signature (mtimes) of each run dir with
+a waiter, no matter how many requests are waiting on it.
+
+Each waiting request holds a server thread for up to cfg.wait_seconds.
+uwsgi must run with threads (`sirepo.pkcli.service` cfg.threads) and
+cfg.max_waiters must leave threads free for other requests, which
+``sirepo service uwsgi`` checks. Requests over cfg.max_waiters return
+immediately so the client polls. With one thread per process (e.g. a
+sync worker), set cfg.max_waiters to 0.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern import pkconfig
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+import os
+import threading
+import time
+
+#: mutex for _watched; notified when a signature changes
+_cond = threading.Condition()
+
+#: Waiters in this process (see cfg.max_waiters)
+_waiters = 0
+
+#: run dir to [signature, waiter count]
+_watched = {}
+
+#: Thread polling _watched
+_thread = None
+
+#: configuration
+cfg = None
+
+
+def signature(run_dir):
+    """Summary of the run dir which changes when the job makes progress
+
+    Includes the mtimes of run_dir and its subdirectories (frames are
+    often written to subdirectories) and the status file.
+
+    Args:
+        run_dir (py.path): directory to summarize
+    Returns:
+        tuple: comparable signature (None if run_dir doesn't exist)
+    """
+    d = str(run_dir)
+    try:
+        res = [os.stat(d).st_mtime]
+        for n in sorted(os.listdir(d)):
+            p = os.path.join(d, n)
+            if n == 'status' or os.path.isdir(p):
+                res.append((n, os.stat(p).st_mtime))
+        return tuple(res)
+    except OSError:
+        return None
+
+
+def wait(run_dir, prev, timeout):
+    """Block until the run dir changes
+
+    If another request is watching run_dir, waits for the poller to
+    see a change from the shared signature, which may be older than
+    prev. Otherwise, a change from prev returns immediately. Either
+    way, each change wakes a waiter once.
+
+    Args:
+        run_dir (py.path): directory to watch
+        prev (tuple): result of `signature` before the caller read the status
+        timeout (float): maximum seconds to wait
+    Returns:
+        bool: True if changed, False if timed out or too many waiters
+    """
+    global _waiters
+
+    p = str(run_dir)
+    end = time.time() + timeout
+    with _cond:
+        if _waiters >= cfg.max_waiters:
+            pkdc('{}: too many waiters={}', p, _waiters)
+            return False
+        w = _watched.get(p)
+        if w:
+            seen = w[0]
+        else:
+            w = _watched[p] = [signature(run_dir), 0]
+            seen = prev
+        w[1] += 1
+        _waiters += 1
+        _start_thread()
+        try:
+            while w[0] == seen:
+                r = end - time.time()
+                if r <= 0:
+                    return False
+                _cond.wait(r)
+            return True
+        finally:
+            _waiters -= 1
+            w[1] -= 1
+            if w[1] <= 0:
+                del _watched[p]
+
+
+def _poll():
+    while True:
+        time.sleep(cfg.poll_seconds)
+        with _cond:
+            paths = list(_watched.keys())
+        if not paths:
+            continue
+        new = dict((p, signature(p)) for p in paths)
+        with _cond:
+            changed = False
+            for p, s in new.items():
+                w = _watched.get(p)
+                if w and w[0] != s:
+                    w[0] = s
+                    changed = True
+            if changed:
+                _cond.notify_all()
+
+
+def _start_thread():
+    global _thread
+
+    if _thread:
+        return
+    _thread = threading.Thread(target=_poll, name='status_watcher')
+    _thread.daemon = True
+    _thread.start()
+
+
+cfg = pkconfig.init(
+    max_waiters=(5, int, 'Requests which may wait at once in each process; others poll (must be less than uwsgi threads)'),
+    poll_seconds=(0.5, float, 'How often to check run dirs with waiters'),
+    wait_seconds=(25, int, 'Maximum seconds a status request waits for a change'),
+)
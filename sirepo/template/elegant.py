@@ -126,6 +126,19 @@ def copy_related_files(data, source_path, target_path):
             py.path.local(f).copy(animation_dir)
 
 
+def estimate_cost(data):
+    """Relative cost of a report (see `sirepo.simulation_db.celery_queue`)
+
+    Args:
+        data (dict): report and models
+    Returns:
+        float: particles for bunch reports or None if unknown
+    """
+    if 'bunchReport' in data['report']:
+        return float(data['models']['bunch']['n_particles_per_bunch'])
+    return None
+
+
 def extract_report_data(xFilename, yFilename, data, page_index):
     xfield = data['x'] if 'x' in data else data[_X_FIELD]
 
@@ -188,7 +201,7 @@ def extract_report_data(xFilename, yFilename, data, page_index):
         'x_label': _field_label(xfield, x_col['column_def'][1]),
         'y_label': _field_label(yfield, y_col['column_def'][1]),
         'title': _plot_title(xfield, yfield, page_index),
-        'z_matrix': hist.T.tolist(),
+        'z_matrix': hist.T,
     }
 
 
@@ -347,13 +360,13 @@ def get_data_file(run_dir, model, frame, options=None):
         assert path.check(file=True, exists=True), \
             '{}: not found'.format(path)
         if not options.suffix:
-            with open(str(path)) as f:
-                return path.basename, f.read(), 'application/octet-stream'
+            return path.basename, path, 'application/octet-stream'
         if options.suffix == 'csv':
-            out = elegant_common.subprocess_output(['sddsprintout', '-columns', '-spreadsheet=csv', str(path)])
-            assert out, \
-                '{}: invalid or empty output from sddsprintout'.format(path)
-            return path.purebasename + '.csv', out, 'text/csv'
+            return path.purebasename + '.csv', sdds_util.csv_rows(
+                str(path),
+                columns=options.get('columns'),
+                pages=options.get('pages'),
+            ), 'text/csv'
         raise AssertionError('{}: invalid suffix for download path={}'.format(options.suffix, path))
 
     if frame >= 0:
@@ -366,8 +379,7 @@ def get_data_file(run_dir, model, frame, options=None):
         path = run_dir.join(ELEGANT_LOG_FILE)
         if not path.exists():
             return 'elegant-output.txt', '', 'text/plain'
-        with open(str(path)) as f:
-            return 'elegant-output.txt', f.read(), 'text/plain'
+        return 'elegant-output.txt', path, 'text/plain'
 
     if model == 'beamlineReport':
         data = simulation_db.read_json(str(run_dir.join('..', simulation_db.SIMULATION_DATA_FILE)))
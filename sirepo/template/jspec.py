@@ -178,8 +178,7 @@ def get_data_file(run_dir, model, frame, options=None):
         path = run_dir.join(_BEAM_EVOLUTION_OUTPUT_FILENAME)
     else:
         path = py.path.local(_ion_files(run_dir)[frame])
-    with open(str(path)) as f:
-        return path.basename, f.read(), 'application/octet-stream'
+    return path.basename, path, 'application/octet-stream'
 
 
 def get_simulation_frame(run_dir, data, model_data):
@@ -397,7 +396,7 @@ def _extract_particle_plot(report, run_dir, page_index):
         'x_label': _field_label(xfield, x_col['column_def']),
         'y_label': _field_label(yfield, y_col['column_def']),
         'title': 'Ions at time {:.2f} [s]'.format(time),
-        'z_matrix': hist.T.tolist(),
+        'z_matrix': hist.T,
     }
 
 
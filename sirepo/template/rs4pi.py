@@ -204,8 +204,7 @@ def get_application_data(data):
 
 def get_data_file(run_dir, model, frame, **kwargs):
     if model == 'dicomAnimation4':
-        with open(_parent_file(run_dir, _DOSE_DICOM_FILE)) as f:
-            return RTDOSE_EXPORT_FILENAME, f.read(), 'application/octet-stream'
+        return RTDOSE_EXPORT_FILENAME, py.path.local(_parent_file(run_dir, _DOSE_DICOM_FILE)), 'application/octet-stream'
     tmp_dir = simulation_db.tmp_dir()
     filename, _ = _generate_rtstruct_file(_parent_dir(run_dir), tmp_dir)
     with open (filename, 'rb') as f:
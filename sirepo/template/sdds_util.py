@@ -8,10 +8,14 @@ from __future__ import absolute_import, division, print_function
 from pykern import pkio
 from pykern import pksubprocess
 from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo import json_encoder
 from sirepo.template import elegant_common
-import math
+import csv
+import itertools
 import re
 import sdds
+import threading
+import werkzeug.exceptions
 
 # elegant mux and muy are computed in sddsprocess below
 _ELEGANT_TO_MADX_COLUMNS = [
@@ -33,6 +37,36 @@ _ELEGANT_TO_MADX_COLUMNS = [
 
 _SDDS_INDEX = 0
 
+#: Rows written to the csv buffer before a chunk is yielded
+_CSV_CHUNK_ROWS = 1000
+
+#: sddsdata datasets for streams, which stay open between requests (0 is _SDDS_INDEX)
+_csv_indexes = list(range(1, 20))
+
+_csv_lock = threading.Lock()
+
+
+def csv_rows(filename, columns=None, pages=None):
+    """Convert SDDS columns to CSV one page at a time
+
+    Replaces ``sddsprintout -columns -spreadsheet=csv``. Only one page
+    of column values is in memory at a time. The file is opened and the
+    columns are checked before returning so errors are raised before a
+    response is started: NotFound if the file can't be read, BadRequest
+    for an unknown column, and ServiceUnavailable if too many
+    conversions are running.
+
+    Args:
+        filename (str): sdds file
+        columns (list): column names [all]
+        pages (tuple): first and last page, one-based and inclusive (last may be None) [all]
+    Returns:
+        iterator: str chunks of csv, starting with the header row; close
+            releases the sdds dataset, e.g. when the client disconnects
+    """
+    res = _csv_chunks(filename, columns, pages)
+    return _CsvRows(next(res), res)
+
 
 def extract_sdds_column(filename, field, page_index):
     return process_sdds_page(filename, page_index, _sdds_column, field)
@@ -86,10 +120,83 @@ def twiss_to_madx(elegant_twiss_file, madx_twiss_file):
     pkio.write_text(madx_twiss_file, header + '\n'.join(lines) + '\n')
 
 
-def _safe_sdds_value(v):
-    if isinstance(v, float) and (math.isinf(v) or math.isnan(v)):
-        return 0
-    return v
+def _csv_chunks(filename, columns, pages):
+    with _csv_lock:
+        if not _csv_indexes:
+            pkdlog('{}: too many concurrent csv conversions', filename)
+            raise werkzeug.exceptions.ServiceUnavailable()
+        index = _csv_indexes.pop()
+    try:
+        if sdds.sddsdata.InitializeInput(index, filename) != 1:
+            pkdlog('{}: cannot access', filename)
+            raise werkzeug.exceptions.NotFound()
+        names = sdds.sddsdata.GetColumnNames(index)
+        if columns:
+            for c in columns:
+                if c not in names:
+                    raise werkzeug.exceptions.BadRequest('unknown column={}'.format(c))
+        else:
+            columns = names
+        first, last = pages or (1, None)
+        buf = _CsvBuffer()
+        w = csv.writer(buf)
+        w.writerow(columns)
+        yield buf.flush()
+        page = 0
+        while last is None or page < last:
+            page = sdds.sddsdata.ReadPage(index)
+            if page <= 0:
+                break
+            if page < first:
+                continue
+            values = [
+                sdds.sddsdata.GetColumn(index, names.index(c)) for c in columns
+            ]
+            for i in range(0, len(values[0]) if values else 0, _CSV_CHUNK_ROWS):
+                w.writerows(zip(*[v[i:i + _CSV_CHUNK_ROWS] for v in values]))
+                yield buf.flush()
+    finally:
+        try:
+            sdds.sddsdata.Terminate(index)
+        except Exception:
+            pass
+        with _csv_lock:
+            _csv_indexes.append(index)
+
+
+class _CsvRows(object):
+    """Chunks of `csv_rows` which WSGI servers close when done
+
+    Args:
+        first (str): header row
+        chunks (generator): `_csv_chunks` after the header
+    """
+
+    def __init__(self, first, chunks):
+        self._chunks = chunks
+        self._iter = itertools.chain([first], chunks)
+
+    def __iter__(self):
+        return self._iter
+
+    def close(self):
+        # runs the finally in _csv_chunks even if iteration didn't start
+        self._chunks.close()
+
+
+class _CsvBuffer(object):
+    """Collects what csv.writer writes until flushed"""
+
+    def __init__(self):
+        self._lines = []
+
+    def flush(self):
+        res = ''.join(self._lines)
+        self._lines = []
+        return res
+
+    def write(self, line):
+        self._lines.append(line)
 
 
 def _sdds_column(field):
@@ -100,7 +207,8 @@ def _sdds_column(field):
         column_names.index(field),
     )
     return {
-        'values': map(lambda v: _safe_sdds_value(v), values),
+        # a list, which callers concatenate and test for emptiness
+        'values': json_encoder.finite(values).tolist(),
         'column_names': column_names,
         'column_def': column_def,
         'err': None,
@@ -62,6 +62,17 @@ _FIELD_ALIAS = {
 _WIGGLER_TRAJECTOR_FILENAME = 'xshwig.sha'
 
 
+def estimate_cost(data):
+    """Relative cost of a report (see `sirepo.simulation_db.celery_queue`)
+
+    Args:
+        data (dict): report and models
+    Returns:
+        float: rays times optical elements
+    """
+    return float(data['models']['simulation']['npoint']) * (1 + len(data['models']['beamline']))
+
+
 def fixup_old_data(data):
     if (
         float(data.fixup_old_version) < 20170703.000001
@@ -97,8 +108,7 @@ def get_application_data(data):
 
 def get_data_file(run_dir, model, frame, **kwargs):
     filename = _SHADOW_OUTPUT_FILE
-    with open(str(run_dir.join(filename))) as f:
-        return filename, f.read(), 'application/octet-stream'
+    return filename, run_dir.join(filename), 'application/octet-stream'
 
 
 def lib_files(data, source_lib):
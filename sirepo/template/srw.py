@@ -284,6 +284,38 @@ def clean_run_dir(run_dir):
         zip_dir.remove()
 
 
+def estimate_cost(data):
+    """Relative cost of a report (see `sirepo.simulation_db.celery_queue`)
+
+    Wavefront reports cost about the mesh size times the number of
+    elements the wavefront is propagated through.
+
+    Args:
+        data (dict): report and models
+    Returns:
+        float: cost or None if unknown
+    """
+    r = data['report']
+    is_w = template_common.is_watchpoint(r)
+    if not (is_w or r == 'initialIntensityReport'):
+        return None
+    s = data['models']['simulation']
+    if int(s['samplingMethod']) == 2:
+        res = float(s['horizontalPointCount']) * float(s['verticalPointCount'])
+    else:
+        # automatic: SRW chooses the mesh, roughly 100x100 per unit sampleFactor
+        res = (float(s['sampleFactor']) * 100) ** 2
+    if is_w:
+        n = 1
+        wid = template_common.watchpoint_id(r)
+        for item in data['models']['beamline']:
+            n += 1
+            if item['id'] == wid:
+                break
+        res *= n
+    return res
+
+
 def extensions_for_file_type(file_type):
     if file_type == 'mirror':
         return ['*.dat', '*.txt']
@@ -568,9 +600,7 @@ def get_application_data(data):
 
 def get_data_file(run_dir, model, frame, **kwargs):
     filename = get_filename_for_model(model)
-    with open(str(run_dir.join(filename))) as f:
-        return filename, f.read(), 'application/octet-stream'
-    raise RuntimeError('output file unknown for model: {}'.format(model))
+    return filename, run_dir.join(filename), 'application/octet-stream'
 
 
 def get_filename_for_model(model):
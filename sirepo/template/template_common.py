@@ -45,10 +45,14 @@ ANIMATION_ARGS_VERSION_RE = re.compile(r'v(\d+)$')
 def copy_lib_files(data, source, target):
     """Copy auxiliary files to target
 
+    Library files are shared through `sirepo.blob_store`.
+
     Args:
         data (dict): simulation db
         target (py.path): destination directory
     """
+    from sirepo import blob_store
+
     for f in lib_files(data, source):
         path = target.join(f.basename)
         pkio.mkdir_parent_only(path)
@@ -58,14 +62,13 @@ def copy_lib_files(data, source, target):
                 r = sim_resource.join(f.basename)
                 # the file doesn't exist in the simulation lib, check the resource lib
                 if r.exists():
-                    pkio.mkdir_parent_only(f)
-                    r.copy(f)
+                    blob_store.link(r, f)
                 else:
                     pkdlog('No file in lib or resource: {}', f)
                     continue
             if source:
                 # copy files from another session
-                f.copy(path)
+                blob_store.link(f, path)
             else:
                 # symlink into the run directory
                 path.mksymlinkto(f, absolute=False)
@@ -275,9 +275,8 @@ def get_data_file(run_dir, model, frame, **kwargs):
     # give the last available file instead.
     if len(files) < frame + 1:
         frame = -1
-    filename = str(files[int(frame)])
-    with open(filename) as f:
-        return os.path.basename(filename), f.read(), 'application/octet-stream'
+    path = py.path.local(files[int(frame)])
+    return path.basename, path, 'application/octet-stream'
 
 
 def import_file(*args, **kwargs):
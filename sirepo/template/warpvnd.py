@@ -157,18 +157,16 @@ def get_application_data(data):
 
 def get_data_file(run_dir, model, frame, **kwargs):
     if model == 'particleAnimation' or model == 'egunCurrentAnimation':
-        filename = str(run_dir.join(_PARTICLE_FILE if model == 'particleAnimation' else _EGUN_CURRENT_FILE))
-        with open(filename) as f:
-            return os.path.basename(filename), f.read(), 'application/octet-stream'
+        path = run_dir.join(_PARTICLE_FILE if model == 'particleAnimation' else _EGUN_CURRENT_FILE)
+        return path.basename, path, 'application/octet-stream'
     #TODO(pjm): consolidate with template/warp.py
     files = _h5_file_list(run_dir, model)
     #TODO(pjm): last client file may have been deleted on a canceled animation,
     # give the last available file instead.
     if len(files) < frame + 1:
         frame = -1
-    filename = str(files[int(frame)])
-    with open(filename) as f:
-        return os.path.basename(filename), f.read(), 'application/octet-stream'
+    path = py.path.local(files[int(frame)])
+    return path.basename, path, 'application/octet-stream'
 
 
 def get_zcurrent_new(particle_array, momenta, mesh, particle_weight, dz):
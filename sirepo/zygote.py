@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+u"""Fork jobs from a process which has already imported the templates
+
+Starting ``sirepo <code> run`` imports srwlib, scipy, Shadow, etc. which
+often takes longer than a foreground report. The zygote is a child of
+the server which imports the templates and pkcli modules once and then
+forks a child per job. The child runs the same pkcli command in the
+job's run_dir with output to run.log.
+
+The server talks to the zygote over pipes passed as the zygote's stdin
+and stdout, one json line per message. The zygote moves them to other
+fds before importing anything so output from templates goes to stderr
+instead of corrupting the messages. Messages are:
+
+    server: {"id": 1, "cmd": [...], "run_dir": "...", "metrics_log": "..."}
+    zygote: {"id": 1, "pid": 123}
+    zygote: {"id": 1, "returncode": 0}
+
+The zygote reaps its children, records each job's metrics (see
+`sirepo.job_metrics`) and sends the exit status, which a reader thread
+in the server passes to the job's `Process`. The SIGCHLD handler only
+reaps; the rest is done by the zygote's main loop, which the handler
+wakes up.
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+from pykern.pkdebug import pkdc, pkdexc, pkdlog, pkdp
+from sirepo.template import template_common
+import errno
+import fcntl
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+#: In the zygote, pid to [id, run_dir, metrics log, start time] of children
+_children = {}
+
+#: In the zygote, [pid, status, rusage] reaped by `_sigchld_handler`
+_exited = []
+
+#: Identifies a job in messages
+_last_id = 0
+
+#: Server's connection to the zygote (see `_Connection`)
+_zygote = None
+
+#: mutex for _zygote and _last_id
+_lock = threading.Lock()
+
+
+class Process(object):
+    """Job forked by the zygote
+
+    Has the part of the `subprocess.Popen` interface used by
+    `sirepo.runner.Scheduler`. The exit status is sent by the zygote.
+    """
+
+    def __init__(self, pid, job_id, connection):
+        self.pid = pid
+        self.returncode = None
+        self._connection = connection
+        self._id = job_id
+
+    def poll(self):
+        if self.returncode is not None:
+            return self.returncode
+        c = self._connection
+        # closed is set after the last message is read
+        closed = c.closed
+        rc = c.returncodes.pop(self._id, None)
+        if rc is not None:
+            self.returncode = rc
+        elif closed:
+            # zygote died; the job is an orphan so only the pid is left
+            try:
+                os.kill(self.pid, 0)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+                pkdlog('pid={}: zygote exited before the job, status unknown', self.pid)
+                self.returncode = 1
+        return self.returncode
+
+
+def main():
+    """Zygote process: import templates then fork jobs sent by the server
+
+    Started as ``sirepo zygote`` (see `sirepo.pkcli.zygote`).
+    """
+    from pykern import pkcli
+
+    req = os.dup(0)
+    rep = os.dup(1)
+    n = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(n, 0)
+    os.close(n)
+    os.dup2(2, 1)
+    _import_templates()
+    wake_r, wake_w = os.pipe()
+    for fd in wake_r, wake_w:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    signal.signal(signal.SIGCHLD, _sigchld_handler)
+    signal.set_wakeup_fd(wake_w)
+    fds = (req, rep, wake_r, wake_w)
+    buf = b''
+    while True:
+        try:
+            ready = select.select([req, wake_r], [], [])[0]
+        except (select.error, OSError) as e:
+            # python 2 doesn't retry
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if wake_r in ready:
+            _drain(wake_r)
+        _send_exits(rep)
+        if req not in ready:
+            continue
+        d = os.read(req, 65536)
+        if not d:
+            # server exited
+            return
+        buf += d
+        while b'\n' in buf:
+            l, buf = buf.split(b'\n', 1)
+            _fork(json.loads(l.decode()), rep, pkcli, fds)
+
+
+def start(cmd, run_dir, metrics_log=None):
+    """Fork a job from the zygote, starting the zygote if necessary
+
+    Blocks while the zygote imports the templates the first time so
+    don't call with locks held.
+
+    Args:
+        cmd (list): pkcli command, e.g. ``['sirepo', 'srw', 'run', run_dir]``
+        run_dir (py.path): where to run
+        metrics_log (str): `sirepo.job_metrics.log_path` [None]
+    Returns:
+        Process: the job
+    """
+    global _zygote, _last_id
+
+    with _lock:
+        for i in range(2):
+            if not _zygote or _zygote.closed:
+                if _zygote:
+                    _zygote.stop()
+                _zygote = _Connection(cmd[0])
+            _last_id += 1
+            r = json.dumps({
+                'cmd': cmd,
+                'id': _last_id,
+                'metrics_log': metrics_log,
+                'run_dir': str(run_dir),
+            }) + '\n'
+            try:
+                _zygote.process.stdin.write(r.encode())
+                _zygote.process.stdin.flush()
+                pid = _zygote.pid_of(_last_id)
+                if pid:
+                    return Process(pid, _last_id, _zygote)
+            except (IOError, OSError) as e:
+                pkdlog('zygote pid={} error: {}', _zygote.process.pid, e)
+            _zygote.stop()
+            _zygote = None
+    raise RuntimeError('{}: zygote failed to start job'.format(cmd))
+
+
+class _Connection(object):
+    """Server side of a zygote"""
+
+    def __init__(self, root_pkg):
+        self.closed = False
+        self.returncodes = {}
+        self._cond = threading.Condition()
+        self._pids = {}
+        self.process = subprocess.Popen(
+            [root_pkg, 'zygote'],
+            close_fds=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        pkdlog('started zygote pid={}', self.process.pid)
+        t = threading.Thread(target=self._read, name='zygote.reader')
+        t.daemon = True
+        t.start()
+
+    def pid_of(self, job_id):
+        """Wait for the zygote to fork job_id
+
+        Args:
+            job_id (int): sent to the zygote
+        Returns:
+            int: pid or None if the zygote exited
+        """
+        with self._cond:
+            while job_id not in self._pids and not self.closed:
+                self._cond.wait()
+            return self._pids.pop(job_id, None)
+
+    def stop(self):
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+        self.process.wait()
+
+    def _read(self):
+        try:
+            for l in iter(self.process.stdout.readline, b''):
+                m = json.loads(l.decode())
+                if 'returncode' in m:
+                    self.returncodes[m['id']] = m['returncode']
+                    continue
+                with self._cond:
+                    self._pids[m['id']] = m['pid']
+                    self._cond.notify_all()
+        except Exception:
+            pkdlog('zygote pid={} read error: {}', self.process.pid, pkdexc())
+        finally:
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+
+
+def _child(cmd, run_dir, pkcli, fds):
+    """Run cmd in the forked child; never returns"""
+    res = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for x in fds:
+            os.close(x)
+        os.chdir(run_dir)
+        fd = os.open(template_common.RUN_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        n = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(n, 0)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(n)
+        os.close(fd)
+        res = pkcli.main(cmd[0], cmd[1:]) or 0
+    except SystemExit as e:
+        res = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        try:
+            pkdlog('{}: error: {}', cmd, pkdexc())
+        except BaseException:
+            pass
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(res)
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 512):
+            pass
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+
+
+def _fork(req, rep, pkcli, fds):
+    """Fork the job in req and reply with its pid
+
+    Args:
+        req (dict): message from the server
+        rep (int): fd for replies
+        pkcli (module): passed to `_child`
+        fds (tuple): closed in the child
+    """
+    t = time.time()
+    pid = os.fork()
+    if pid == 0:
+        _child(req['cmd'], req['run_dir'], pkcli, fds)
+    # exits reaped before this are in _exited until _send_exits
+    _children[pid] = [req['id'], req['run_dir'], req.get('metrics_log'), t]
+    _write(rep, {'id': req['id'], 'pid': pid})
+
+
+def _import_templates():
+    from sirepo import feature_config
+    import importlib
+
+    for t in feature_config.cfg.sim_types:
+        for m in 'sirepo.template.', 'sirepo.pkcli.':
+            try:
+                importlib.import_module(m + t)
+            except Exception:
+                # the child will report the error when it imports
+                pkdlog('{}: import failed: {}', m + t, pkdexc())
+
+
+def _send_exits(rep):
+    """Record metrics and send the exit status of reaped children
+
+    Args:
+        rep (int): fd for replies
+    """
+    from sirepo import job_metrics
+
+    while _exited:
+        pid, status, rusage = _exited.pop(0)
+        c = _children.pop(pid, None)
+        if not c:
+            continue
+        rc = job_metrics.returncode(status)
+        job_metrics.record(c[2], c[1], c[3], rc, rusage)
+        _write(rep, {'id': c[0], 'returncode': rc})
+
+
+def _sigchld_handler(signum=None, frame=None):
+    """Reap children; `main` does the rest (see `_send_exits`)"""
+    try:
+        while True:
+            pid, status, ru = os.wait4(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            _exited.append([pid, status, ru])
+    except OSError as e:
+        if e.errno != errno.ECHILD:
+            raise
+
+
+def _write(fd, msg):
+    b = (json.dumps(msg) + '\n').encode()
+    while b:
+        b = b[os.write(fd, b):]
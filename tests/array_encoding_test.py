@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.array_encoding
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+
+def test_encode():
+    from pykern.pkunit import pkeq
+    from sirepo import array_encoding
+    import base64
+    import numpy
+
+    z = [[float(i * 20 + j) for j in range(20)] for i in range(20)]
+    res = array_encoding.encode({
+        'title': 'x',
+        'x_range': [0, 1, 20],
+        'labels': ['a'] * 300,
+        'z_matrix': z,
+        'points': [float(i) for i in range(300)],
+        'nested': {'z_matrix': numpy.arange(400).reshape(20, 20)},
+        'reports': [{'z_matrix': numpy.array(z)}],
+    })
+    pkeq('x', res['title'])
+    pkeq([0, 1, 20], res['x_range'])
+    pkeq(['a'] * 300, res['labels'])
+    m = res['z_matrix']
+    pkeq([20, 20], m['shape'])
+    a = numpy.frombuffer(base64.b64decode(m['data']), dtype='<f4').reshape(m['shape'])
+    pkeq(z, a.tolist())
+    # not in cfg.keys
+    pkeq(300, len(res['points']))
+    # integers lose precision as float32
+    pkeq(list(range(20)), list(res['nested']['z_matrix'][0]))
+    pkeq([20, 20], res['reports'][0]['z_matrix']['shape'])
+
+
+def test_schema_default():
+    pytest.importorskip('srwl_bl')
+    from pykern.pkunit import pkeq
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    res = fc.sr_post_form('simulationSchema', {'simulationType': 'srw'})
+    # lossy, so JSON numbers unless configured
+    pkeq(None, res.arrayEncoding)
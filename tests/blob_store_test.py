@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.blob_store
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+pytest.importorskip('srwl_bl')
+
+
+def test_link_and_gc():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import blob_store
+    from sirepo import sr_unit
+
+    sr_unit.flask_client()
+    with pkunit.save_chdir_work() as d:
+        a = d.join('a.dat')
+        pkio.write_text(a, 'same contents')
+        b = d.join('lib1', 'b.dat')
+        c = d.join('lib2', 'c.dat')
+        blob_store.link(a, b)
+        blob_store.link(a, c)
+        pkeq(b.stat().ino, c.stat().ino)
+        pkeq('same contents', pkio.read_text(c))
+        pkeq((0, 0), blob_store.gc(min_age=0))
+        pkio.unchecked_remove(b, c)
+        n, size = blob_store.gc(min_age=0)
+        pkeq(1, n)
+        pkeq(len('same contents'), size)
+
+
+def test_gc_orphans():
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+    from sirepo import blob_store
+    from sirepo import sr_unit
+    import os
+
+    sr_unit.flask_client()
+    with pkunit.save_chdir_work() as d:
+        a = d.join('a.dat')
+        pkio.write_text(a, 'orphan contents')
+        b = d.join('lib1', 'b.dat')
+        blob_store.link(a, b)
+        s = os.stat(str(b))
+        pkio.unchecked_remove(b)
+        # just unlinked so too young for the default min_age
+        pkeq((0, 0), blob_store.gc())
+        pkeq((1, len('orphan contents')), blob_store.gc(orphans=set([(s.st_dev, s.st_ino)])))
+
+
+def test_link_after_gc(monkeypatch):
+    from pykern import pkio
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+    from sirepo import blob_store
+    from sirepo import sr_unit
+
+    sr_unit.flask_client()
+    with pkunit.save_chdir_work() as d:
+        a = d.join('a.dat')
+        pkio.write_text(a, 'raced contents')
+        blob_store.link(a, d.join('lib1', 'b.dat'))
+        pkio.unchecked_remove(d.join('lib1', 'b.dat'))
+        intern = blob_store._intern
+        raced = []
+
+        def _intern_then_gc(path):
+            res = intern(path)
+            if not raced:
+                # gc runs between _intern's check and link's os.link
+                raced.append(blob_store.gc(min_age=0))
+            return res
+
+        monkeypatch.setattr(blob_store, '_intern', _intern_then_gc)
+        c = d.join('lib2', 'c.dat')
+        blob_store.link(a, c)
+        pkeq([(1, len('raced contents'))], raced)
+        pkeq('raced contents', pkio.read_text(c))
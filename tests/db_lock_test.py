@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.db_lock
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_contention():
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import db_lock
+    from sirepo import sr_unit
+    import threading
+
+    sr_unit.flask_client()
+    prev = db_lock.stats().get('simulation')
+    with db_lock.simulation('abcdefgh'):
+        # reentrant in the same thread
+        with db_lock.simulation('abcdefgh'):
+            pass
+        res = []
+
+        def _other():
+            try:
+                with db_lock.simulation('abcdefgh', timeout=0.2):
+                    res.append('acquired')
+            except db_lock.Timeout:
+                res.append('timeout')
+
+        t = threading.Thread(target=_other)
+        t.start()
+        t.join()
+        pkeq(['timeout'], res)
+    s = db_lock.stats().simulation
+    pkeq((prev.timeouts if prev else 0) + 1, s.timeouts)
+    pkok(s.contended > (prev.contended if prev else 0), 'expecting contention')
+    with db_lock.simulation('abcdefgh', timeout=0):
+        pass
+
+
+def test_remove():
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import db_lock
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    import threading
+    import time
+
+    sr_unit.flask_client()
+    p = simulation_db.db_dir().join('lock', 'simulation', 'removeme')
+    res = []
+
+    def _other():
+        with db_lock.simulation('removeme', timeout=5):
+            res.append(p.check(file=True))
+
+    with db_lock.simulation('removeme'):
+        t = threading.Thread(target=_other)
+        t.start()
+        # let _other open the file which is about to be removed
+        time.sleep(0.2)
+        db_lock.remove('simulation', 'removeme')
+        pkok(not p.check(), '{}: lock file not removed', p)
+    t.join()
+    # acquired on a new file, not the removed one
+    pkeq([True], res)
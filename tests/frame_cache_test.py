@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.frame_cache
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_get_put_evict():
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    from sirepo import frame_cache
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    import os
+
+    sr_unit.flask_client()
+    d = pkio.mkdir_parent(simulation_db.db_dir().join('frame-cache-test', 'animation'))
+    prev = frame_cache.cfg.max_bytes
+    frame_cache.cfg.max_bytes = 100
+    try:
+        pkeq(None, frame_cache.get(d, 'srw*s*m*a*0*1'))
+        frame_cache.put(d, 'srw*s*m*a*0*1', '{"x": 1}')
+        pkeq(b'{"x": 1}', frame_cache.get(d, 'srw*s*m*a*0*1'))
+        # another run has another startTime
+        pkeq(None, frame_cache.get(d, 'srw*s*m*a*0*2'))
+        for i in range(10):
+            frame_cache.put(d, 'srw*s*m*a*{}*2'.format(i), '"{}"'.format('y' * 20))
+        pkeq(None, frame_cache.get(d, 'srw*s*m*a*0*1'))
+        n = sum(f.size() for f in pkio.sorted_glob(d.join('frame-cache', '*')))
+        pkeq(True, n <= 100)
+        # removing the run dir invalidates its entries
+        pkio.unchecked_remove(d)
+        frame_cache._evict()
+        pkeq([], [l for l in pkio.sorted_glob(frame_cache._index_dir().join('*')) if not os.path.exists(str(l))])
+    finally:
+        frame_cache.cfg.max_bytes = prev
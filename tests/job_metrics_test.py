@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.job_metrics
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_api_disabled(monkeypatch):
+    from pykern.pkunit import pkeq
+    from sirepo import server
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    pkeq(404, fc.get('/job-metrics').status_code)
+    monkeypatch.setattr(server.cfg, 'enable_job_metrics', True)
+    r = fc.get('/job-metrics')
+    pkeq(200, r.status_code)
+    pkeq('text/plain', r.mimetype)
+
+
+def test_record_summary():
+    from pykern import pkcollections
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import job_metrics
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    import time
+
+    sr_unit.flask_client()
+    d = pkio.mkdir_parent(simulation_db.db_dir().join('metrics-test', 'watchpointReport6'))
+    now = time.time()
+    simulation_db.write_json(
+        d.join(simulation_db.RUN_INFO_FILE),
+        pkcollections.Dict(
+            jobId='u-s-watchpointReport6',
+            report='watchpointReport6',
+            simulationId='s',
+            simulationType='srw',
+            startTime=now - 10,
+        ),
+    )
+    pkio.write_text(d.join('res.dat'), 'x' * 100)
+    ru = pkcollections.Dict(ru_maxrss=2048, ru_stime=0.5, ru_utime=1.5)
+    log = str(job_metrics.log_path())
+    job_metrics.record(log, d, now - 4, 0, ru)
+    job_metrics.record(log, d, now - 2, -9, ru)
+    # a partial line is ignored until complete
+    with open(log, 'a') as f:
+        f.write('{"cores"')
+    s = job_metrics.summary()[('srw', 'watchpointReport')]
+    pkeq(2, s.jobs)
+    pkeq(1, s.errors)
+    pkeq(4.0, s.cpu_seconds)
+    pkeq(2048 * 1024, s.max_rss_bytes)
+    pkeq(200, s.output_bytes)
+    pkok(s.queue_seconds >= 14, '{}: expecting wait before start', s.queue_seconds)
+    pkeq(2, job_metrics.summary(since=now - 60)[('srw', 'watchpointReport')].jobs)
+    pkok(
+        'sirepo_job_jobs_total{report="watchpointReport",sim_type="srw"} 2' in job_metrics.prometheus_text(),
+        'expecting jobs_total',
+    )
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.job_registry
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_registry():
+    from pykern.pkunit import pkeq
+    from sirepo import job_registry
+    from sirepo import sr_unit
+
+    sr_unit.flask_client()
+    pkeq(None, job_registry.get('u-s-r'))
+    job_registry.add('u-s-r', pid=123, queue='sequential')
+    r = job_registry.get('u-s-r')
+    pkeq(123, r.pid)
+    pkeq(job_registry.HOST, r.host)
+    pkeq('running', r.state)
+    job_registry.update('u-s-r', state='canceling')
+    pkeq('canceling', job_registry.get('u-s-r').state)
+    # a newer job with the same jid is not removed
+    job_registry.remove('u-s-r', pid=456)
+    pkeq(123, job_registry.get('u-s-r').pid)
+    job_registry.remove('u-s-r', pid=123)
+    pkeq(None, job_registry.get('u-s-r'))
+
+
+def test_expire(monkeypatch):
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import job_registry
+    from sirepo import sr_unit
+    import subprocess
+    import time
+
+    sr_unit.flask_client()
+    p = subprocess.Popen(['true'])
+    p.wait()
+    job_registry.add('u-s-exited', pid=p.pid)
+    job_registry.add('u-s-queued', state='queued')
+    job_registry.expire()
+    pkeq(None, job_registry.get('u-s-exited'))
+    pkok(job_registry.get('u-s-queued'), 'queued job must not expire')
+    monkeypatch.setattr(job_registry.cfg, 'max_age', 0)
+    time.sleep(0.01)
+    job_registry.expire()
+    pkeq(None, job_registry.get('u-s-queued'))
+
+
+def test_pid_reused():
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import job_registry
+    from sirepo import runner
+    from sirepo import sr_unit
+    import os
+
+    sr_unit.flask_client()
+    job_registry.add('u-s-reused', pid=os.getpid())
+    r = job_registry.get('u-s-reused')
+    pkok(job_registry.process_exists(r), '{}: expecting this process', r)
+    pkeq(os.getpid(), runner._other_process_pid('u-s-reused'))
+    # same pid, but another process started it
+    job_registry._execute(
+        'UPDATE job SET pid_start = pid_start - 1 WHERE jid = ?',
+        ('u-s-reused',),
+    )
+    pkok(
+        not job_registry.process_exists(job_registry.get('u-s-reused')),
+        'reused pid must not be the job',
+    )
+    pkeq(None, runner._other_process_pid('u-s-reused'))
+    pkeq(None, job_registry.get('u-s-reused'))
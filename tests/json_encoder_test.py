@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.json_encoder
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+
+def test_numpy():
+    from pykern.pkunit import pkeq
+    from sirepo import json_encoder
+    import json
+    import numpy
+
+    v = {
+        'n': numpy.int64(3),
+        'points': numpy.array([1.5, numpy.nan, numpy.inf, -2.0]),
+        'title': 'x',
+        'z_matrix': numpy.arange(200000, dtype=float).reshape((400, 500)),
+    }
+    expect = {
+        'n': 3,
+        'points': [1.5, 0, 0, -2.0],
+        'title': 'x',
+        'z_matrix': numpy.arange(200000, dtype=float).reshape((400, 500)).tolist(),
+    }
+    pkeq(expect, json.loads(json_encoder.dumps(v)))
+    pkeq(expect, json.loads(''.join(json_encoder.iterencode(v))))
+    with pytest.raises(ValueError):
+        json_encoder.dumps({'x': float('nan')})
+
+
+def test_is_large():
+    from pykern.pkunit import pkeq
+    from sirepo import json_encoder
+    import numpy
+
+    pkeq(False, json_encoder.is_large({'state': 'ok', 'points': [1.0, 2.0]}))
+    pkeq(False, json_encoder.is_large({'x': float('nan')}))
+    pkeq(True, json_encoder.is_large({'z_matrix': numpy.zeros((1000, 1000))}))
+    pkeq(True, json_encoder.is_large({'z_matrix': [[0.0] * 1000] * 1000}))
@@ -47,3 +47,25 @@ def test_purge_users(monkeypatch):
     res = admin.purge_users(days=1, confirm=True)
     pkeq(dirs, res, '{}: no users registered so one delete', res)
     pkok(not dirs[0].check(dir=True), '{}: directory deleted', res)
+
+
+def test_purge_users_not_confirmed(monkeypatch):
+    from pykern.pkunit import pkeq
+    from pykern import pkio
+    from sirepo import sr_unit
+
+    sr_unit.init_user_db()
+
+    from sirepo.pkcli import admin
+    from sirepo import server
+    from sirepo import simulation_db
+
+    server.cfg.oauth_login = False
+    monkeypatch.setattr(server, 'all_uids', lambda: [])
+    dirs = list(pkio.sorted_glob(simulation_db.user_dir_name('*')))
+    pkeq(1, len(dirs), '{}: expecting exactly one user dir', dirs)
+    for f in pkio.walk_tree(dirs[0]):
+        f.setmtime(f.mtime() - 86400 * 2)
+    before = sorted(str(f) for f in pkio.walk_tree(dirs[0]))
+    pkeq(dirs, admin.purge_users(days=1, confirm=False))
+    pkeq(before, sorted(str(f) for f in pkio.walk_tree(dirs[0])), 'nothing removed')
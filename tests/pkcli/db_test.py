@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.pkcli.db
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+
+pytest.importorskip('srwl_bl')
+
+_OLD_VERSION = '20170101.000000'
+
+
+def test_migrate():
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    from sirepo import sr_unit
+
+    sr_unit.init_user_db()
+
+    from sirepo.pkcli import db
+    from sirepo import simulation_db
+
+    paths = list(pkio.sorted_glob(
+        simulation_db.user_dir_name('*').join(
+            'hellweg',
+            '*',
+            simulation_db.SIMULATION_DATA_FILE,
+        ),
+    ))
+    path = paths[0]
+    data = simulation_db.read_json(path)
+    data.version = _OLD_VERSION
+    simulation_db.write_json(path, data)
+    bad = pkio.mkdir_parent(path.dirpath().dirpath().join('bad')).join(
+        simulation_db.SIMULATION_DATA_FILE,
+    )
+    pkio.write_text(bad, '{')
+    try:
+        pkeq(
+            '1 users, 1 simulations migrated, 1 errors',
+            db.migrate(processes=1),
+        )
+    finally:
+        pkio.unchecked_remove(bad.dirpath())
+    pkeq(simulation_db.SCHEMA_COMMON['version'], simulation_db.read_json(path).version)
+    pkeq(
+        '1 users, 0 simulations migrated, 0 errors',
+        db.migrate(processes=1),
+    )
+
+
+def test_no_fixup_on_read(monkeypatch):
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    sr_unit.init_user_db()
+
+    from sirepo import simulation_db
+
+    monkeypatch.setattr(simulation_db.cfg, 'fixup_on_read', False)
+    path = list(pkio.sorted_glob(
+        simulation_db.user_dir_name('*').join(
+            'hellweg',
+            '*',
+            simulation_db.SIMULATION_DATA_FILE,
+        ),
+    ))[0]
+    data = simulation_db.read_json(path)
+    data.version = _OLD_VERSION
+    simulation_db.write_json(path, data)
+    before = pkio.read_text(path)
+    fc.sr_post('listSimulations', {'simulationType': 'hellweg', 'search': {}})
+    pkeq(before, pkio.read_text(path), 'request must not rewrite documents')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.result_cache
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+pytest.importorskip('sdds')
+
+_SIM_TYPE = 'elegant'
+
+_SIM_NAME = 'fourDipoleCSR'
+
+_REPORT = 'bunchReport1'
+
+
+def test_hit_other_user(monkeypatch):
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import result_cache
+
+    fc, queued = _client(monkeypatch)
+    data = _sim_data(fc, 1001)
+    _run_simulation(fc, data)
+    pkeq(1, len(queued), 'first run must be queued')
+    k = _complete(queued[0])
+    pkok(result_cache._root().join(k).check(dir=True), '{}: not saved', k)
+    # new session, i.e. a new user with its own copy of the example
+    fc.cookie_jar.clear()
+    data = _sim_data(fc, 1001)
+    res = _run_simulation(fc, data)
+    pkeq(1, len(queued), 'cached result must not be queued')
+    pkeq('completed', res.state)
+    pkeq([1, 2, 3], res.cached)
+
+
+def test_miss(monkeypatch):
+    from pykern.pkunit import pkeq
+
+    fc, queued = _client(monkeypatch)
+    data = _sim_data(fc, 2001)
+    _run_simulation(fc, data)
+    _complete(queued[0])
+    data.models.bunch.n_particles_per_bunch = 2002
+    _run_simulation(fc, data)
+    pkeq(2, len(queued), 'changed parameters must be queued')
+
+
+def test_evict(monkeypatch):
+    from pykern.pkunit import pkok
+    from sirepo import result_cache
+
+    fc, queued = _client(monkeypatch)
+    data = _sim_data(fc, 3001)
+    _run_simulation(fc, data)
+    e1 = result_cache._root().join(_complete(queued[0]))
+    e1.setmtime(e1.mtime() - 10)
+    s = int(e1.join(result_cache._SIZE_FILE).read())
+    monkeypatch.setattr(result_cache.cfg, 'max_bytes', s + s // 2)
+    data.models.bunch.n_particles_per_bunch = 3002
+    _run_simulation(fc, data)
+    e2 = result_cache._root().join(_complete(queued[1]))
+    pkok(not e1.check(), '{}: least recently used not evicted', e1)
+    pkok(e2.check(dir=True), '{}: newest evicted', e2)
+
+
+def test_save_rerun(monkeypatch):
+    from pykern.pkunit import pkok
+    from sirepo import result_cache
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    fc, queued = _client(monkeypatch)
+    data = _sim_data(fc, 4001)
+    _run_simulation(fc, data)
+    res = []
+
+    def _op():
+        k = result_cache.key(queued[0])
+        d = simulation_db.simulation_run_dir(queued[0])
+        # rerun with other parameters before the job's save
+        queued[0].models.bunch.n_particles_per_bunch = 4002
+        queued[0].pop('reportParametersHash', None)
+        _write_run(queued[0], d)
+        res.extend([d, k])
+
+    sr_unit.test_in_request(_op)
+    # like the runner's reaper thread, outside of a request
+    result_cache.save(*res)
+    pkok(not result_cache._root().join(res[1]).check(), 'stale run saved')
+
+
+def _client(monkeypatch):
+    from sirepo import server
+    from sirepo import sr_unit
+
+    queued = []
+
+    class _Queue(object):
+
+        def __init__(self, data):
+            queued.append(data)
+
+        @classmethod
+        def is_processing(cls, jid):
+            return False
+
+    fc = sr_unit.flask_client()
+    monkeypatch.setattr(server.cfg, 'job_queue', _Queue)
+    return fc, queued
+
+
+def _complete(data):
+    """Write the result of data's job and save it as the runner would"""
+    from sirepo import result_cache
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    res = []
+
+    def _op():
+        d = simulation_db.simulation_run_dir(data)
+        _write_run(data, d)
+        res.extend([d, result_cache.key(data)])
+
+    sr_unit.test_in_request(_op)
+    # the runner's reaper thread has no request context
+    result_cache.save(*res)
+    return res[1]
+
+
+def _run_simulation(fc, data):
+    return fc.sr_post(
+        'runSimulation',
+        dict(
+            forceRun=False,
+            models=data.models,
+            report=_REPORT,
+            simulationId=data.models.simulation.simulationId,
+            simulationType=data.simulationType,
+        ),
+    )
+
+
+def _sim_data(fc, particles):
+    """Example with parameters unique to the test, since the cache is shared"""
+    res = fc.sr_sim_data(_SIM_TYPE, _SIM_NAME)
+    res.models.bunch.n_particles_per_bunch = particles
+    return res
+
+
+def _write_run(data, run_dir):
+    from pykern import pkio
+    from sirepo import simulation_db
+
+    pkio.unchecked_remove(run_dir)
+    pkio.mkdir_parent(run_dir)
+    simulation_db.write_run_input(data, run_dir)
+    simulation_db.write_result({'cached': [1, 2, 3]}, run_dir=run_dir)
+    simulation_db.write_status('completed', run_dir)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.runner
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_fair_order():
+    from pykern import pkcollections
+    from pykern.pkunit import pkeq
+    from sirepo import runner
+
+    def _job(owner, jid):
+        return pkcollections.Dict(cores=1, jid=jid, owner=owner)
+
+    q = [_job('a', 'a1'), _job('a', 'a2'), _job('a', 'a3'), _job('b', 'b1'), _job('c', 'c1')]
+    prev = runner.Scheduler._queue['sequential']
+    runner.Scheduler._queue['sequential'] = q
+    try:
+        pkeq(
+            ['a1', 'b1', 'c1', 'a2', 'a3'],
+            [j.jid for j in runner.Scheduler._fair_order('sequential', {})],
+        )
+        # a already has two jobs running
+        pkeq(
+            ['b1', 'c1', 'a1', 'a2', 'a3'],
+            [j.jid for j in runner.Scheduler._fair_order('sequential', {'a': [2, 2]})],
+        )
+    finally:
+        runner.Scheduler._queue['sequential'] = prev
+
+
+def test_over_quota():
+    from pykern.pkunit import pkeq
+    from sirepo import runner
+
+    prev = runner.cfg.user_max_jobs, runner.cfg.user_max_cores
+    try:
+        runner.cfg.user_max_jobs = 2
+        runner.cfg.user_max_cores = 4
+        pkeq(False, runner._over_quota(0, 0, 8))
+        pkeq(False, runner._over_quota(1, 1, 3))
+        pkeq(True, runner._over_quota(1, 1, 4))
+        pkeq(True, runner._over_quota(2, 2, 1))
+    finally:
+        runner.cfg.user_max_jobs, runner.cfg.user_max_cores = prev
+
+
+def test_scheduler_dispatch(monkeypatch):
+    from pykern import pkunit
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import runner
+    from sirepo import server
+    from sirepo import sr_unit
+    from sirepo.template import template_common
+    import subprocess
+    import time
+
+    class _Stop(Exception):
+        pass
+
+    def _wait(*args, **kwargs):
+        # dispatcher has nothing left to start
+        raise _Stop()
+
+    sr_unit.flask_client()
+    s = runner.Scheduler
+    started = []
+    monkeypatch.setattr(s, '_job', {})
+    monkeypatch.setattr(s, '_queue', dict((q, []) for q in runner._QUEUE_NAMES))
+    monkeypatch.setattr(s, '_running', dict((q, []) for q in runner._QUEUE_NAMES))
+    monkeypatch.setattr(s, '_start', classmethod(lambda cls, self: started.append(self.jid)))
+    monkeypatch.setattr(s._lock, 'wait', _wait)
+    monkeypatch.setitem(runner.cfg.slots, 'sequential', 2)
+    monkeypatch.setattr(server.cfg, 'foreground_time_limit', 10)
+    with pkunit.save_chdir_work() as d:
+        p = subprocess.Popen(['sleep', '60'])
+        over = _scheduler_job(
+            'a',
+            'over',
+            metrics_log=str(d.join('metrics.log')),
+            process=p,
+            run_dir=d,
+            start_time=time.time() - 100,
+        )
+        s._job[over.jid] = over
+        s._running['sequential'].append(over)
+        for o, j in ('a', 'a1'), ('a', 'a2'), ('b', 'b1'):
+            s._job[j] = _scheduler_job(o, j)
+            s._queue['sequential'].append(s._job[j])
+        with pytest.raises(_Stop):
+            s._dispatch()
+        # over holds one of two slots and b has no jobs running
+        pkeq(['b1'], started)
+        pkeq(['a1', 'a2'], [j.jid for j in s._queue['sequential']])
+        pkok(over.in_kill, 'job over the time limit not stopped')
+        pkok(
+            'time limit' in d.join(template_common.RUN_LOG).read(),
+            'time limit not in run log',
+        )
+        for _ in range(50):
+            if over.jid not in s._job:
+                break
+            time.sleep(.1)
+        else:
+            pkunit.pkfail('{}: not reaped', over.jid)
+        pkok(p.returncode is not None, 'process not terminated')
+
+
+def test_run_cancel_all(monkeypatch):
+    from pykern import pkio
+    from pykern.pkunit import pkeq
+    from sirepo import job_registry
+    from sirepo import server
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    class _Queue(object):
+        killed = []
+
+        @classmethod
+        def is_processing(cls, jid):
+            return jid not in cls.killed
+
+        @classmethod
+        def kill(cls, jid, on_exit=None):
+            cls.killed.append(jid)
+            on_exit()
+
+    fc = sr_unit.flask_client()
+    data = fc.sr_sim_data('srw', "Young's Double Slit Experiment")
+    data.report = 'intensityReport'
+    job = []
+
+    def _add():
+        d = pkio.mkdir_parent(simulation_db.simulation_run_dir(data))
+        simulation_db.write_run_input(data, d)
+        j = simulation_db.job_id(data)
+        job_registry.add(j, queue='sequential', run_dir=d)
+        job.extend([j, d])
+
+    sr_unit.test_in_request(_add)
+    monkeypatch.setattr(server.cfg, 'job_queue', _Queue)
+    try:
+        res = fc.sr_post('runCancelAll', {})
+        pkeq(1, res['count'])
+        pkeq([job[0]], _Queue.killed)
+        pkeq('canceled', simulation_db.read_result(job[1])[0].state)
+    finally:
+        job_registry.remove(job[0])
+
+
+def test_run_simulation_running(monkeypatch):
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import server
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    from sirepo.template import template_common
+
+    class _Queue(object):
+        killed = []
+        queued = []
+
+        def __init__(self, data):
+            d = pkio.mkdir_parent(simulation_db.simulation_run_dir(data, remove_dir=True))
+            simulation_db.write_run_input(data, d)
+            simulation_db.write_status('running', d)
+            self.queued.append(simulation_db.job_id(data))
+
+        @classmethod
+        def is_processing(cls, jid):
+            return jid in cls.queued and jid not in cls.killed
+
+        @classmethod
+        def kill(cls, jid, on_exit=None):
+            cls.killed.append(jid)
+
+    fc = sr_unit.flask_client()
+    data = fc.sr_sim_data('srw', "Young's Double Slit Experiment")
+    data.report = 'intensityReport'
+    data.simulationId = data.models.simulation.simulationId
+    monkeypatch.setattr(server.cfg, 'job_queue', _Queue)
+    fc.sr_post('runSimulation', data)
+    pkeq(1, len(_Queue.queued))
+    res = []
+
+    def _start():
+        i = simulation_db.simulation_run_dir(data).join(
+            template_common.INPUT_BASE_NAME + simulation_db.JSON_SUFFIX,
+        )
+        i.setmtime(i.mtime() - 10)
+        m = i.mtime()
+        # e.g. a double click: attaches to the running job
+        res.append(server._start_simulation(data))
+        res.append(m == i.mtime())
+
+    sr_unit.test_in_request(_start)
+    pkeq([True, True], res, 'identical start must not touch the run dir')
+    pkeq(1, len(_Queue.queued))
+    pkeq([], _Queue.killed)
+    data.models.intensityReport.photonEnergyPointCount = 9999
+    data.pop('reportParametersHash')
+    r = fc.sr_post('runSimulation', data)
+    pkok(r.get('superseding'), '{}: changed parameters not superseding', r)
+    pkeq('pending', r.state)
+    pkeq(_Queue.queued, _Queue.killed)
+    pkeq(1, len(_Queue.queued), 'must not start until the old job is gone')
+
+
+def test_quota_expires_exited_jobs(monkeypatch):
+    from pykern.pkunit import pkeq
+    from sirepo import job_registry
+    from sirepo import runner
+    from sirepo import sr_unit
+    import subprocess
+    import time
+
+    sr_unit.flask_client()
+    # only _is_live removes records
+    monkeypatch.setattr(job_registry, '_last_expire', time.time())
+    p = subprocess.Popen(['true'])
+    p.wait()
+    job_registry.add('q-s-exited', pid=p.pid)
+    job_registry.add('q-s-other', pid=1)
+    job_registry.update('q-s-other', host='another-host')
+    try:
+        pkeq(False, runner._is_live(job_registry.get('q-s-exited')))
+        pkeq(None, job_registry.get('q-s-exited'))
+        pkeq(True, runner._is_live(job_registry.get('q-s-other')))
+    finally:
+        job_registry.remove('q-s-other')
+
+
+
+def _scheduler_job(owner, jid, **kwargs):
+    """Scheduler instance without a run dir"""
+    from sirepo import runner
+
+    res = object.__new__(runner.Scheduler)
+    res.__dict__.update(
+        cores=1,
+        in_kill=False,
+        jid=jid,
+        owner=owner,
+        process=None,
+        queue_name='sequential',
+        **kwargs
+    )
+    return res
@@ -27,6 +27,7 @@ def test_basic():
 
 def test_get_data_file():
     from sirepo import sr_unit
+    from sirepo.template import sdds_util
     from pykern import pkunit
     from pykern import pkio
     import sdds
@@ -66,29 +67,48 @@ def test_get_data_file():
         time.sleep(1)
     else:
         pkunit.pkfail('runStatus: failed to complete: {}', run)
-    resp = fc.sr_get(
-        'downloadDataFile',
-        dict(
-            simulation_type=data.simulationType,
-            simulation_id=data.models.simulation.simulationId,
-            model='bunchReport1',
-            frame='-1',
-            suffix='csv',
-        ),
-        raw_response=True,
-    )
-    rows = csv.reader(StringIO.StringIO(resp.get_data()))
-    assert len(list(rows)) == 5001
-    resp = fc.sr_get(
-        'downloadDataFile',
-        dict(
+
+    def _download(suffix=None, query=None, headers=None):
+        p = dict(
             simulation_type=data.simulationType,
             simulation_id=data.models.simulation.simulationId,
             model='bunchReport1',
             frame='-1',
-        ),
-        raw_response=True,
-    )
+        )
+        if suffix:
+            p['suffix'] = suffix
+        return fc.sr_get(
+            'downloadDataFile',
+            p,
+            query=query,
+            headers=headers,
+            raw_response=True,
+        )
+
+    def _csv(query=None):
+        return list(csv.reader(StringIO.StringIO(_download('csv', query=query).get_data())))
+
+    indexes = len(sdds_util._csv_indexes)
+    pkunit.pkeq(5001, len(_csv()))
+    rows = _csv({'columns': 'x,xp', 'pages': '1'})
+    pkunit.pkeq(['x', 'xp'], rows[0])
+    pkunit.pkeq(5001, len(rows))
+    pkunit.pkeq(2, len(rows[1]))
+    for pages, count in ('1-1', 5001), ('1-', 5001), ('2-', 1), ('2-3', 1):
+        rows = _csv({'columns': 'x', 'pages': pages})
+        pkunit.pkeq(['x'], rows[0])
+        pkunit.pkeq(count, len(rows), 'pages={}: unexpected rows', pages)
+    for query, status in ({'columns': 'no_such_column'}, 400), ({'pages': '3-2'}, 400):
+        resp = _download('csv', query=query)
+        pkunit.pkeq(status, resp.status_code, '{}: unexpected status', query)
+    pkunit.pkeq(indexes, len(sdds_util._csv_indexes), 'sdds index leaked')
+    # client disconnects after the first chunk
+    resp = _download('csv')
+    pkunit.pkeq(indexes - 1, len(sdds_util._csv_indexes))
+    pkunit.pkok(next(iter(resp.response)), 'expecting header row')
+    resp.close()
+    pkunit.pkeq(indexes, len(sdds_util._csv_indexes), 'closed stream leaked its sdds index')
+    resp = _download()
     m = re.search(r'attachment; filename="([^"]+)"', resp.headers['Content-Disposition'])
     with pkunit.save_chdir_work():
         path = pkio.py_path(m.group(1))
@@ -99,6 +119,23 @@ def test_get_data_file():
         # Verify we can read something
         assert 0 <= len(sdds.sddsdata.GetColumnNames(0))
         sdds.sddsdata.Terminate(0)
+    pkunit.pkeq(0, resp.cache_control.max_age)
+    pkunit.pkok(not resp.cache_control.public, 'data files are not public')
+    whole = resp.get_data()
+    resp = _download(headers={'Range': 'bytes=10-19'})
+    pkunit.pkeq(206, resp.status_code)
+    pkunit.pkeq(whole[10:20], resp.get_data())
+    pkunit.pkeq('bytes 10-19/{}'.format(len(whole)), resp.headers['Content-Range'])
+
+
+def test_csv_rows_not_found():
+    from pykern import pkunit
+    from sirepo.template import sdds_util
+    import werkzeug.exceptions
+
+    with pkunit.save_chdir_work():
+        with pytest.raises(werkzeug.exceptions.NotFound):
+            sdds_util.csv_rows('no-such-file.sdds')
 
 
 def test_srw():
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.simulation_db
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_simulation_index():
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    sim_type = 'srw'
+    rows = fc.sr_post('listSimulations', {'simulationType': sim_type})
+    pkok(len(rows) > 1, '{}: expecting examples', rows)
+    d = pkio.sorted_glob(simulation_db.user_dir_name('*').join(sim_type))[0]
+    index = simulation_db.read_json(d.join(simulation_db.SIMULATION_INDEX_FILE))
+    pkeq(sorted(r.simulationId for r in rows), sorted(index.keys()))
+    # Modified outside of the server so the entry must be revalidated
+    sid = rows[0].simulationId
+    fn = d.join(sid, simulation_db.SIMULATION_DATA_FILE)
+    data = simulation_db.read_json(fn)
+    data.models.simulation.name = 'index test'
+    simulation_db.write_json(fn, data)
+    fn.setmtime(fn.mtime() + 10)
+    rows = fc.sr_post('listSimulations', {'simulationType': sim_type})
+    pkeq(
+        'index test',
+        [r.name for r in rows if r.simulationId == sid][0],
+    )
+    fc.sr_post(
+        'deleteSimulation',
+        {'simulationType': sim_type, 'simulationId': sid},
+    )
+    index = simulation_db.read_json(d.join(simulation_db.SIMULATION_INDEX_FILE))
+    pkok(sid not in index, '{}: deleted simulation still in index', sid)
+
+
+def test_simulations_using_file():
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    fc.sr_post('listSimulations', {'simulationType': 'srw'})
+    res = fc.sr_post(
+        'deleteFile',
+        {'simulationType': 'srw', 'fileName': 'mirror2_1d.dat', 'fileType': 'mirror'},
+    )
+    pkok(res.get('error'), '{}: file in use was deleted', res)
+    pkeq(
+        ['Gaussian X-ray beam through a Beamline containing Imperfect Mirrors'],
+        [f.split('/')[-1] for f in res.fileList],
+    )
+
+
+def test_global_index(monkeypatch):
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    sim_type = 'srw'
+    rows = fc.sr_post('listSimulations', {'simulationType': sim_type})
+    pkok(simulation_db.rebuild_global_index() >= len(rows), 'missing simulations in index')
+    sid = rows[0].simulationId
+    p = simulation_db.find_global_simulation(sim_type, sid)
+    pkok(p and p.endswith(sid), '{}: unexpected path for sid={}', p, sid)
+    i = simulation_db._global_index_path(sim_type, sid)
+    c = simulation_db._global_index_dir().join(simulation_db._GLOBAL_INDEX_COMPLETE_FILE)
+    pkok(c.check(file=True), '{}: index not marked complete', c)
+
+    def _no_glob(*args, **kwargs):
+        raise AssertionError('user directories searched')
+
+    # complete index: misses and new ids never search user directories
+    monkeypatch.setattr(simulation_db.glob, 'glob', _no_glob)
+    pkeq(None, simulation_db.find_global_simulation(sim_type, 'zzzzzzzz'))
+    r = fc.sr_post(
+        'newSimulation',
+        {'simulationType': sim_type, 'name': 'global index', 'folder': '/'},
+    )
+    n = r.models.simulation.simulationId
+    pkok(
+        simulation_db.find_global_simulation(sim_type, n),
+        '{}: new simulation not in index',
+        n,
+    )
+    pkio.unchecked_remove(i)
+    pkeq(None, simulation_db.find_global_simulation(sim_type, sid))
+    monkeypatch.undo()
+    # index not built yet: written without updating the index
+    pkio.unchecked_remove(c)
+    pkeq(p, simulation_db.find_global_simulation(sim_type, sid))
+    pkok(i.check(file=True), '{}: index entry not repaired', i)
+    pkeq(None, simulation_db.find_global_simulation(sim_type, 'zzzzzzzz'))
+    simulation_db.rebuild_global_index()
+    fc.sr_post(
+        'deleteSimulation',
+        {'simulationType': sim_type, 'simulationId': sid},
+    )
+    pkeq(None, simulation_db.find_global_simulation(sim_type, sid))
+
+
+def test_create_examples(monkeypatch):
+    from pykern import pkcollections
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    sim_type = 'hellweg'
+    sr_unit.flask_client()
+    n = len(simulation_db.examples(sim_type))
+    examples = simulation_db.examples
+
+    def _bad_example(*args, **kwargs):
+        # fails after the other examples are written
+        return examples(*args, **kwargs) + [pkcollections.Dict()]
+
+    res = []
+
+    def _op():
+        u = simulation_db._user_dir()
+        try:
+            simulation_db.simulation_dir(sim_type)
+            res.append(None)
+        except Exception as e:
+            res.append(e)
+        res.append(list(pkio.sorted_glob(u.join('*{}*'.format(sim_type)))))
+        res.append(list(pkio.sorted_glob(u.join('.{}.*'.format(sim_type)))))
+
+    monkeypatch.setattr(simulation_db, 'examples', _bad_example)
+    sr_unit.test_in_request(_op)
+    pkok(res[0], 'example creation did not fail')
+    pkeq([], res[1] + res[2], 'failed creation left directories')
+    monkeypatch.setattr(simulation_db, 'examples', examples)
+    del res[:]
+    sr_unit.test_in_request(_op)
+    pkeq(None, res[0])
+    pkeq(
+        n,
+        len(list(pkio.sorted_glob(res[1][0].join('*', simulation_db.SIMULATION_DATA_FILE)))),
+        '{}: retry did not create all examples',
+        res[1][0],
+    )
+
+
+def test_report_info():
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    from sirepo.template import template_common
+
+    fc = sr_unit.flask_client()
+    data = fc.sr_sim_data('srw', "Young's Double Slit Experiment")
+    data.report = 'intensityReport'
+    data.simulationId = data.models.simulation.simulationId
+    res = []
+
+    def _op():
+        d = pkio.mkdir_parent(simulation_db.simulation_run_dir(data, remove_dir=True))
+        simulation_db.write_run_input(data, d)
+        i = d.join(template_common.INPUT_BASE_NAME + simulation_db.JSON_SUFFIX)
+        t = i.read()
+        # polls only read the summary
+        i.write('{')
+        res.append(simulation_db.report_info(data))
+        data.models.intensityReport.photonEnergyPointCount = 9999
+        data.pop('reportParametersHash')
+        res.append(simulation_db.report_info(data))
+        # run dirs without a summary are read from in.json
+        i.write(t)
+        d.join(simulation_db.RUN_INFO_FILE).remove()
+        res.append(simulation_db.report_info(data))
+
+    sr_unit.test_in_request(_op)
+    pkeq(True, res[0].cache_hit)
+    pkeq(simulation_db.job_id(data), res[0].cached_data.jobId)
+    pkok(res[0].start_time, 'startTime not in summary')
+    pkeq(False, res[1].cache_hit)
+    pkeq(True, res[1].parameters_changed)
+    pkeq(True, res[2].parameters_changed)
+    pkeq(res[0].cached_hash, res[2].cached_hash)
+
+
+def test_json_cache():
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    sr_unit.flask_client()
+    with pkunit.save_chdir_work():
+        simulation_db.write_json('cache', {'a': [1, {'b': 2}]})
+        prev = simulation_db.json_cache_stats()
+        d = simulation_db.read_json('cache')
+        d.a[1].b = 3
+        pkeq(2, simulation_db.read_json('cache').a[1].b)
+        s = simulation_db.json_cache_stats()
+        pkeq(prev.misses + 1, s.misses)
+        pkeq(prev.hits + 1, s.hits)
+        simulation_db.write_json('cache', {'a': 4})
+        pkeq(4, simulation_db.read_json('cache').a)
+
+
+def test_user_accessed(monkeypatch):
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    sr_unit.flask_client()
+    monkeypatch.setattr(simulation_db, '_USER_ACCESS_MAX', 3)
+    monkeypatch.setattr(simulation_db, '_user_access', {})
+    for i in range(10):
+        # no such users, so only recorded in _user_access
+        simulation_db.user_accessed('nouser{:02d}'.format(i))
+        pkok(len(simulation_db._user_access) <= 3, 'unbounded _user_access')
+    pkeq(True, 'nouser09' in simulation_db._user_access)
+
+
+def test_result_arrays():
+    from pykern import pkunit
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import simulation_db
+
+    with pkunit.save_chdir_work() as d:
+        z = [[float(i * j) for i in range(100)] for j in range(50)]
+        simulation_db.write_result({'z_matrix': z, 'title': 'x', 'x_range': [0, 1, 2]})
+        pkok(d.join('out.npz').check(file=True), 'expecting arrays file')
+        j = simulation_db.read_json('out.json')
+        pkeq({simulation_db._RESULT_ARRAY_KEY: 'a0'}, j.z_matrix)
+        res, err = simulation_db.read_result(d)
+        pkeq(None, err)
+        pkeq(z, res.z_matrix)
+        pkeq([0, 1, 2], res.x_range)
+        pkeq('completed', res.state)
+
+
+def test_celery_queue(monkeypatch):
+    from pykern.pkunit import pkeq
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+
+    fc = sr_unit.flask_client()
+    data = fc.sr_sim_data('srw', "Young's Double Slit Experiment")
+    data.report = 'intensityReport'
+    # cost lanes are off unless configured
+    pkeq('sequential', simulation_db.celery_queue(data))
+    monkeypatch.setattr(simulation_db.cfg, 'cost_fast_max', 1e15)
+    pkeq('fast', simulation_db.celery_queue(data))
+    monkeypatch.setattr(simulation_db.cfg, 'cost_fast_max', 0.0)
+    monkeypatch.setattr(simulation_db.cfg, 'cost_heavy_min', 1.0)
+    pkeq('heavy', simulation_db.celery_queue(data))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+u"""test runStatusWait and sirepo.status_watcher
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_run_status_wait(monkeypatch):
+    from pykern import pkio
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import server
+    from sirepo import simulation_db
+    from sirepo import sr_unit
+    from sirepo import status_watcher
+    import threading
+    import time
+
+    fc = sr_unit.flask_client()
+    sim_type = 'srw'
+    data = fc.sr_sim_data(sim_type, "Young's Double Slit Experiment")
+    data.report = 'intensityReport'
+    d = []
+    # needs the session user
+    sr_unit.test_in_request(lambda: d.append(simulation_db.simulation_run_dir(data)))
+    run_dir = pkio.mkdir_parent(d[0])
+    monkeypatch.setattr(status_watcher.cfg, 'wait_seconds', 2)
+    monkeypatch.setattr(status_watcher.cfg, 'poll_seconds', 0.1)
+    status = {'percentComplete': 10}
+    calls = []
+
+    def _status(data, quiet=False):
+        calls.append(1)
+        return {
+            'nextRequest': {},
+            'percentComplete': status['percentComplete'],
+            'state': 'running',
+        }
+
+    monkeypatch.setattr(server, '_simulation_run_status', _status)
+    req = {
+        'lastStatus': {'percentComplete': 10, 'state': 'running'},
+        'report': data.report,
+        'simulationId': data.models.simulation.simulationId,
+        'simulationType': sim_type,
+    }
+    # no change: times out without reading the status over and over
+    s = time.time()
+    res = fc.sr_post('runStatusWait', req)
+    pkok(time.time() - s >= 1.9, 'returned before wait_seconds')
+    pkeq(10, res.percentComplete)
+    pkeq(1, len(calls), 'status read again without a change')
+
+    def _progress():
+        time.sleep(0.5)
+        status['percentComplete'] = 20
+        simulation_db.write_status('running', run_dir)
+
+    t = threading.Thread(target=_progress)
+    t.start()
+    s = time.time()
+    res = fc.sr_post('runStatusWait', req)
+    t.join()
+    pkok(time.time() - s < 1.9, 'change did not wake the waiter')
+    pkeq(20, res.percentComplete)
+
+
+def test_many_waiters(monkeypatch):
+    from pykern import pkunit
+    from pykern.pkunit import pkeq, pkok
+    from sirepo import status_watcher
+    import threading
+    import time
+
+    monkeypatch.setattr(status_watcher.cfg, 'max_waiters', 3)
+    monkeypatch.setattr(status_watcher.cfg, 'poll_seconds', 0.1)
+    with pkunit.save_chdir_work() as d:
+        s = status_watcher.signature(d)
+        res = []
+
+        def _wait():
+            res.append(status_watcher.wait(d, s, 5))
+
+        t = [threading.Thread(target=_wait) for _ in range(3)]
+        for x in t:
+            x.start()
+        time.sleep(0.3)
+        pkeq(3, status_watcher._waiters)
+        # over max_waiters: the client polls
+        b = time.time()
+        pkeq(False, status_watcher.wait(d, s, 5))
+        pkok(time.time() - b < 1, 'extra waiter must not wait')
+        d.join('status').write('running')
+        for x in t:
+            x.join(5)
+        pkeq([True, True, True], res)
+        pkeq(0, status_watcher._waiters)
+        pkeq({}, status_watcher._watched)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+u"""test sirepo.zygote
+
+:copyright: Copyright (c) 2018 RadiaSoft LLC.  All Rights Reserved.
+:license: http://www.apache.org/licenses/LICENSE-2.0.html
+"""
+from __future__ import absolute_import, division, print_function
+import pytest
+pytest.importorskip('srwl_bl')
+
+
+def test_fork_exit(monkeypatch):
+    from pykern import pkunit
+    from pykern.pkunit import pkeq
+    from sirepo import zygote
+    from sirepo.template import template_common
+    import json
+    import os
+    import time
+
+    class _Pkcli(object):
+
+        @staticmethod
+        def main(root_pkg, argv):
+            # sys.stdout may be captured by pytest
+            os.write(1, ' '.join([root_pkg] + argv).encode() + b'\n')
+            return 3
+
+    monkeypatch.setattr(zygote, '_children', {})
+    monkeypatch.setattr(zygote, '_exited', [])
+    with pkunit.save_chdir_work() as d:
+        r, w = os.pipe()
+        try:
+            zygote._fork(
+                {'cmd': ['sirepo', 'srw', 'run'], 'id': 7, 'run_dir': str(d)},
+                w,
+                _Pkcli,
+                (r,),
+            )
+            for _ in range(50):
+                zygote._sigchld_handler()
+                if zygote._exited:
+                    break
+                time.sleep(.1)
+            else:
+                pkunit.pkfail('child not reaped')
+            zygote._send_exits(w)
+            m = [json.loads(l) for l in os.read(r, 1024).decode().splitlines()]
+        finally:
+            os.close(r)
+            os.close(w)
+        pkeq(7, m[0]['id'])
+        pkeq({'id': 7, 'returncode': 3}, m[1])
+        pkeq({}, zygote._children)
+        pkeq('sirepo srw run\n', d.join(template_common.RUN_LOG).read())
+
+
+def test_process_poll():
+    from pykern import pkcollections
+    from pykern.pkunit import pkeq
+    from sirepo import zygote
+    import subprocess
+
+    c = pkcollections.Dict(closed=False, returncodes={})
+    p = zygote.Process(1, 1, c)
+    pkeq(None, p.poll())
+    c.returncodes[1] = -15
+    pkeq(-15, p.poll())
+    pkeq({}, c.returncodes)
+    # zygote died and the job exited, so only the pid is left
+    x = subprocess.Popen(['true'])
+    x.wait()
+    c.closed = True
+    pkeq(1, zygote.Process(x.pid, 2, c).poll())